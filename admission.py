@@ -0,0 +1,160 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import REGISTRY
+
+# header with the client address set by the reverse proxy, empty means the connection's peer address
+CLIENT_IP_HEADER = os.environ.get("CLIENT_IP_HEADER", "")
+
+SHED_REQUESTS = REGISTRY.counter("nip57_shed_requests_total", "Invoice requests turned away before any LND call",
+                                 ("reason",))
+
+
+class TokenBucketLimiter:
+    """
+    One token bucket per key: rate tokens per sec, at most burst. A key costs one small list in an
+    OrderedDict kept in last use order, so evict_idle() only looks at the oldest keys. A key idle for
+    burst / rate secs has a full bucket again and is dropped, max_keys bounds the memory under a flood of keys.
+    """
+
+    def __init__(self, name: str, rate: float, burst: float, max_keys: int):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        # key -> [tokens, last update]
+        self._buckets: OrderedDict[str, list] = OrderedDict()
+        self.limited = 0
+
+    def allow(self, key: str, now: float = None) -> bool:
+        if self.rate <= 0:
+            return True
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = [self.burst, now]
+                self._buckets[key] = bucket
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+                self._buckets.move_to_end(key)
+            if bucket[0] < 1:
+                self.limited += 1
+                return False
+            bucket[0] -= 1
+            return True
+
+    def evict_idle(self, now: float = None) -> int:
+        if now is None:
+            now = time.monotonic()
+        refill_secs = self.burst / self.rate if self.rate > 0 else 0
+        evicted = 0
+        with self._lock:
+            while self._buckets:
+                key, bucket = next(iter(self._buckets.items()))
+                if now - bucket[1] < refill_secs:
+                    break
+                del self._buckets[key]
+                evicted += 1
+        return evicted
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def stats(self) -> dict:
+        return {"rate": self.rate, "burst": self.burst, "keys": len(self._buckets), "limited": self.limited}
+
+
+class AdmissionControl:
+    """
+    Decides early whether an invoice request gets served: token buckets per client IP and username
+    before anything is decoded, one per 9734 pubkey once the signature checked out, and a cap on
+    LND calls in flight. A request over a limit is answered at once (429, or 503 if LND is saturated)
+    instead of queueing up for CPU, LND and a cache slot. A rate of 0 switches a limiter off.
+    """
+    # off by default without CLIENT_IP_HEADER: behind a reverse proxy all clients would share the proxy's bucket
+    IP_RATE = float(os.environ.get("RATE_LIMIT_IP_RATE", 2 if CLIENT_IP_HEADER != "" else 0))
+    IP_BURST = float(os.environ.get("RATE_LIMIT_IP_BURST", 20))
+    USER_RATE = float(os.environ.get("RATE_LIMIT_USER_RATE", 20))
+    USER_BURST = float(os.environ.get("RATE_LIMIT_USER_BURST", 100))
+    PUBKEY_RATE = float(os.environ.get("RATE_LIMIT_PUBKEY_RATE", 1))
+    PUBKEY_BURST = float(os.environ.get("RATE_LIMIT_PUBKEY_BURST", 10))
+    MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", 100000))
+    MAX_LND_IN_FLIGHT = int(os.environ.get("MAX_LND_IN_FLIGHT", 64))  # 0 means no cap
+    EVICT_INTERVAL = float(os.environ.get("RATE_LIMIT_EVICT_INTERVAL", 60))
+
+    TOO_MANY = {"status": "ERROR", "reason": "Too many requests, try again later"}, 429
+    BUSY = {"status": "ERROR", "reason": "Server busy, try again later"}, 503
+
+    def __init__(self, logger: logging.Logger):
+        self._logger = logger
+        if self.IP_RATE > 0 and CLIENT_IP_HEADER == "":
+            logger.warning("RATE_LIMIT_IP_RATE is on without CLIENT_IP_HEADER: behind a reverse proxy all clients "
+                           "share the proxy's address and its one rate limit")
+        self.by_ip = TokenBucketLimiter("ip", self.IP_RATE, self.IP_BURST, self.MAX_KEYS)
+        self.by_user = TokenBucketLimiter("username", self.USER_RATE, self.USER_BURST, self.MAX_KEYS)
+        self.by_pubkey = TokenBucketLimiter("pubkey", self.PUBKEY_RATE, self.PUBKEY_BURST, self.MAX_KEYS)
+        self._lnd_slots = threading.BoundedSemaphore(self.MAX_LND_IN_FLIGHT) if self.MAX_LND_IN_FLIGHT > 0 else None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.shed: dict[str, int] = {"ip": 0, "username": 0, "pubkey": 0, "lnd_busy": 0}
+
+    def _shed(self, reason: str):
+        with self._lock:
+            self.shed[reason] += 1
+        SHED_REQUESTS.labels(reason).inc()
+
+    def admit(self, client_ip: str | None, username: str):
+        """
+        :return: None, or the error response if the client or username is over its rate
+        """
+        if client_ip is not None and not self.by_ip.allow(client_ip):
+            self._shed("ip")
+            return self.TOO_MANY
+        if not self.by_user.allow(username):
+            self._shed("username")
+            return self.TOO_MANY
+        return None
+
+    def admit_pubkey(self, pubkey: str):
+        if not self.by_pubkey.allow(pubkey):
+            self._shed("pubkey")
+            return self.TOO_MANY
+        return None
+
+    def acquire_lnd(self):
+        """
+        Take one of the MAX_LND_IN_FLIGHT slots without waiting, release_lnd() gives it back.
+        :return: None, or the error response if all slots are taken
+        """
+        if self._lnd_slots is not None and not self._lnd_slots.acquire(blocking=False):
+            self._shed("lnd_busy")
+            return self.BUSY
+        with self._lock:
+            self.in_flight += 1
+        return None
+
+    def release_lnd(self):
+        with self._lock:
+            self.in_flight -= 1
+        if self._lnd_slots is not None:
+            self._lnd_slots.release()
+
+    def evict_idle(self):
+        evicted = sum(limiter.evict_idle() for limiter in (self.by_ip, self.by_user, self.by_pubkey))
+        self._logger.debug(f"Dropped {evicted} idle rate limit keys")
+
+    def stats(self) -> dict:
+        with self._lock:
+            shed = dict(self.shed)
+            in_flight = self.in_flight
+        return {"lnd_in_flight": in_flight, "max_lnd_in_flight": self.MAX_LND_IN_FLIGHT, "shed": shed,
+                "limiters": {limiter.name: limiter.stats() for limiter in (self.by_ip, self.by_user, self.by_pubkey)}}
@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import random
+import socket
+import ssl
+import time
+
+from aiohttp import ClientConnectorError, ClientError, ClientSession, ClientTimeout, TCPConnector, web
+
+try:
+    from aiohttp_socks import ProxyConnector
+except ImportError:
+    ProxyConnector = None
+
+from lnd_backend import LndBackend
+from lnd_client import LndClient
+from lnd_helper import LndHelper
+from zap_endpoints import METRICS_CONTENT_TYPE, ZapEndpoints, client_ip
+
+
+class AsyncLndClient:
+    """
+    aiohttp counterpart of LndClient for the invoice path: one pooled session per LND backend,
+    rebuilt when the backend's address, TLS setting or proxy changed (set_clearnet).
+    """
+
+    def __init__(self, logger: logging.Logger):
+        self._logger = logger
+        # backend name -> (config the session was built for, session)
+        self._sessions: dict[str, tuple[tuple, ClientSession]] = {}
+
+    @staticmethod
+    def _ssl(tls_verify):
+        if tls_verify is False:
+            return False
+        if tls_verify is True:
+            return None
+        return ssl.create_default_context(cafile=tls_verify)
+
+    def _session(self, backend: LndBackend) -> ClientSession:
+        config = (backend.restaddr, str(backend.tls_verify), backend.socks5h_proxy)
+        entry = self._sessions.get(backend.name)
+        if entry is not None and entry[0] == config:
+            return entry[1]
+        if entry is not None:
+            asyncio.get_running_loop().create_task(entry[1].close())
+        tls = self._ssl(backend.tls_verify)
+        if backend.socks5h_proxy:
+            if ProxyConnector is None:
+                raise RuntimeError("SERVER_MODE=async with SOCKS5H_PROXY needs the aiohttp-socks package")
+            # socks5h means the proxy resolves the host name, which is rdns for aiohttp-socks
+            connector = ProxyConnector.from_url(backend.socks5h_proxy.replace("socks5h://", "socks5://"),
+                                                rdns=True, ssl=tls, limit=LndClient.POOL_SIZE)
+        else:
+            connector = TCPConnector(ssl=tls, limit=LndClient.POOL_SIZE)
+        timeout = ClientTimeout(sock_connect=LndClient.CONNECT_TIMEOUT, sock_read=LndClient.READ_TIMEOUT)
+        session = ClientSession(base_url=backend.restaddr, connector=connector, timeout=timeout)
+        self._sessions[backend.name] = (config, session)
+        return session
+
+    async def post(self, backend: LndBackend, path: str, headers: dict, data: str) -> tuple[int, dict, dict]:
+        """
+        POST with retries on connect errors only, like LndClient.
+        :return: status, json body and headers of the response
+        """
+        for attempt in range(LndClient.RETRIES + 1):
+            try:
+                async with self._session(backend).post(path, headers=headers, data=data) as response:
+                    return response.status, await response.json(content_type=None), dict(response.headers)
+            except ClientConnectorError:
+                if attempt == LndClient.RETRIES:
+                    raise
+            await asyncio.sleep(LndClient.RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1))
+
+    async def close(self):
+        for _, session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+
+
+def _int_arg(request: web.Request, key: str) -> int | None:
+    try:
+        return int(request.query[key])
+    except (KeyError, ValueError):
+        return None
+
+
+def _json_response(result) -> web.Response:
+    if isinstance(result, tuple):
+        body, status = result
+    else:
+        body, status = result, 200
+    if status == 204:
+        return web.Response(status=204)
+    return web.json_response(body, status=status)
+
+
+def create_app(logger: logging.Logger, endpoints: ZapEndpoints, lnd_helper: LndHelper) -> web.Application:
+    lnd_client = AsyncLndClient(logger)
+
+    @web.middleware
+    async def cors(request: web.Request, handler):
+        response = await handler(request)
+        response.headers["Access-Control-Allow-Origin"] = "*"
+        return response
+
+    async def lnurlp(request: web.Request) -> web.Response:
+        cached, headers = endpoints.lnurlp(request.match_info["username"])
+        if cached.status == 200 and any(etag.value in (cached.etag, "*") for etag in request.if_none_match or ()):
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=cached.body, status=cached.status, headers=headers, content_type="application/json")
+
+    async def nostr_json(request: web.Request) -> web.Response:
+        return _json_response(endpoints.nostr_json(request.query.get("name")))
+
+    async def state(request: web.Request) -> web.Response:
+        # lnd_state uses the blocking client, keep it off the event loop
+        return _json_response(await asyncio.get_running_loop().run_in_executor(None, endpoints.state))
+
+    async def set_clearnet(request: web.Request) -> web.Response:
+        return _json_response(endpoints.set_clearnet(secret=request.query.get("secret"),
+                                                     ipv4=request.query.get("ipv4"),
+                                                     port=_int_arg(request, "port"),
+                                                     tls_verify=request.query.get("tls_verify")))
+
+    async def invoice(request: web.Request) -> web.Response:
+        username = request.match_info["username"]
+        amount = _int_arg(request, "amount")
+        # signature verification may block on the verifier pool, run it in a thread
+        response, zap_request, pool = await asyncio.get_running_loop().run_in_executor(
+            None, endpoints.check_invoice_request, username, amount, request.query.get("nostr"),
+            request.query.get("comment"), client_ip(request.headers, request.remote))
+        if response is not None:
+            return _json_response(response)
+        bech32_invoice, issuer, completed = "", None, None
+        try:
+            try:
+                for backend in lnd_helper.invoice_attempts(pool):
+                    headers, json_data = lnd_helper.invoice_request(amount, zap_request.raw, backend)
+                    start = time.perf_counter()
+                    try:
+                        status, body, response_headers = await lnd_client.post(backend, "/v1/invoices", headers,
+                                                                               json_data)
+                    except (ClientError, asyncio.TimeoutError, ValueError) as e:
+                        lnd_helper.invoice_failed(backend, time.perf_counter() - start, e)
+                        continue
+                    bech32_invoice = lnd_helper.invoice_response(backend, status, body, response_headers,
+                                                                 time.perf_counter() - start)
+                    if bech32_invoice != "":
+                        issuer = backend
+                        break
+            finally:
+                endpoints.release_lnd()
+            # caching the invoice and the dedup entry may be round trips to the shared store, keep them off the
+            # event loop
+            completed = await asyncio.get_running_loop().run_in_executor(
+                None, endpoints.complete_invoice, bech32_invoice, zap_request, amount, issuer)
+        finally:
+            if completed is None:
+                endpoints.abandon_invoice(zap_request, amount)
+        return _json_response(completed)
+
+    async def metrics(request: web.Request) -> web.Response:
+        body, status = endpoints.metrics()
+        if status != 200:
+            return _json_response((body, status))
+        return web.Response(text=body, headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+    async def close_client(app: web.Application):
+        await lnd_client.close()
+
+    app = web.Application(middlewares=[cors])
+    app.router.add_get('/.well-known/lnurlp/{username}', lnurlp)
+    app.router.add_get('/.well-known/nostr.json', nostr_json)
+    app.router.add_get('/lnurlp/state', state)
+    app.router.add_get('/lnurlp/set_clearnet', set_clearnet)
+    app.router.add_get('/lnurlp/invoice/{username}', invoice)
+    app.router.add_get('/metrics', metrics)
+    app.on_cleanup.append(close_client)
+    return app
+
+
+def serve_async(logger: logging.Logger, endpoints: ZapEndpoints, lnd_helper: LndHelper, host: str, port: int,
+                sock: socket.socket = None):
+    """
+    Serve the same routes as the Flask app on an asyncio event loop. Invoice requests wait for LND
+    without holding a thread, so the number of requests in flight is not capped by a thread pool.
+    :param sock: listening socket to serve on, maybe shared with other workers, instead of host and port
+    """
+    app = create_app(logger, endpoints, lnd_helper)
+    if sock is not None:
+        logger.info(f"Serving async on the listening socket {sock.getsockname()}")
+        web.run_app(app, sock=sock, print=None, access_log=None)
+        return
+    logger.info(f"Serving async on http://{host}:{port}")
+    web.run_app(app, host=host, port=int(port), print=None, access_log=None)
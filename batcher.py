@@ -0,0 +1,77 @@
+import logging
+import queue
+import threading
+import time
+from typing import Callable
+
+_STOP = object()
+
+
+class Batcher:
+    """
+    Coalesces items handed in from any thread: a worker thread takes the first item, waits up to
+    window secs for more (at most max_batch in all) and passes them to process() in one call. A burst
+    becomes a few large batches, a lone item waits at most window secs. With window 0 a batch is
+    whatever is queued at that moment.
+    """
+
+    def __init__(self, logger: logging.Logger, name: str, process: Callable[[list], None], window: float,
+                 max_batch: int):
+        self._logger = logger
+        self._name = name
+        self._process = process
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self.batches = 0
+        self.items = 0
+
+    def add(self, item):
+        if self._thread is None:
+            self._start()
+        self._queue.put(item)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    remaining = deadline - time.monotonic()
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self.batches += 1
+            self.items += len(batch)
+            try:
+                self._process(batch)
+            except Exception:
+                self._logger.exception(f"Processing a batch of {len(batch)} in {self._name} failed")
+
+    def close(self, timeout: float = 5):
+        """
+        Process what is queued, then stop the worker thread.
+        """
+        thread = self._thread
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "items": self.items, "queued": self._queue.qsize()}
@@ -0,0 +1,90 @@
+"""
+Per request decode cost of a kind 9734 event: the old path (unquote twice, json.loads three times,
+linear tag scans) against decoding once into a ZapRequest. Signature verification is left out, it is
+the same on both paths.
+Run from the repo root: python benchmarks/bench_9734_parsing.py [n]
+"""
+import json
+import os
+import sys
+import time
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import zap_request  # noqa: E402
+from zap_request import ZapRequest  # noqa: E402
+
+EVENT = {"id": "c" * 64, "pubkey": "d" * 64, "created_at": 1700000000, "kind": 9734, "content": "Great post!",
+         "tags": [["p", "a" * 64], ["e", "e" * 64], ["amount", "21000"], ["lnurl", "lnurl1" + "x" * 80],
+                  ["relays", "wss://nostr.mom/", "wss://nos.lol/", "wss://relay.damus.io/", "wss://relay.snort.social/"]],
+         "sig": "b" * 128}
+ENCODED = urllib.parse.quote_plus(json.dumps(EVENT))
+
+
+def _count_tag(tags, tag):
+    n = 0
+    for inner_tags in tags:
+        if inner_tags[0] == tag:
+            n += 1
+    return n
+
+
+def _get_tag(tags, tag):
+    for inner_tags in tags:
+        if inner_tags[0] == tag:
+            return inner_tags
+    return []
+
+
+def old_path(encoded: str):
+    # check_9734_event
+    nostr = json.loads(urllib.parse.unquote_plus(encoded))
+    _count_tag(nostr["tags"], "p")
+    _count_tag(nostr["tags"], "e")
+    if _count_tag(nostr["tags"], "amount") == 1:
+        int(_get_tag(nostr["tags"], "amount")[1])
+    # invoice(): fetch_invoice and cache_payment each unquote again
+    raw = urllib.parse.unquote_plus(encoded)
+    urllib.parse.unquote_plus(encoded)
+    # confirm_payment
+    nostr_9734 = json.loads(raw)
+    _get_tag(nostr_9734["tags"], "p")
+    if _count_tag(nostr_9734["tags"], "e") == 1:
+        _get_tag(nostr_9734["tags"], "e")
+    if _count_tag(nostr_9734["tags"], "a") == 1:
+        _get_tag(nostr_9734["tags"], "a")
+    # get_relays_from_9734
+    relays_9734 = json.loads(raw)
+    if _count_tag(relays_9734["tags"], "relays") == 1:
+        _get_tag(relays_9734["tags"], "relays")[1:]
+
+
+def new_path(encoded: str):
+    zap = ZapRequest.from_json(urllib.parse.unquote_plus(encoded))
+    zap.count_tag("p")
+    zap.count_tag("e")
+    if zap.count_tag("amount") == 1:
+        int(zap.get_tag("amount")[1])
+    zap.get_tag("p")
+    if zap.count_tag("e") == 1:
+        zap.get_tag("e")
+    if zap.count_tag("a") == 1:
+        zap.get_tag("a")
+    zap.relays()
+
+
+def bench(fn, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        fn(ENCODED)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    old = bench(old_path, n)
+    new = bench(new_path, n)
+    print(f"json backend: {zap_request._loads.__module__}")
+    print(f"old path {old:7.2f} us/request")
+    print(f"new path {new:7.2f} us/request  ({(old - new) / old * 100:.0f}% saved)")
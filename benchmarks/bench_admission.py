@@ -0,0 +1,45 @@
+"""
+Token bucket limiter: cost per allow() for a hot key and for a flood of distinct keys, and memory per
+tracked key.
+Run from the repo root: python benchmarks/bench_admission.py [keys]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from admission import TokenBucketLimiter  # noqa: E402
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    keys = [f"{i >> 8 & 255}.{i & 255}.{i >> 16 & 255}.1" for i in range(n)]
+
+    limiter = TokenBucketLimiter("ip", 2, 20, n)
+    start = time.perf_counter()
+    for _ in range(n):
+        limiter.allow("10.0.0.1")
+    hot = (time.perf_counter() - start) / n * 1e9
+
+    limiter = TokenBucketLimiter("ip", 2, 20, n)
+    start = time.perf_counter()
+    for key in keys:
+        limiter.allow(key)
+    flood = (time.perf_counter() - start) / n * 1e9
+
+    limiter = TokenBucketLimiter("ip", 2, 20, n)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for key in keys:
+        limiter.allow(key)
+    per_key = (tracemalloc.get_traced_memory()[0] - before) / n
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    evicted = limiter.evict_idle(time.monotonic() + 3600)
+    evict = time.perf_counter() - start
+    print(f"allow() same key     {hot:.0f} ns")
+    print(f"allow() new keys     {flood:.0f} ns")
+    print(f"memory per key       {per_key:.0f} bytes (key string included)")
+    print(f"evicting {evicted} idle keys took {evict * 1000:.1f} ms")
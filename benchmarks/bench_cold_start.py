@@ -0,0 +1,129 @@
+"""
+Container cold start, as when an instance scaled to zero gets its first wallet callback: how long a
+nip57_server subprocess takes from exec to accepting connections (before that a wallet gets connection
+refused), to answering its first lnurlp request, to subscribing to the LND invoices, to its first invoice
+and to its first zap receipt at the relay, and its RSS after the first request and after the first
+receipt. Runs against a fake LND that settles every invoice 50 ms after handing it out and a fake relay,
+--runs times per mode, and reports medians.
+--repo runs the server of another checkout for comparison, e.g. after git worktree add /tmp/before HEAD~1
+Run from the repo root: python benchmarks/bench_cold_start.py --runs 5
+"""
+import argparse
+import json
+import os
+import secrets
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_lnd import FakeLnd  # noqa: E402
+from fake_relay import FakeRelay  # noqa: E402
+from load_test import REPO, RECIPIENT, stop_server  # noqa: E402
+from zap_events import invoice_query, make_zap_request  # noqa: E402
+
+AMOUNT = 21000
+
+
+def rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def wait_for(check, timeout: float, interval: float = 0.002) -> bool:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if check():
+            return True
+        time.sleep(interval)
+    return False
+
+
+def accepts(port: int) -> bool:
+    try:
+        socket.create_connection(("127.0.0.1", port), timeout=1).close()
+        return True
+    except OSError:
+        return False
+
+
+def run(mode: str, args, lnd: FakeLnd, relay: FakeRelay, relay_url: str, workdir: str) -> dict:
+    base = f"http://127.0.0.1:{args.port}"
+    env = dict(os.environ, SERVER_MODE=mode, SERVER_PORT=str(args.port), LND_RESTADDR=f"http://127.0.0.1:{args.lnd_port}",
+               SOCKS5H_PROXY="", ZAPPER_KEY=secrets.token_hex(32), INVOICE_MACAROON="00", TLS_VERIFY="false",
+               LNURL_ORIGIN=base, DEFAULT_RELAYS=relay_url, STATS_LOG_INTERVAL="0", PYTHONPATH=args.repo)
+    query = invoice_query(AMOUNT, make_zap_request(AMOUNT, RECIPIENT, [relay_url]))
+    receipts = len(relay.receipts)
+    log = open(os.path.join(workdir, f"server-{mode}.log"), "w")
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, os.path.join(args.repo, "nip57_server.py")], cwd=workdir, env=env,
+                              stdout=log, stderr=subprocess.STDOUT)
+    try:
+        if not wait_for(lambda: accepts(args.port), 30):
+            raise RuntimeError(f"server in mode {mode} did not come up, see {log.name}")
+        result = {"port": time.perf_counter() - start}
+        urllib.request.urlopen(f"{base}/.well-known/lnurlp/bench", timeout=30).read()
+        result["lnurlp"] = time.perf_counter() - start
+        result["rss_first"] = rss_mb(server.pid)
+        wait_for(lambda: lnd.stats()["subscribers"] > 0, 30)
+        result["subscribed"] = time.perf_counter() - start
+        body = json.loads(urllib.request.urlopen(f"{base}/lnurlp/invoice/bench?{query}", timeout=30).read())
+        if body.get("status") != "OK":
+            raise RuntimeError(f"invoice request failed: {body}")
+        result["invoice"] = time.perf_counter() - start
+        if not wait_for(lambda: len(relay.receipts) > receipts, 30):
+            raise RuntimeError(f"no zap receipt reached the relay, see {log.name}")
+        result["receipt"] = time.perf_counter() - start
+        result["rss_receipt"] = rss_mb(server.pid)
+        return result
+    finally:
+        stop_server(server)
+        log.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="cold starts per mode")
+    parser.add_argument("--modes", default="threads,async")
+    parser.add_argument("--repo", default=REPO, help="checkout whose nip57_server.py to start")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--lnd-port", type=int, default=18090)
+    parser.add_argument("--relay-port", type=int, default=18190)
+    args = parser.parse_args()
+    args.repo = os.path.abspath(args.repo)
+
+    # paid right after the invoice is out, a wallet takes longer
+    lnd = FakeLnd(0.0, settle_rate=1.0, settle_delay=0.05)
+    lnd.start(args.lnd_port)
+    relay = FakeRelay()
+    relay.start(args.relay_port)
+    relay_url = f"ws://127.0.0.1:{args.relay_port}/"
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        with open(os.path.join(workdir, "users.json"), "w") as users_file:
+            json.dump({"bench": RECIPIENT}, users_file)
+        for mode in args.modes.split(","):
+            # the first start warms the page cache and writes the .pyc files, like a pulled image does
+            run(mode, args, lnd, relay, relay_url, workdir)
+            results[mode] = [run(mode, args, lnd, relay, relay_url, workdir) for _ in range(args.runs)]
+    relay.stop()
+    lnd.stop()
+
+    print(f"{args.repo}, median of {args.runs} cold starts, ms from exec")
+    print(f"{'':8} {'port open':>10} {'lnurlp':>8} {'subscribed':>11} {'invoice':>8} {'receipt':>8} {'RSS first MB':>13} "
+          f"{'RSS receipt MB':>15}")
+    for mode, runs in results.items():
+        def median(key: str) -> float:
+            return statistics.median(r[key] for r in runs)
+        print(f"{mode:8} {median('port') * 1000:>10.0f} {median('lnurlp') * 1000:>8.0f} {median('subscribed') * 1000:>11.0f} "
+              f"{median('invoice') * 1000:>8.0f} {median('receipt') * 1000:>8.0f} {median('rss_first'):>13.1f} "
+              f"{median('rss_receipt'):>15.1f}")
@@ -0,0 +1,72 @@
+"""
+Insert/lookup throughput of the pending invoice store against the plain dict it replaced.
+Run from the repo root: python benchmarks/bench_invoice_store.py [n]
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from invoice_store import PendingInvoiceStore, SqliteInvoiceBackend  # noqa: E402
+from zap_request import ZapRequest  # noqa: E402
+
+RAW_EVENT = '{"kind":9734,"content":"","tags":[["p","' + "a" * 64 + '"],["amount","21000"]],"sig":"' + "b" * 128 + '"}'
+EVENT = ZapRequest.from_json(RAW_EVENT)
+
+
+def bench_dict(n: int) -> tuple[float, float]:
+    cache = {}
+    start = time.perf_counter()
+    for i in range(n):
+        cache[str(i)] = {"timestamp": int(time.time()), "event": EVENT, "idx": str(i)}
+    insert = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(n):
+        if str(i) in cache:
+            del cache[str(i)]
+    lookup = time.perf_counter() - start
+    return insert, lookup
+
+
+def bench_store(n: int, store: PendingInvoiceStore) -> tuple[float, float]:
+    start = time.perf_counter()
+    for i in range(n):
+        store.put(str(i), EVENT)
+    insert = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(n):
+        store.pop(str(i))
+    lookup = time.perf_counter() - start
+    return insert, lookup
+
+
+def report(name: str, n: int, insert: float, lookup: float):
+    print(f"{name:<24} insert {n / insert:>12,.0f} ops/s   lookup+remove {n / lookup:>12,.0f} ops/s")
+
+
+if __name__ == '__main__':
+    logger = logging.getLogger("bench")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    report("dict (baseline)", n, *bench_dict(n))
+    report("PendingInvoiceStore", n, *bench_store(n, PendingInvoiceStore(logger, max_size=n)))
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = SqliteInvoiceBackend(logger, os.path.join(tmp, "invoices.db"))
+        store = PendingInvoiceStore(logger, max_size=n, backend=backend)
+        report("  + SqliteInvoiceBackend", n, *bench_store(n, store))
+        start = time.perf_counter()
+        store.close()
+        print(f"final flush of the write queue took {time.perf_counter() - start:.3f}s")
+        backend = SqliteInvoiceBackend(logger, os.path.join(tmp, "invoices.db"))
+        for i in range(n):
+            backend.record_put(str(i), int(time.time()), RAW_EVENT)
+        backend.flush()
+        store = PendingInvoiceStore(logger, max_size=n, backend=backend)
+        start = time.perf_counter()
+        loaded = store.warm_load()
+        print(f"warm load of {loaded} entries took {time.perf_counter() - start:.3f}s")
+        store.close()
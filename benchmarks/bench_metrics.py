@@ -0,0 +1,56 @@
+"""
+Cost per instrumented call with metrics disabled (METRICS_ENABLED=false, the null objects) and enabled,
+including the two perf_counter() calls a timed section makes.
+Run from the repo root: python benchmarks/bench_metrics.py [n]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import NullRegistry, Registry  # noqa: E402
+
+
+def per_call(func, n: int) -> float:
+    start = time.perf_counter()
+    func(n)
+    return (time.perf_counter() - start) / n * 1e9
+
+
+def bench(registry, n: int) -> dict:
+    counter = registry.counter("bench_total", "bench")
+    labelled = registry.counter("bench_labelled_total", "bench", ("relay",))
+    histogram = registry.histogram("bench_seconds", "bench", ("backend",))
+
+    def inc(n):
+        for _ in range(n):
+            counter.inc()
+
+    def labelled_inc(n):
+        for _ in range(n):
+            labelled.labels("wss://nos.lol/").inc()
+
+    def timed(n):
+        perf_counter = time.perf_counter
+        for _ in range(n):
+            start = perf_counter()
+            histogram.labels("default").observe(perf_counter() - start)
+
+    def baseline(n):
+        for _ in range(n):
+            pass
+
+    empty = per_call(baseline, n)
+    return {"counter.inc()": per_call(inc, n) - empty,
+            "labels().inc()": per_call(labelled_inc, n) - empty,
+            "timed observe": per_call(timed, n) - empty}
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    disabled = bench(NullRegistry(), n)
+    enabled = bench(Registry(), n)
+    print(f"{'ns per call':<16} {'disabled':>9} {'enabled':>9}")
+    for name in disabled:
+        print(f"{name:<16} {disabled[name]:>9.0f} {enabled[name]:>9.0f}")
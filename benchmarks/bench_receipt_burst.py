@@ -0,0 +1,98 @@
+"""
+A burst of zap receipts, as when a popular note gets zapped: N settlements handed to
+NostrHelper.confirm_payment at once, each receipt going to a few of a handful of fake relays that
+answer with a network-like latency. Compares receipts signed one by one and sent one EVENT per round
+trip (batches of 1) with the defaults (settlements coalesced, signed as a batch,
+several EVENTs per send). Reports receipts/sec, relay connections and sends per receipt and the delay
+from settlement to arrival at the relay.
+Run from the repo root: python benchmarks/bench_receipt_burst.py --settlements 1000
+"""
+import argparse
+import logging
+import os
+import random
+import secrets
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# read at import time
+os.environ.setdefault("ZAPPER_KEY", secrets.token_hex(32))
+os.environ["DEFAULT_RELAYS"] = ""
+
+from fake_relay import FakeRelay  # noqa: E402
+from load_test import RECIPIENT, percentile  # noqa: E402
+from nostr_helper import NostrHelper  # noqa: E402
+from relay_pool import ReceiptPublisher  # noqa: E402
+from zap_events import make_zap_request  # noqa: E402
+from zap_request import ZapRequest  # noqa: E402
+
+
+def bolt11_of(event: dict) -> str | None:
+    for tag in event.get("tags", []):
+        if len(tag) > 1 and tag[0] == "bolt11":
+            return tag[1]
+    return None
+
+
+def run(name: str, window: float, max_batch: int, send_batch: int, args, port: int) -> dict:
+    relays = [FakeRelay(args.latency) for _ in range(args.relays)]
+    urls = [f"ws://127.0.0.1:{port + i}/" for i in range(args.relays)]
+    for i, relay in enumerate(relays):
+        relay.start(port + i)
+    zap_requests = [ZapRequest.from_json(make_zap_request(21000, RECIPIENT, random.sample(urls, args.per_zap)))
+                    for _ in range(args.settlements)]
+    expected = args.settlements * args.per_zap
+
+    NostrHelper.RECEIPT_BATCH_WINDOW = window
+    NostrHelper.RECEIPT_BATCH_MAX = max_batch
+    ReceiptPublisher.SEND_BATCH = send_batch
+    helper = NostrHelper(logging.getLogger("bench"))
+    settled_at: dict[str, float] = {}
+    start = time.time()
+    for i, zap_request in enumerate(zap_requests):
+        invoice = {"payment_request": f"lnbcrt21u1burst{i}", "settle_date": str(int(time.time()))}
+        settled_at[invoice["payment_request"]] = time.time()
+        helper.confirm_payment(i, zap_request, invoice, time.monotonic())
+    deadline = time.time() + args.timeout
+    while sum(len(relay.receipts) for relay in relays) < expected and time.time() < deadline:
+        time.sleep(0.01)
+
+    arrivals = [(arrival, event) for relay in relays for arrival, event in relay.receipts]
+    delays = [arrival - settled_at[bolt11_of(event)] for arrival, event in arrivals]
+    elapsed = max(arrival for arrival, _ in arrivals) - start if arrivals else float("nan")
+    sends = sum(stats["sends"] for stats in helper.relay_stats()["relays"].values())
+    batches = helper.relay_stats()["batches"]["batches"]
+    connections = sum(relay.stats()["connections"] for relay in relays)
+    helper.close()
+    for relay in relays:
+        relay.stop()
+    return {"name": name, "delivered": len(arrivals), "expected": expected, "secs": elapsed,
+            "receipts_per_sec": args.settlements / elapsed, "connections": connections, "sends": sends,
+            "batches": batches, "p50": percentile(delays, 0.5), "p99": percentile(delays, 0.99)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--settlements", type=int, default=1000)
+    parser.add_argument("--relays", type=int, default=6, help="fake relays")
+    parser.add_argument("--per-zap", type=int, default=3, help="relays each zap request lists")
+    parser.add_argument("--latency", type=float, default=0.02, help="secs a relay takes to answer")
+    parser.add_argument("--timeout", type=float, default=300, help="secs to wait for all receipts")
+    parser.add_argument("--port", type=int, default=18200)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    print(f"{args.settlements} settlements, {args.per_zap} of {args.relays} relays each, "
+          f"relays answer after {args.latency * 1000:.0f} ms")
+    defaults = NostrHelper.RECEIPT_BATCH_WINDOW, NostrHelper.RECEIPT_BATCH_MAX, ReceiptPublisher.SEND_BATCH
+    results = [run("one by one", 0, 1, 1, args, args.port),
+               run("coalesced", *defaults, args, args.port + args.relays)]
+    print(f"{'':12} {'delivered':>10} {'secs':>7} {'receipts/s':>11} {'conn/receipt':>13} {'sends/receipt':>14} "
+          f"{'sign batches':>13} {'p50 ms':>8} {'p99 ms':>8}")
+    for r in results:
+        print(f"{r['name']:12} {r['delivered']:>5}/{r['expected']:<4} {r['secs']:>7.2f} {r['receipts_per_sec']:>11.0f} "
+              f"{r['connections'] / args.settlements:>13.4f} {r['sends'] / args.settlements:>14.3f} "
+              f"{r['batches']:>13} {r['p50'] * 1000:>8.0f} {r['p99'] * 1000:>8.0f}")
@@ -0,0 +1,66 @@
+"""
+Load time, memory and lookup rate of the users.json registry and the prebuilt lnurlp responses.
+Run from the repo root: python benchmarks/bench_user_registry.py [users]
+"""
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lnurlp_cache import LnurlpResponseCache  # noqa: E402
+from user_registry import UserRegistry  # noqa: E402
+
+
+def write_users(path: str, n: int):
+    users = {}
+    for i in range(n):
+        pubkey = f"{i:064x}"
+        if i % 10 == 0:
+            users[f"user{i}"] = {"pubkey": pubkey, "max_sendable": 100000000, "comment_allowed": 120}
+        else:
+            users[f"user{i}"] = pubkey
+    with open(path, "w") as users_file:
+        json.dump(users, users_file)
+
+
+if __name__ == '__main__':
+    logger = logging.getLogger("bench")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "users.json")
+        write_users(path, n)
+        print(f"users.json with {n} users, {os.path.getsize(path) / 1e6:.1f} MB")
+        registry = UserRegistry(logger, path, 1000, 1000000000)
+        cache = LnurlpResponseCache(logger, "https://lnurlp.example.com", registry.defaults, "a" * 64, "bench")
+        start = time.perf_counter()
+        registry.load()
+        loaded = time.perf_counter()
+        cache.load(registry.snapshot.users)
+        built = time.perf_counter()
+        print(f"registry load             {loaded - start:8.3f} s")
+        print(f"lnurlp prebuild           {built - loaded:8.3f} s")
+        # second round under tracemalloc, it slows down allocations a lot
+        tracemalloc.start()
+        registry.load()
+        cache.load(registry.snapshot.users)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"allocated by a reload     {current / 1e6:8.1f} MB (peak {peak / 1e6:.1f} MB)")
+        names = [f"user{i}" for i in range(0, n, 7)]
+        start = time.perf_counter()
+        for name in names:
+            registry.get(name)
+            cache.get(name)
+        elapsed = time.perf_counter() - start
+        print(f"lookups (registry+lnurlp) {len(names) / elapsed:8,.0f} /s")
+        start = time.perf_counter()
+        for _ in range(1000):
+            registry.check_for_changes()
+        print(f"mtime check               {(time.perf_counter() - start) * 1000:8.3f} us")
@@ -0,0 +1,217 @@
+"""
+Local stand-in for the LND REST interface: POST /v1/invoices, GET /v1/state and the streaming
+GET /v1/invoices/subscribe, with a configurable delay to mimic the Tor round trip.
+A settle_rate share of the invoices gets paid settle_delay secs after it was issued, the settlement
+is streamed to every subscriber and its time kept in settled_at by payment_request.
+GET /stats reports how many invoice requests were in flight at most.
+Run standalone: python benchmarks/fake_lnd.py --port 18080 --latency 2 --settle-rate 1 --settle-delay 1
+"""
+import argparse
+import collections
+import json
+import queue
+import random
+import secrets
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeLnd:
+
+    def __init__(self, latency: float = 0.0, settle_rate: float = 0.0, settle_delay: float = 1.0):
+        self.latency = latency
+        self.settle_rate = settle_rate
+        self.settle_delay = settle_delay
+        self.fail = False  # answer every request with 503, like an LND that is still starting
+        self.replay = False  # stream every settlement twice, like a subscription replaying after a reconnect
+        self._lock = threading.Lock()
+        self._add_index = 0
+        self._settle_index = 0
+        # (due, invoice) in due order, the delay is the same for all
+        self._to_settle: collections.deque = collections.deque()
+        self._settle_wakeup = threading.Event()
+        self._subscribers: set[queue.Queue] = set()
+        self.settled_at: dict[str, float] = {}
+        # stream lines of the settled invoices, in settle_index order
+        self._settled_lines: list[bytes] = []
+        self.to_settle = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.invoices = 0
+        self._server: ThreadingHTTPServer | None = None
+
+    def next_invoice(self, value_msat: int) -> dict:
+        with self._lock:
+            self._add_index += 1
+            self.invoices += 1
+            add_index = self._add_index
+        invoice = {"r_hash": secrets.token_hex(32), "add_index": str(add_index),
+                   "payment_request": f"lnbcrt{value_msat // 1000}u1fake{add_index}",
+                   "payment_addr": secrets.token_hex(32)}
+        if random.random() < self.settle_rate:
+            with self._lock:
+                self.to_settle += 1
+            self._to_settle.append((time.monotonic() + self.settle_delay, dict(invoice, value_msat=str(value_msat))))
+            self._settle_wakeup.set()
+        return invoice
+
+    def _settle_loop(self):
+        while self._server is not None:
+            if not self._to_settle:
+                self._settle_wakeup.wait(0.5)
+                self._settle_wakeup.clear()
+                continue
+            due, invoice = self._to_settle[0]
+            if due > time.monotonic():
+                time.sleep(min(due - time.monotonic(), 0.5))
+                continue
+            self._to_settle.popleft()
+            self.settle(invoice)
+
+    def settle(self, invoice: dict):
+        now = time.time()
+        with self._lock:
+            self._settle_index += 1
+            settled = dict(invoice, settled=True, state="SETTLED", settle_index=str(self._settle_index),
+                           settle_date=str(int(now)), amt_paid_msat=invoice["value_msat"])
+            self.settled_at[invoice["payment_request"]] = now
+            line = (json.dumps({"result": settled}) + "\n").encode()
+            self._settled_lines.append(line)
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.put(line)
+            if self.replay:
+                subscriber.put(line)
+
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"invoices": self.invoices, "in_flight": self.in_flight, "max_in_flight": self.max_in_flight,
+                    "settled": len(self.settled_at), "subscribers": len(self._subscribers)}
+
+    def reset(self):
+        with self._lock:
+            self.max_in_flight = self.in_flight
+            self.invoices = 0
+
+    def handler(self):
+        lnd = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _json(self, body: dict, status: int = 200):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if self.path != "/v1/invoices":
+                    return self._json({"message": "not found"}, 404)
+                if lnd.fail:
+                    return self._json({"message": "unavailable"}, 503)
+                lnd.enter()
+                try:
+                    time.sleep(lnd.latency)
+                    self._json(lnd.next_invoice(int(body.get("value_msat", 0))))
+                finally:
+                    lnd.leave()
+
+            def do_GET(self):
+                if self.path == "/v1/state":
+                    return self._json({"state": "SERVER_ACTIVE"} if not lnd.fail else {"message": "unavailable"},
+                                      503 if lnd.fail else 200)
+                if self.path == "/stats":
+                    return self._json(lnd.stats())
+                if self.path == "/reset":
+                    lnd.reset()
+                    return self._json({})
+                if self.path.startswith("/v1/invoices/subscribe"):
+                    return self._subscribe()
+                self._json({"message": "not found"}, 404)
+
+            def _subscribe(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+                lnd.serve_subscription(self, int(query.get("settle_index", ["0"])[0]))
+                self.close_connection = True
+
+        return Handler
+
+    def serve_subscription(self, handler: BaseHTTPRequestHandler, settle_index: int = 0):
+        """
+        Stream settlements, starting with those after settle_index like LND does (settle_index 0 means none).
+        Invoices added before the subscriber came are not replayed.
+        """
+        lines: queue.Queue = queue.Queue()
+        with self._lock:
+            if settle_index > 0:
+                for line in self._settled_lines[settle_index:]:
+                    lines.put(line)
+            self._subscribers.add(lines)
+        try:
+            while self._server is not None:
+                try:
+                    line = lines.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                handler.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                handler.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                self._subscribers.discard(lines)
+
+    def start(self, port: int) -> ThreadingHTTPServer:
+        ThreadingHTTPServer.request_queue_size = 1024
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self.handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        threading.Thread(target=self._settle_loop, name="fake-lnd-settler", daemon=True).start()
+        return self._server
+
+    def stop(self):
+        server, self._server = self._server, None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--latency", type=float, default=2.0, help="secs per invoice request")
+    parser.add_argument("--settle-rate", type=float, default=0.0, help="share of invoices that get paid")
+    parser.add_argument("--settle-delay", type=float, default=1.0, help="secs until an invoice is paid")
+    args = parser.parse_args()
+    fake = FakeLnd(args.latency, args.settle_rate, args.settle_delay)
+    fake.start(args.port)
+    print(f"fake LND on http://127.0.0.1:{args.port}, {args.latency}s per invoice, "
+          f"{args.settle_rate:.0%} settle after {args.settle_delay}s")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
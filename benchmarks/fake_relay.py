@@ -0,0 +1,197 @@
+"""
+Local stand-in for a nostr relay, stdlib only: accepts websocket connections, answers every EVENT
+with OK (NIP-20) and REQ with EOSE, and records the kind 9735 zap receipts with their arrival time.
+With a latency the replies go out that many secs late, like over a real network, while the relay
+keeps reading.
+Run standalone: python benchmarks/fake_relay.py --port 18100
+"""
+import argparse
+import base64
+import hashlib
+import json
+import queue
+import socketserver
+import struct
+import threading
+import time
+
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def _unmask(payload: bytes, mask: bytes) -> bytes:
+    n = len(payload)
+    key = (mask * (n // 4 + 1))[:n]
+    return (int.from_bytes(payload, "big") ^ int.from_bytes(key, "big")).to_bytes(n, "big")
+
+
+def _frame(opcode: int, payload: bytes) -> bytes:
+    n = len(payload)
+    if n < 126:
+        header = struct.pack("!BB", 0x80 | opcode, n)
+    elif n < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, n)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+    return header + payload
+
+
+class FakeRelay:
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._lock = threading.Lock()
+        # (arrival time, event) of every kind 9735
+        self.receipts: list[tuple[float, dict]] = []
+        self.events = 0
+        self.connections = 0
+        self._server: socketserver.ThreadingTCPServer | None = None
+
+    def record(self, event: dict):
+        with self._lock:
+            self.events += 1
+            if event.get("kind") == 9735:
+                self.receipts.append((time.time(), event))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"connections": self.connections, "events": self.events, "receipts": len(self.receipts)}
+
+    def handler(self):
+        relay = self
+
+        class Handler(socketserver.StreamRequestHandler):
+
+            def setup(self):
+                super().setup()
+                self._write_lock = threading.Lock()
+                self._delayed: queue.Queue | None = None
+                if relay.latency > 0:
+                    self._delayed = queue.Queue()
+                    threading.Thread(target=self._send_delayed, daemon=True).start()
+
+            def finish(self):
+                if self._delayed is not None:
+                    self._delayed.put(None)
+                super().finish()
+
+            def _send_delayed(self):
+                while True:
+                    job = self._delayed.get()
+                    if job is None:
+                        return
+                    due, payload = job
+                    time.sleep(max(due - time.monotonic(), 0))
+                    self._send(1, payload)
+
+            def handle(self):
+                if not self._handshake():
+                    return
+                with relay._lock:
+                    relay.connections += 1
+                message = b""
+                while True:
+                    frame = self._read_frame()
+                    if frame is None:
+                        return
+                    fin, opcode, payload = frame
+                    if opcode == 8:
+                        self._send(8, b"")
+                        return
+                    if opcode == 9:
+                        self._send(10, payload)
+                        continue
+                    if opcode in (0, 1, 2):
+                        message += payload
+                        if fin:
+                            self._on_message(message)
+                            message = b""
+
+            def _handshake(self) -> bool:
+                key = None
+                while True:
+                    line = self.rfile.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    if name.strip().lower() == "sec-websocket-key":
+                        key = value.strip()
+                if key is None:
+                    self.wfile.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+                    return False
+                accept = base64.b64encode(hashlib.sha1(key.encode() + WS_GUID).digest()).decode()
+                self.wfile.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                                  f"Connection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+                return True
+
+            def _read_frame(self) -> tuple[bool, int, bytes] | None:
+                head = self.rfile.read(2)
+                if len(head) < 2:
+                    return None
+                fin, opcode = head[0] & 0x80, head[0] & 0x0F
+                masked, n = head[1] & 0x80, head[1] & 0x7F
+                if n == 126:
+                    n = struct.unpack("!H", self.rfile.read(2))[0]
+                elif n == 127:
+                    n = struct.unpack("!Q", self.rfile.read(8))[0]
+                mask = self.rfile.read(4) if masked else None
+                payload = self.rfile.read(n)
+                if len(payload) < n:
+                    return None
+                return bool(fin), opcode, _unmask(payload, mask) if mask else payload
+
+            def _send(self, opcode: int, payload: bytes):
+                try:
+                    with self._write_lock:
+                        self.wfile.write(_frame(opcode, payload))
+                except (OSError, ValueError):
+                    pass
+
+            def _reply(self, message: list):
+                if self._delayed is not None:
+                    self._delayed.put((time.monotonic() + relay.latency, json.dumps(message).encode()))
+                    return
+                self._send(1, json.dumps(message).encode())
+
+            def _on_message(self, raw: bytes):
+                try:
+                    message = json.loads(raw)
+                except ValueError:
+                    return self._reply(["NOTICE", "invalid json"])
+                if not isinstance(message, list) or len(message) < 2:
+                    return self._reply(["NOTICE", "invalid message"])
+                if message[0] == "EVENT" and isinstance(message[1], dict):
+                    relay.record(message[1])
+                    self._reply(["OK", message[1].get("id", ""), True, ""])
+                elif message[0] == "REQ":
+                    self._reply(["EOSE", message[1]])
+
+        return Handler
+
+    def start(self, port: int) -> socketserver.ThreadingTCPServer:
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", port), self.handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server
+
+    def stop(self):
+        server, self._server = self._server, None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=18100)
+    parser.add_argument("--latency", type=float, default=0.0, help="secs until a reply goes out")
+    args = parser.parse_args()
+    fake = FakeRelay(args.latency)
+    fake.start(args.port)
+    print(f"fake relay on ws://127.0.0.1:{args.port}")
+    try:
+        while True:
+            time.sleep(10)
+            print(fake.stats())
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,116 @@
+"""
+Load test of the invoice endpoint against a local fake LND, in both server modes.
+Starts fake LND with --latency secs per invoice, then for each mode a nip57_server subprocess,
+fires --requests invoice requests with --concurrency parallel clients and reports latency
+percentiles and how many requests reached LND at the same time.
+Run from the repo root: python benchmarks/load_test.py --requests 200 --concurrency 100 --latency 1
+"""
+import argparse
+import json
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_lnd import FakeLnd  # noqa: E402
+from zap_events import invoice_query, make_zap_request  # noqa: E402
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RECIPIENT = "c" * 64
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def start_server(mode: str, port: int, lnd_port: int, workdir: str, extra_env: dict = None) -> subprocess.Popen:
+    # the load comes from one address, so rate limits are off unless set in the environment
+    env = dict({"RATE_LIMIT_IP_RATE": "0", "RATE_LIMIT_USER_RATE": "0", "MAX_LND_IN_FLIGHT": "0"}, **os.environ)
+    env.update(SERVER_MODE=mode, SERVER_PORT=str(port), LND_RESTADDR=f"http://127.0.0.1:{lnd_port}",
+               SOCKS5H_PROXY="", ZAPPER_KEY=secrets.token_hex(32), INVOICE_MACAROON="00", TLS_VERIFY="false",
+               LNURL_ORIGIN=f"http://127.0.0.1:{port}", PYTHONPATH=REPO, **(extra_env or {}))
+    log = open(os.path.join(workdir, f"server-{mode}.log"), "w")
+    server = subprocess.Popen([sys.executable, os.path.join(REPO, "nip57_server.py")], cwd=workdir, env=env,
+                              stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/.well-known/lnurlp/bench", timeout=1).read()
+            return server
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"server in mode {mode} did not come up, see {log.name}")
+
+
+def fire(url: str) -> tuple[float, bool]:
+    start = time.perf_counter()
+    try:
+        body = json.loads(urllib.request.urlopen(url, timeout=120).read())
+        ok = body.get("status") == "OK"
+    except (urllib.error.URLError, ConnectionError, ValueError):
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def stop_server(server: subprocess.Popen):
+    server.terminate()
+    try:
+        server.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def run(mode: str, args, lnd: FakeLnd, queries: list[str], workdir: str) -> dict:
+    port = args.port
+    server = start_server(mode, port, args.lnd_port, workdir)
+    try:
+        lnd.reset()
+        urls = [f"http://127.0.0.1:{port}/lnurlp/invoice/bench?{q}" for q in queries]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(fire, urls))
+        elapsed = time.perf_counter() - start
+    finally:
+        stop_server(server)
+    latencies = [latency for latency, ok in results if ok]
+    return {"mode": mode, "ok": len(latencies), "failed": len(results) - len(latencies),
+            "p50": percentile(latencies, 0.5) if latencies else 0, "p99": percentile(latencies, 0.99) if latencies else 0,
+            "rps": len(latencies) / elapsed, "max_in_flight": lnd.stats()["max_in_flight"]}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=1.0, help="fake LND secs per invoice")
+    parser.add_argument("--port", type=int, default=18090)
+    parser.add_argument("--lnd-port", type=int, default=18080)
+    parser.add_argument("--modes", default="threads,async")
+    args = parser.parse_args()
+
+    queries = [invoice_query(21000, make_zap_request(21000, RECIPIENT, ["ws://127.0.0.1:1"]))
+               for _ in range(args.requests)]
+    lnd = FakeLnd(args.latency)
+    lnd.start(args.lnd_port)
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        with open(os.path.join(workdir, "users.json"), "w") as users_file:
+            json.dump({"bench": RECIPIENT}, users_file)
+        for mode in args.modes.split(","):
+            rows.append(run(mode, args, lnd, queries, workdir))
+    lnd.stop()
+    print(f"{args.requests} invoice requests, {args.concurrency} clients, fake LND latency {args.latency}s")
+    print(f"{'mode':<8} {'ok':>5} {'failed':>6} {'p50 s':>7} {'p99 s':>7} {'req/s':>7} {'max in flight':>14}")
+    for row in rows:
+        print(f"{row['mode']:<8} {row['ok']:>5} {row['failed']:>6} {row['p50']:>7.2f} {row['p99']:>7.2f} "
+              f"{row['rps']:>7.1f} {row['max_in_flight']:>14}")
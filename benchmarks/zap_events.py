@@ -0,0 +1,24 @@
+"""
+Validly signed kind 9734 zap requests for the benchmarks.
+"""
+import json
+import time
+import urllib.parse
+
+from nostr.event import Event
+from nostr.key import PrivateKey
+
+
+def make_zap_request(amount: int, recipient: str, relays: list[str], sender: PrivateKey = None) -> str:
+    """
+    :return: the signed event as json
+    """
+    sender = sender or PrivateKey()
+    event = Event(public_key=sender.public_key.hex(), content="", kind=9734, created_at=int(time.time()),
+                  tags=[["p", recipient], ["amount", str(amount)], ["relays"] + relays])
+    sender.sign_event(event)
+    return json.dumps(json.loads(event.to_message())[1])
+
+
+def invoice_query(amount: int, zap_request: str) -> str:
+    return f"amount={amount}&nostr={urllib.parse.quote_plus(zap_request)}"
@@ -0,0 +1,160 @@
+"""
+End-to-end zap benchmark, fully offline: fake LND (invoice latency, settlement rate and delay), fake relay
+and a nip57_server subprocess in between. Zaps arrive open loop at --rps, each one is a lnurlp request
+followed by an invoice request with a freshly signed 9734; latencies count from the zap's scheduled
+start, so a server falling behind shows up in the percentiles instead of slowing the generator down.
+Reports lnurlp and invoice p50/p99, the delay from LND settling an invoice to its 9735 arriving at
+the relay, and zaps completed (receipt at the relay) per second. --repeat sends every invoice request
+again like a retrying wallet, --replay has the fake LND stream every settlement twice; both must not
+cost extra invoices or receipts. --workers runs the server as that many processes sharing their
+pending invoices, every invoice must still get its receipt from the one leader.
+Run from the repo root: python benchmarks/zap_suite.py --rps 20 --duration 10 --mode async
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_lnd import FakeLnd  # noqa: E402
+from fake_relay import FakeRelay  # noqa: E402
+from load_test import RECIPIENT, percentile, start_server, stop_server  # noqa: E402
+from zap_events import invoice_query, make_zap_request  # noqa: E402
+
+AMOUNT = 21000
+
+
+def get_json(url: str) -> dict | None:
+    try:
+        return json.loads(urllib.request.urlopen(url, timeout=60).read())
+    except (urllib.error.URLError, ConnectionError, ValueError):
+        return None
+
+
+def zap(base: str, query: str, due: float, repeat: int) -> tuple[float, float | None, list[float], bool]:
+    """
+    :return: lnurlp latency, invoice latency (None on failure), latencies of the repeated invoice requests
+        and whether all of them got the first invoice
+    """
+    time.sleep(max(due - time.perf_counter(), 0))
+    get_json(f"{base}/.well-known/lnurlp/bench")
+    lnurlp_done = time.perf_counter()
+    invoice = get_json(f"{base}/lnurlp/invoice/bench?{query}")
+    if invoice is None or invoice.get("status") != "OK":
+        return lnurlp_done - due, None, [], False
+    invoice_latency = time.perf_counter() - lnurlp_done
+    repeated, same = [], True
+    for _ in range(repeat):
+        start = time.perf_counter()
+        again = get_json(f"{base}/lnurlp/invoice/bench?{query}")
+        repeated.append(time.perf_counter() - start)
+        same = same and again is not None and again.get("pr") == invoice["pr"]
+    return lnurlp_done - due, invoice_latency, repeated, same
+
+
+def wait_for(condition, timeout: float) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def bolt11(event: dict) -> str | None:
+    for tag in event.get("tags", []):
+        if len(tag) > 1 and tag[0] == "bolt11":
+            return tag[1]
+    return None
+
+
+def fmt(values: list[float], scale: float = 1000) -> str:
+    if len(values) == 0:
+        return "-"
+    return f"p50 {percentile(values, 0.5) * scale:.1f}  p99 {percentile(values, 0.99) * scale:.1f}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rps", type=float, default=20, help="zaps per sec")
+    parser.add_argument("--duration", type=float, default=10, help="secs of load")
+    parser.add_argument("--mode", default="threads", help="SERVER_MODE of the server")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake LND secs per invoice")
+    parser.add_argument("--settle-rate", type=float, default=1.0, help="share of invoices that get paid")
+    parser.add_argument("--settle-delay", type=float, default=0.5, help="secs from invoice to payment")
+    parser.add_argument("--clients", type=int, default=200, help="max zaps in flight")
+    parser.add_argument("--port", type=int, default=18090)
+    parser.add_argument("--lnd-port", type=int, default=18080)
+    parser.add_argument("--relay-port", type=int, default=18100)
+    parser.add_argument("--repeat", type=int, default=0, help="times each invoice request is sent again")
+    parser.add_argument("--replay", action="store_true", help="fake LND streams every settlement twice")
+    parser.add_argument("--workers", type=int, default=1, help="WORKERS of the server")
+    parser.add_argument("--keep-log", help="copy the server log to this file")
+    args = parser.parse_args()
+
+    relay_url = f"ws://127.0.0.1:{args.relay_port}/"
+    n = int(args.rps * args.duration)
+    print(f"signing {n} zap requests...")
+    queries = [invoice_query(AMOUNT, make_zap_request(AMOUNT, RECIPIENT, [relay_url])) for _ in range(n)]
+
+    lnd = FakeLnd(args.latency, args.settle_rate, args.settle_delay)
+    lnd.replay = args.replay
+    lnd.start(args.lnd_port)
+    relay = FakeRelay()
+    relay.start(args.relay_port)
+    with tempfile.TemporaryDirectory() as workdir:
+        with open(os.path.join(workdir, "users.json"), "w") as users_file:
+            json.dump({"bench": RECIPIENT}, users_file)
+        server = start_server(args.mode, args.port, args.lnd_port, workdir,
+                              {"DEFAULT_RELAYS": relay_url, "STATS_LOG_INTERVAL": "0", "WORKERS": str(args.workers)})
+        try:
+            if not wait_for(lambda: lnd.stats()["subscribers"] > 0, 20):
+                raise RuntimeError("the server did not subscribe to the fake LND invoices")
+            base = f"http://127.0.0.1:{args.port}"
+            start = time.perf_counter()
+            start_wall = time.time()
+            with ThreadPoolExecutor(max_workers=args.clients) as pool:
+                futures = [pool.submit(zap, base, query, start + i / args.rps, args.repeat) for i, query in enumerate(queries)]
+                results = [future.result() for future in futures]
+            load_secs = time.perf_counter() - start
+            # every invoice LND settles should end up as a receipt at the relay
+            wait_for(lambda: len(lnd.settled_at) >= lnd.to_settle
+                     and relay.stats()["receipts"] >= len(lnd.settled_at), args.settle_delay + 30)
+        finally:
+            stop_server(server)
+            if args.keep_log:
+                shutil.copy(os.path.join(workdir, f"server-{args.mode}.log"), args.keep_log)
+    relay.stop()
+    lnd.stop()
+
+    lnurlp_latencies = [lnurlp for lnurlp, _, _, _ in results]
+    invoice_latencies = [invoice for _, invoice, _, _ in results if invoice is not None]
+    repeated_latencies = [latency for _, _, repeated, _ in results for latency in repeated]
+    delays = []
+    last_receipt = start_wall
+    for arrival, event in relay.receipts:
+        settled_at = lnd.settled_at.get(bolt11(event))
+        if settled_at is not None:
+            delays.append(arrival - settled_at)
+            last_receipt = max(last_receipt, arrival)
+    print(f"mode {args.mode} x{args.workers}, {n} zaps at {args.rps}/s, fake LND {args.latency}s per invoice, "
+          f"{args.settle_rate:.0%} paid after {args.settle_delay}s")
+    print(f"sent in           {load_secs:.1f}s ({n / load_secs:.1f} zaps/s)")
+    print(f"invoices          {len(invoice_latencies)} ok, {n - len(invoice_latencies)} failed")
+    print(f"lnurlp ms         {fmt(lnurlp_latencies)}")
+    print(f"invoice ms        {fmt(invoice_latencies)}")
+    if args.repeat > 0:
+        differing = sum(1 for _, invoice, _, same in results if invoice is not None and not same)
+        print(f"repeated ms       {fmt(repeated_latencies)}, {differing} zaps got another invoice, "
+              f"{lnd.stats()['invoices']} LND invoices")
+    duplicates = len(relay.receipts) - len({bolt11(event) for _, event in relay.receipts})
+    print(f"settled           {len(lnd.settled_at)}, receipts at relay {len(relay.receipts)}, {duplicates} duplicates")
+    print(f"settle->9735 ms   {fmt(delays)}")
+    print(f"completed zaps/s  {len(delays) / max(last_receipt - start_wall, 1e-9):.1f}")
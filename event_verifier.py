@@ -0,0 +1,154 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import secp256k1
+
+KEY_CACHE_SIZE = int(os.environ.get("VERIFY_KEY_CACHE_SIZE", 4096))
+
+# parsed secp256k1 public keys by hex pubkey, per process
+_key_cache: OrderedDict[str, secp256k1.PublicKey] = OrderedDict()
+_key_cache_lock = threading.Lock()
+
+
+def compute_event_id(event: dict) -> str:
+    """
+    sha256 of the canonical NIP-01 serialization
+    """
+    serialized = json.dumps([0, event["pubkey"], event["created_at"], event["kind"], event["tags"], event["content"]],
+                            separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+
+def _public_key(pubkey: str) -> secp256k1.PublicKey:
+    with _key_cache_lock:
+        key = _key_cache.get(pubkey)
+        if key is not None:
+            _key_cache.move_to_end(pubkey)
+            return key
+    # parse outside the lock, x-only key with 02 prefix for schnorr (bip340)
+    key = secp256k1.PublicKey(b"\x02" + bytes.fromhex(pubkey), True)
+    with _key_cache_lock:
+        _key_cache[pubkey] = key
+        if len(_key_cache) > KEY_CACHE_SIZE:
+            _key_cache.popitem(last=False)
+    return key
+
+
+def verify_event(event: dict) -> bool:
+    """
+    Check that id is the hash of the event and sig is a valid schnorr signature of id by pubkey.
+    The secp256k1 call runs in C through cffi and releases the GIL.
+    """
+    try:
+        if compute_event_id(event) != event["id"]:
+            return False
+        key = _public_key(event["pubkey"])
+        return key.schnorr_verify(bytes.fromhex(event["id"]), bytes.fromhex(event["sig"]), None, True)
+    except Exception:
+        # secp256k1 raises a plain Exception for keys not on the curve
+        return False
+
+
+def _verify_batch(events: list[dict]) -> list[bool]:
+    return [verify_event(event) for event in events]
+
+
+class EventVerifier:
+    """
+    Verifies nostr events inline, or with VERIFY_WORKERS > 0 in a process pool. Concurrent requests are then
+    collected for up to VERIFY_BATCH_WINDOW secs (or VERIFY_BATCH_SIZE events) and sent to a worker as one batch.
+    """
+    WORKERS = int(os.environ.get("VERIFY_WORKERS", 0))
+    BATCH_SIZE = int(os.environ.get("VERIFY_BATCH_SIZE", 64))
+    BATCH_WINDOW = float(os.environ.get("VERIFY_BATCH_WINDOW", 0.002))
+    TIMEOUT = 10
+
+    def __init__(self, logger: logging.Logger, workers: int = None):
+        self._logger = logger
+        self._workers = self.WORKERS if workers is None else workers
+        self._pool: ProcessPoolExecutor | None = None
+        self._pool_lock = threading.Lock()
+        self._closed = False
+        self._pending: queue.Queue = queue.Queue()
+        if self._workers > 0:
+            self._pool = self._start_pool()
+            threading.Thread(target=self._batch_loop, name="verify-batcher", daemon=True).start()
+            self._logger.info(f"Verifying events in {self._workers} worker processes")
+
+    def _start_pool(self) -> ProcessPoolExecutor:
+        # spawn, forking a process that already runs threads is not safe
+        return ProcessPoolExecutor(max_workers=self._workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def _replace_pool(self, broken: ProcessPoolExecutor):
+        """
+        A dead worker process (e.g. OOM killed) breaks the whole pool, start a new one in its place.
+        """
+        with self._pool_lock:
+            if self._pool is not broken or self._closed:
+                return
+            self._logger.error("A verifier process died, starting a new verifier pool")
+            self._pool = self._start_pool()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def verify(self, event: dict) -> bool:
+        if self._pool is None:
+            return verify_event(event)
+        future = Future()
+        self._pending.put((event, future))
+        try:
+            return future.result(timeout=self.TIMEOUT)
+        except Exception as e:
+            self._logger.error(f"Event verification failed: {e}")
+            return False
+
+    def _batch_loop(self):
+        while True:
+            batch = [self._pending.get()]
+            deadline = time.monotonic() + self.BATCH_WINDOW
+            try:
+                while len(batch) < self.BATCH_SIZE:
+                    batch.append(self._pending.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                pass
+            events = [event for event, _ in batch]
+            futures = [future for _, future in batch]
+            pool = self._pool
+            try:
+                result = pool.submit(_verify_batch, events)
+            except RuntimeError as e:
+                # BrokenProcessPool, or the pool was shut down by close()
+                self._fail(futures, e)
+                self._replace_pool(pool)
+                continue
+            result.add_done_callback(lambda done, waiting=futures, used=pool: self._resolve(done, waiting, used))
+
+    def _resolve(self, done: Future, futures: list[Future], pool: ProcessPoolExecutor):
+        try:
+            results = done.result()
+        except Exception as e:
+            self._fail(futures, e)
+            if isinstance(e, BrokenProcessPool):
+                self._replace_pool(pool)
+            return
+        for future, verified in zip(futures, results):
+            future.set_result(verified)
+
+    @staticmethod
+    def _fail(futures: list[Future], error: Exception):
+        for future in futures:
+            future.set_exception(error)
+
+    def close(self):
+        with self._pool_lock:
+            self._closed = True
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
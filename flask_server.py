@@ -0,0 +1,67 @@
+import logging
+import socket
+
+from flask import Flask, Response
+from flask import request
+from flask_cors import CORS
+from waitress import serve
+
+from zap_endpoints import METRICS_CONTENT_TYPE, ZapEndpoints, client_ip
+
+
+def create_app(endpoints: ZapEndpoints) -> Flask:
+    app = Flask("nip57Server")
+    CORS(app)
+
+    @app.route('/.well-known/lnurlp/<string:username>')
+    def lnurlp(username):
+        cached, headers = endpoints.lnurlp(username)
+        if cached.status == 200 and request.if_none_match.contains(cached.etag):
+            return Response(status=304, headers=headers)
+        return Response(cached.body, status=cached.status, headers=headers, mimetype="application/json")
+
+    @app.route('/.well-known/nostr.json')
+    def nostr_json():
+        return endpoints.nostr_json(request.args.get(key='name', type=str))
+
+    @app.route('/lnurlp/state')
+    def state():
+        return endpoints.state()
+
+    @app.route('/lnurlp/set_clearnet')
+    def set_clearnet():
+        return endpoints.set_clearnet(secret=request.args.get(key='secret', type=str),
+                                      ipv4=request.args.get(key='ipv4', type=str),
+                                      port=request.args.get(key='port', type=int),
+                                      tls_verify=request.args.get(key='tls_verify', type=str))
+
+    @app.route('/lnurlp/invoice/<string:username>')
+    def invoice(username):
+        return endpoints.invoice(username,
+                                 amount=request.args.get(key='amount', type=int),
+                                 nostr=request.args.get(key='nostr', type=str),
+                                 comment=request.args.get(key='comment', type=str),
+                                 client_ip=client_ip(request.headers, request.remote_addr))
+
+    @app.route('/metrics')
+    def metrics():
+        body, status = endpoints.metrics()
+        if status != 200:
+            return body, status
+        return Response(body, headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+    return app
+
+
+def serve_threads(logger: logging.Logger, endpoints: ZapEndpoints, host: str, port: int,
+                  sock: socket.socket = None):
+    """
+    Serve the Flask app with waitress, each request in a thread of its pool.
+    :param sock: listening socket to serve on, maybe shared with other workers, instead of host and port
+    """
+    app = create_app(endpoints)
+    if sock is not None:
+        logger.info(f"Serving threads on the listening socket {sock.getsockname()}")
+        serve(app, sockets=[sock])
+        return
+    serve(app, host=host, port=port)
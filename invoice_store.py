@@ -0,0 +1,397 @@
+import heapq
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import REGISTRY
+from shared_store import KEY_PREFIX, RespClient, StoreError
+from zap_request import ZapRequest
+
+CACHE_LOOKUPS = REGISTRY.counter("nip57_invoice_cache_lookups_total", "Pending invoice lookups on settlement",
+                                 ("result",))
+
+
+class SqliteInvoiceBackend:
+    """
+    Optional on-disk copy of the pending invoices, so a restart does not drop zap receipts.
+    Changes are queued in memory and written by a background thread in one WAL transaction
+    every FLUSH_INTERVAL secs, the invoice request path never waits for an fsync.
+    """
+    FLUSH_INTERVAL = float(os.environ.get("INVOICE_DB_FLUSH_INTERVAL", 0.2))
+    FLUSH_BATCH = 512
+
+    def __init__(self, logger: logging.Logger, path: str):
+        self._logger = logger
+        self._path = path
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS pending "
+                         "(idx TEXT PRIMARY KEY, timestamp INTEGER NOT NULL, event TEXT NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._queue_lock = threading.Lock()
+        self._queue: list[tuple] = []
+        # flushes from other threads than the writer must not commit out of order
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._writer = threading.Thread(target=self._run, name="invoice-db-writer", daemon=True)
+        self._writer.start()
+
+    def _enqueue(self, op: tuple):
+        with self._queue_lock:
+            self._queue.append(op)
+            if len(self._queue) >= self.FLUSH_BATCH:
+                self._wakeup.set()
+
+    def record_put(self, idx: str, timestamp: int, event: str):
+        self._enqueue(("put", idx, timestamp, event))
+
+    def record_delete(self, idx: str):
+        self._enqueue(("delete", idx))
+
+    def record_expire(self, cutoff: int):
+        self._enqueue(("expire", cutoff))
+
+    def set_meta(self, key: str, value: str):
+        self._enqueue(("meta", key, value))
+
+    def get_meta(self, key: str, default: str = None) -> str | None:
+        with self._db_lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def load(self, cutoff: int) -> list[tuple[str, int, str]]:
+        """
+        :param cutoff: entries with a timestamp below are expired and not loaded
+        :return: (idx, timestamp, event) of all unexpired entries, oldest first
+        """
+        with self._db_lock:
+            return self._db.execute("SELECT idx, timestamp, event FROM pending WHERE timestamp >= ? "
+                                    "ORDER BY timestamp", (cutoff,)).fetchall()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.FLUSH_INTERVAL)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._queue_lock:
+            ops, self._queue = self._queue, []
+        if len(ops) == 0:
+            return
+        try:
+            with self._db_lock:
+                self._db.execute("BEGIN")
+                for op in ops:
+                    if op[0] == "put":
+                        self._db.execute("INSERT OR REPLACE INTO pending (idx, timestamp, event) VALUES (?, ?, ?)",
+                                         op[1:])
+                    elif op[0] == "delete":
+                        self._db.execute("DELETE FROM pending WHERE idx = ?", op[1:])
+                    elif op[0] == "expire":
+                        self._db.execute("DELETE FROM pending WHERE timestamp < ?", op[1:])
+                    elif op[0] == "meta":
+                        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", op[1:])
+                self._db.execute("COMMIT")
+        except sqlite3.Error as e:
+            self._logger.error(f"Writing {len(ops)} changes to {self._path} failed: {e}")
+            with self._db_lock:
+                if self._db.in_transaction:
+                    self._db.execute("ROLLBACK")
+
+    def close(self):
+        self._stop.set()
+        self._wakeup.set()
+        self._writer.join(timeout=5)
+        self.flush()
+        with self._db_lock:
+            self._db.close()
+
+
+class PendingInvoiceStore:
+    """
+    Thread-safe store for kind 9734 events waiting for their invoice to be paid, keyed by LND add_index.
+    Expiry walks a heap ordered by expiry time, so a cleanup costs amortized O(expired) instead of a full scan.
+    Above MAX_SIZE the oldest entry is evicted (FIFO, a lookup pops its entry anyway).
+    With a backend every change is mirrored to disk and warm_load() restores the unexpired entries.
+    """
+    # secs until we remove a 9734 from the store
+    TTL = int(os.environ.get("INVOICE_CACHE_TTL", 120))
+    MAX_SIZE = int(os.environ.get("INVOICE_CACHE_MAX_SIZE", 100000))
+
+    def __init__(self, logger: logging.Logger, ttl: int = None, max_size: int = None,
+                 backend: SqliteInvoiceBackend = None):
+        self._logger = logger
+        self._backend = backend
+        self.ttl = self.TTL if ttl is None else ttl
+        self.max_size = self.MAX_SIZE if max_size is None else max_size
+        self._lock = threading.Lock()
+        # idx -> entry, oldest first
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        # (expires_at, seq, idx), stale tuples of removed entries are skipped lazily
+        self._expiry_heap: list[tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        self._inserts = 0
+        self._hits = 0
+        self._misses = 0
+        self._expired = 0
+        self._evicted = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, idx: str, event: ZapRequest, timestamp: int = None):
+        if timestamp is None:
+            timestamp = int(time.time())
+        self._put(idx, event, timestamp)
+        if self._backend is not None:
+            self._backend.record_put(idx, timestamp, event.raw)
+
+    def _put(self, idx: str, event: ZapRequest, timestamp: int):
+        entry = {"timestamp": timestamp, "event": event, "idx": idx, "expires_at": timestamp + self.ttl}
+        with self._lock:
+            self._expire_locked(time.time())
+            self._entries[idx] = entry
+            self._entries.move_to_end(idx)
+            heapq.heappush(self._expiry_heap, (entry["expires_at"], next(self._seq), idx))
+            self._inserts += 1
+            while len(self._entries) > self.max_size:
+                evicted_idx, _ = self._entries.popitem(last=False)
+                self._evicted += 1
+                self._logger.warning(f"Invoice cache full, evicted idx {evicted_idx}")
+                if self._backend is not None:
+                    self._backend.record_delete(evicted_idx)
+            self._compact_locked()
+
+    def warm_load(self) -> int:
+        """
+        Restore the unexpired entries from the backend.
+        :return: number of restored entries
+        """
+        if self._backend is None:
+            return 0
+        rows = self._backend.load(int(time.time()) - self.ttl)
+        restored = 0
+        for idx, timestamp, raw in rows:
+            try:
+                self._put(idx, ZapRequest.from_json(raw), timestamp)
+                restored += 1
+            except ValueError:
+                self._logger.error(f"Dropping unreadable pending invoice {idx} from disk")
+        self._logger.info(f"Restored {restored} pending invoices from disk")
+        return restored
+
+    def save_indices(self, name: str, add_index: int, settle_index: int):
+        if self._backend is not None:
+            self._backend.set_meta("add_index:" + name, str(add_index))
+            self._backend.set_meta("settle_index:" + name, str(settle_index))
+
+    def load_indices(self, name: str) -> tuple[int, int]:
+        """
+        :param name: LND backend name
+        :return: (add_index, settle_index) its subscription got to before the last shutdown
+        """
+        if self._backend is None:
+            return 0, 0
+        return (int(self._backend.get_meta("add_index:" + name, "0")),
+                int(self._backend.get_meta("settle_index:" + name, "0")))
+
+    def flush(self):
+        """
+        Write the queued changes to disk now instead of on the backend's next flush.
+        """
+        if self._backend is not None:
+            self._backend.flush()
+
+    def close(self):
+        if self._backend is not None:
+            self._backend.close()
+
+    def pop(self, idx: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.pop(idx, None)
+            if entry is None:
+                self._misses += 1
+                CACHE_LOOKUPS.labels("miss").inc()
+                return None
+            self._hits += 1
+        CACHE_LOOKUPS.labels("hit").inc()
+        if self._backend is not None:
+            self._backend.record_delete(idx)
+        return entry
+
+    def expire(self, now: float = None) -> int:
+        """
+        Drop all entries older than the TTL.
+        :return: number of dropped entries
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            dropped = self._expire_locked(now)
+        if self._backend is not None:
+            self._backend.record_expire(int(now) - self.ttl)
+        return dropped
+
+    def _expire_locked(self, now: float) -> int:
+        dropped = 0
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            expires_at, _, idx = heapq.heappop(heap)
+            entry = self._entries.get(idx)
+            if entry is not None and entry["expires_at"] == expires_at:
+                del self._entries[idx]
+                dropped += 1
+        self._expired += dropped
+        return dropped
+
+    def _compact_locked(self):
+        # settled and evicted entries leave stale heap tuples behind, rebuild once they dominate
+        if len(self._expiry_heap) > 2 * len(self._entries) + 1024:
+            self._expiry_heap = [(entry["expires_at"], next(self._seq), idx) for idx, entry in self._entries.items()]
+            heapq.heapify(self._expiry_heap)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries),
+                    "max_size": self.max_size,
+                    "ttl": self.ttl,
+                    "inserts": self._inserts,
+                    "hits": self._hits,
+                    "misses": self._misses,
+                    "expired": self._expired,
+                    "evicted": self._evicted}
+
+
+class SharedInvoiceStore:
+    """
+    PendingInvoiceStore for several processes or hosts: the pending invoices live in a shared store
+    (Redis protocol), in one hash plus a sorted set by expiry time, so any worker can cache an invoice and
+    the leader that holds the LND subscription finds it on settlement. pop() only returns the entry
+    to the one caller whose HDEL removed it, two listeners seeing the same settlement cannot both receipt it.
+    Expiry is up to expire(), there is no size cap besides the TTL.
+    """
+    TTL = PendingInvoiceStore.TTL
+    EXPIRE_BATCH = 1000
+
+    def __init__(self, logger: logging.Logger, client: RespClient, ttl: int = None):
+        self._logger = logger
+        self._client = client
+        self.ttl = self.TTL if ttl is None else ttl
+        self._entries_key = KEY_PREFIX + "pending"
+        self._expiry_key = KEY_PREFIX + "pending:expiry"
+        self._meta_key = KEY_PREFIX + "meta"
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self._hits = 0
+        self._misses = 0
+        self._expired = 0
+
+    def __len__(self):
+        return self._client.execute("HLEN", self._entries_key)
+
+    def put(self, idx: str, event: ZapRequest, timestamp: int = None):
+        """
+        :raise StoreError: if the shared store is unreachable
+        """
+        if timestamp is None:
+            timestamp = int(time.time())
+        entry = json.dumps({"timestamp": timestamp, "event": event.raw})
+        self._client.pipeline([("HSET", self._entries_key, idx, entry),
+                               ("ZADD", self._expiry_key, timestamp + self.ttl, idx)])
+        with self._lock:
+            self._inserts += 1
+
+    def pop(self, idx: str) -> dict | None:
+        """
+        :raise StoreError: if the shared store is unreachable
+        """
+        entry, deleted, _ = self._client.pipeline([("HGET", self._entries_key, idx),
+                                                   ("HDEL", self._entries_key, idx),
+                                                   ("ZREM", self._expiry_key, idx)])
+        if entry is None or deleted == 0:
+            with self._lock:
+                self._misses += 1
+            CACHE_LOOKUPS.labels("miss").inc()
+            return None
+        with self._lock:
+            self._hits += 1
+        CACHE_LOOKUPS.labels("hit").inc()
+        stored = json.loads(entry)
+        return {"timestamp": stored["timestamp"], "event": ZapRequest.from_json(stored["event"]), "idx": idx,
+                "expires_at": stored["timestamp"] + self.ttl}
+
+    def expire(self, now: float = None) -> int:
+        """
+        Drop all entries older than the TTL, any process may do it.
+        :return: number of dropped entries
+        """
+        if now is None:
+            now = time.time()
+        dropped = 0
+        while True:
+            expired = self._client.execute("ZRANGEBYSCORE", self._expiry_key, "-inf", now,
+                                           "LIMIT", 0, self.EXPIRE_BATCH)
+            if len(expired) == 0:
+                break
+            deleted, _ = self._client.pipeline([("HDEL", self._entries_key, *expired),
+                                                ("ZREM", self._expiry_key, *expired)])
+            dropped += deleted
+            if len(expired) < self.EXPIRE_BATCH:
+                break
+        with self._lock:
+            self._expired += dropped
+        return dropped
+
+    def warm_load(self) -> int:
+        # the entries outlive this process in the shared store, nothing to restore
+        return 0
+
+    def save_indices(self, name: str, add_index: int, settle_index: int):
+        self._client.execute("HSET", self._meta_key, "add_index:" + name, add_index,
+                             "settle_index:" + name, settle_index)
+
+    def load_indices(self, name: str) -> tuple[int, int]:
+        """
+        :param name: LND backend name
+        :return: (add_index, settle_index) the last leader's subscription got to
+        """
+        add_index, settle_index = self._client.pipeline([("HGET", self._meta_key, "add_index:" + name),
+                                                         ("HGET", self._meta_key, "settle_index:" + name)])
+        return int(add_index or 0), int(settle_index or 0)
+
+    def flush(self):
+        # every change is in the shared store once put() or pop() returned
+        pass
+
+    def close(self):
+        # the client is shared with the dedup and leader election, its creator closes it
+        pass
+
+    def stats(self) -> dict:
+        try:
+            size = len(self)
+        except StoreError:
+            size = None
+        with self._lock:
+            return {"size": size,
+                    "ttl": self.ttl,
+                    "shared": self._client.url,
+                    "reachable": size is not None,
+                    "store_errors": self._client.errors,
+                    "inserts": self._inserts,
+                    "hits": self._hits,
+                    "misses": self._misses,
+                    "expired": self._expired}
@@ -0,0 +1,188 @@
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from typing import Callable
+
+import requests
+
+from lnd_client import LndClient
+from metrics import REGISTRY
+
+SUBSCRIPTION_RECONNECTS = REGISTRY.counter("nip57_lnd_subscription_reconnects_total",
+                                           "Reconnects of the LND invoice subscription", ("backend",))
+
+
+class InvoiceSubscription:
+    """
+    Supervised, single-owner LND /v1/invoices/subscribe stream.
+    The stream is kept open for the lifetime of the server. After a drop it reconnects with jittered
+    exponential backoff and asks LND to replay everything after the last seen add_index/settle_index,
+    so settlements arriving during the gap are not lost.
+    """
+    BACKOFF_MIN = float(os.environ.get("SUBSCRIBE_BACKOFF_MIN", 1))
+    BACKOFF_MAX = float(os.environ.get("SUBSCRIBE_BACKOFF_MAX", 60))
+
+    def __init__(self, logger: logging.Logger, client: LndClient, macaroon: str,
+                 on_invoice: Callable[[dict], None], name: str = "default"):
+        self._logger = logger
+        self._client = client
+        self._macaroon = macaroon
+        self._on_invoice = on_invoice
+        self._name = name
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._response: requests.Response | None = None
+        self._connected = False
+        self._reconnects = 0
+        self._add_index = 0
+        self._settle_index = 0
+        self._last_message = 0.0
+        self._lag = 0.0
+        self._got_message = False
+
+    def start(self):
+        thread = self._thread
+        if thread is not None and self._stop.is_set():
+            # started again right after stop(), let the old stream close first
+            thread.join(timeout=5)
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._logger.info(f"Starting LND invoice subscription {self._name}")
+            self._thread = threading.Thread(target=self._run, name=f"lnd-subscription-{self._name}", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.reconnect()
+
+    def reconnect(self):
+        """
+        Drop the current stream, the supervisor opens a new one (e.g. after the LND address changed).
+        """
+        with self._lock:
+            response = self._response
+        if response is not None:
+            # closing alone blocks while the subscription thread sits in a read on the stream,
+            # shutting the socket down first makes that read return
+            sock = getattr(getattr(response.raw, "_connection", None), "sock", None)
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            response.close()
+
+    def set_macaroon(self, macaroon: str):
+        self._macaroon = macaroon
+
+    def resume_from(self, add_index: int, settle_index: int):
+        """
+        Set the indices to resume from, used when pending invoices are restored from disk.
+        """
+        with self._lock:
+            self._add_index = max(self._add_index, add_index)
+            self._settle_index = max(self._settle_index, settle_index)
+
+    def indices(self) -> tuple[int, int]:
+        with self._lock:
+            return self._add_index, self._settle_index
+
+    def _subscribe_path(self) -> str:
+        add_index, settle_index = self.indices()
+        params = []
+        if add_index > 0:
+            params.append(f"add_index={add_index}")
+        if settle_index > 0:
+            params.append(f"settle_index={settle_index}")
+        if len(params) == 0:
+            return '/v1/invoices/subscribe'
+        return '/v1/invoices/subscribe?' + "&".join(params)
+
+    def _run(self):
+        backoff = self.BACKOFF_MIN
+        while not self._stop.is_set():
+            self._got_message = False
+            try:
+                self._consume()
+            except (requests.exceptions.RequestException, ValueError, OSError) as e:
+                if not self._stop.is_set():
+                    self._logger.error(f"LND subscription {self._name} failed: {e}")
+            finally:
+                with self._lock:
+                    self._connected = False
+                    self._response = None
+            if self._stop.is_set():
+                break
+            if self._got_message:
+                # the stream was healthy before it dropped, start over with a short delay
+                backoff = self.BACKOFF_MIN
+            with self._lock:
+                self._reconnects += 1
+            SUBSCRIPTION_RECONNECTS.labels(self._name).inc()
+            delay = random.uniform(backoff / 2, backoff)
+            self._logger.info(f"LND subscription {self._name} reconnecting in {delay:.1f}s")
+            self._stop.wait(delay)
+            backoff = min(backoff * 2, self.BACKOFF_MAX)
+        self._logger.info(f"LND invoice subscription {self._name} closed")
+
+    def _consume(self):
+        headers = {'Grpc-Metadata-macaroon': self._macaroon}
+        path = self._subscribe_path()
+        self._logger.debug(f"Sending invoice subscribe to LND: {path}")
+        response = self._client.get(path, headers=headers, stream=True)
+        with self._lock:
+            self._response = response
+        if response.status_code != 200:
+            self._logger.error(f"No 200 from lnd on subscribe: {response.status_code}")
+            response.close()
+            return
+        with self._lock:
+            self._connected = True
+        try:
+            for raw_response in response.iter_lines():
+                if self._stop.is_set():
+                    break
+                if not raw_response:
+                    continue
+                self._got_message = True
+                json_response = json.loads(raw_response)
+                self._logger.debug(f"Got streamed from LND: {json_response}")
+                self._track(json_response)
+                try:
+                    self._on_invoice(json_response)
+                except Exception:
+                    self._logger.exception(f"Processing invoice from LND subscription {self._name} failed")
+        except AttributeError:
+            # reconnect() closed the response under our feet
+            pass
+        finally:
+            response.close()
+
+    def _track(self, json_response: dict):
+        invoice = json_response.get("result")
+        if not isinstance(invoice, dict):
+            return
+        now = time.time()
+        with self._lock:
+            self._last_message = now
+            self._add_index = max(self._add_index, int(invoice.get("add_index", 0)))
+            if invoice.get("settled"):
+                self._settle_index = max(self._settle_index, int(invoice.get("settle_index", 0)))
+                self._lag = max(now - int(invoice.get("settle_date", now)), 0.0)
+
+    def state(self) -> dict:
+        with self._lock:
+            return {"connected": self._connected,
+                    "reconnects": self._reconnects,
+                    "add_index": self._add_index,
+                    "settle_index": self._settle_index,
+                    "lag_secs": round(self._lag, 3),
+                    "last_message_age_secs": round(time.time() - self._last_message, 1)
+                    if self._last_message > 0 else None}
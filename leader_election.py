@@ -0,0 +1,106 @@
+import logging
+import os
+import secrets
+import socket
+import threading
+import time
+from typing import Callable
+
+from metrics import REGISTRY
+from shared_store import KEY_PREFIX, RespClient, StoreError
+
+LEADER_CHANGES = REGISTRY.counter("nip57_leader_changes_total", "Times this process became or stopped being leader",
+                                  ("change",))
+
+
+class LeaderElection:
+    """
+    Picks the one process among all workers and hosts that holds the LND invoice subscriptions and
+    publishes the zap receipts: whoever sets the lease key in the shared store first, for as long as it
+    renews the lease every LEASE / 3 secs. A leader that cannot reach the store steps down once its
+    lease ran out, so a partitioned process stops listening about when another one may take over.
+    Two leaders for a moment cost nothing but a duplicate stream, the shared pending invoices hand each
+    settled zap request to one of them only.
+    """
+    LEASE = float(os.environ.get("LEADER_LEASE", 15))
+
+    def __init__(self, logger: logging.Logger, store: RespClient, on_elected: Callable[[], None],
+                 on_deposed: Callable[[], None]):
+        self._logger = logger
+        self._store = store
+        self._on_elected = on_elected
+        self._on_deposed = on_deposed
+        self._key = KEY_PREFIX + "leader"
+        self.identity = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self._lock = threading.Lock()
+        self._leader = False
+        # time.monotonic() the lease runs out, as far as this process knows
+        self._lease_until = 0.0
+        self.elected = 0
+
+    @property
+    def renew_interval(self) -> float:
+        return self.LEASE / 3
+
+    def is_leader(self) -> bool:
+        with self._lock:
+            return self._leader
+
+    def tick(self):
+        """
+        Take the lease if it is free, renew it if it is ours. Run every renew_interval secs.
+        """
+        now = time.monotonic()
+        lease_ms = int(self.LEASE * 1000)
+        try:
+            if self.is_leader():
+                # GET and PEXPIRE are not atomic: if the lease ran out in between and another process took it,
+                # this extends the other one's lease and the next tick sees the new holder
+                holder = self._store.execute("GET", self._key)
+                if holder == self.identity:
+                    self._store.execute("PEXPIRE", self._key, lease_ms)
+                    self._lease_until = now + self.LEASE
+                    return
+                self._logger.warning(f"Lost the leader lease to {holder}")
+                self._set_leader(False)
+            elif self._store.execute("SET", self._key, self.identity, "NX", "PX", lease_ms) == "OK":
+                self._lease_until = now + self.LEASE
+                self._set_leader(True)
+        except StoreError as e:
+            self._logger.error(f"Leader election failed: {e}")
+            if self.is_leader() and time.monotonic() >= self._lease_until:
+                self._logger.warning("Leader lease ran out without the shared store, stepping down")
+                self._set_leader(False)
+
+    def resign(self):
+        """
+        Step down and free the lease at once, so another process does not wait for it to run out.
+        """
+        if not self.is_leader():
+            return
+        self._set_leader(False)
+        try:
+            if self._store.execute("GET", self._key) == self.identity:
+                self._store.execute("DEL", self._key)
+        except StoreError as e:
+            self._logger.warning(f"Freeing the leader lease failed: {e}")
+
+    def _set_leader(self, leader: bool):
+        with self._lock:
+            if self._leader == leader:
+                return
+            self._leader = leader
+            if leader:
+                self.elected += 1
+        LEADER_CHANGES.labels("elected" if leader else "deposed").inc()
+        if leader:
+            self._logger.info(f"Elected leader as {self.identity}, starting the invoice listener")
+            self._on_elected()
+        else:
+            self._logger.info(f"No longer leader as {self.identity}, stopping the invoice listener")
+            self._on_deposed()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"identity": self.identity, "leader": self._leader, "elected": self.elected,
+                    "lease": self.LEASE}
@@ -0,0 +1,131 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable
+
+import requests
+
+from invoice_subscription import InvoiceSubscription
+from lnd_client import LndClient
+
+
+class LndBackend:
+    """
+    One LND node: its pooled REST client, invoice macaroon and invoice subscription.
+    add_index values are only unique per node, so pending invoices are keyed by backend name and add_index.
+    It also keeps what the pool needs to pick a node: a moving average of its latency and a circuit
+    breaker that takes the node out for BREAKER_COOLDOWN secs after BREAKER_FAILURES failures in a row.
+    """
+    BREAKER_FAILURES = int(os.environ.get("LND_BREAKER_FAILURES", 3))
+    BREAKER_COOLDOWN = float(os.environ.get("LND_BREAKER_COOLDOWN", 30))
+    LATENCY_SMOOTHING = 0.3
+
+    def __init__(self, logger: logging.Logger, name: str, restaddr: str, macaroon: str, tls_verify,
+                 socks5h_proxy: str, on_invoice: Callable[["LndBackend", dict], None]):
+        self.name = name
+        self.restaddr = restaddr
+        self.macaroon = macaroon
+        self.tls_verify = tls_verify
+        self.socks5h_proxy = socks5h_proxy
+        self.client = LndClient(logger, restaddr, tls_verify, socks5h_proxy)
+        self.subscription = InvoiceSubscription(logger, self.client, macaroon,
+                                                lambda result: on_invoice(self, result), name)
+        # result of the last health probe, None until the first one ran
+        self.healthy: bool | None = None
+        self.probe_latency = 0.0
+        self.last_probe = 0.0
+        self._lock = threading.Lock()
+        self.latency = 1.0  # a Tor round trip is the better first guess than 0
+        self.failures = 0
+        self._open_until = 0.0
+        self._trial = False
+
+    def key(self, add_index) -> str:
+        return f"{self.name}:{add_index}"
+
+    def state(self) -> dict:
+        """
+        GET /v1/state
+        :raise requests.exceptions.RequestException: if LND is unreachable or answers garbage
+        """
+        return self.client.get('/v1/state').json()
+
+    def probe(self) -> bool:
+        """
+        Health probe: healthy if /v1/state says LND is fully started.
+        """
+        start = time.perf_counter()
+        try:
+            healthy = self.state().get("state") == "SERVER_ACTIVE"
+        except (requests.exceptions.RequestException, AttributeError):
+            healthy = False
+        self.probe_latency = time.perf_counter() - start
+        self.last_probe = time.time()
+        self.healthy = healthy
+        if healthy:
+            self.record_success(self.probe_latency)
+        else:
+            self.record_failure()
+        return healthy
+
+    def available(self) -> bool:
+        """
+        False while the circuit is open or its trial after the cooldown is taken. Doesn't claim the trial.
+        """
+        with self._lock:
+            return self._open_until == 0.0 or (time.monotonic() >= self._open_until and not self._trial)
+
+    def try_acquire_trial(self) -> bool:
+        """
+        Call right before sending a request to the node. True if the circuit is closed, or if the cooldown
+        is over and this caller got the one trial request, which record_success() or record_failure() ends.
+        """
+        with self._lock:
+            if self._open_until == 0.0:
+                return True
+            if time.monotonic() < self._open_until or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self, latency: float):
+        with self._lock:
+            self.latency += self.LATENCY_SMOOTHING * (latency - self.latency)
+            self.failures = 0
+            self._open_until = 0.0
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.BREAKER_FAILURES or self._trial:
+                self._open_until = time.monotonic() + self.BREAKER_COOLDOWN
+                self._trial = False
+
+    def health(self) -> dict:
+        with self._lock:
+            circuit_open = self._open_until != 0.0
+        return {"healthy": self.healthy, "probe_latency": round(self.probe_latency, 3),
+                "last_probe": int(self.last_probe), "latency": round(self.latency, 3),
+                "failures": self.failures, "circuit_open": circuit_open}
+
+    def configure(self, restaddr: str, tls_verify, socks5h_proxy: str):
+        reconnect = restaddr != self.restaddr
+        self.restaddr = restaddr
+        self.tls_verify = tls_verify
+        self.socks5h_proxy = socks5h_proxy
+        self.client.configure(restaddr, tls_verify, socks5h_proxy)
+        if reconnect:
+            self.subscription.reconnect()
+
+    def set_macaroon(self, macaroon: str):
+        reconnect = macaroon != self.macaroon
+        self.macaroon = macaroon
+        self.subscription.set_macaroon(macaroon)
+        if reconnect:
+            self.subscription.reconnect()
+
+    def close(self):
+        self.subscription.stop()
+        self.client.close()
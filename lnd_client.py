@@ -0,0 +1,115 @@
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+
+class LndClient:
+    """
+    Long-lived, pooled HTTP client for the LND REST interface.
+    One requests.Session with a bounded connection pool is shared by all threads, so the
+    SOCKS5h circuit and TLS handshake are paid once per pooled connection instead of once per call.
+    """
+    POOL_SIZE = int(os.environ.get("LND_POOL_SIZE", 8))
+    CONNECT_TIMEOUT = float(os.environ.get("LND_CONNECT_TIMEOUT", 15))
+    READ_TIMEOUT = float(os.environ.get("LND_READ_TIMEOUT", 30))
+    RETRIES = int(os.environ.get("LND_RETRIES", 2))
+    RETRY_BACKOFF = float(os.environ.get("LND_RETRY_BACKOFF", 0.5))
+
+    def __init__(self, logger: logging.Logger, base_url: str, tls_verify, socks5h_proxy: str):
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._base_url = base_url
+        self._tls_verify = tls_verify
+        self._socks5h_proxy = socks5h_proxy
+        # connection counters of already closed sessions, see stats()
+        self._closed_connections = 0
+        self._closed_requests = 0
+        self._session, self._adapter = self._build_session(socks5h_proxy)
+
+    def _build_session(self, socks5h_proxy: str) -> tuple[requests.Session, HTTPAdapter]:
+        # POST /v1/invoices is not idempotent: retry it only if the connect failed,
+        # GETs are retried on read errors and gateway status codes as well
+        retry = Retry(total=self.RETRIES, connect=self.RETRIES, read=self.RETRIES, status=self.RETRIES,
+                      allowed_methods=frozenset({"GET"}), status_forcelist={502, 503, 504},
+                      backoff_factor=self.RETRY_BACKOFF, backoff_jitter=self.RETRY_BACKOFF,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.POOL_SIZE, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        if socks5h_proxy:
+            session.proxies = {'http': socks5h_proxy, 'https': socks5h_proxy}
+        return session, adapter
+
+    def configure(self, base_url: str, tls_verify, socks5h_proxy: str):
+        """
+        Atomically swap in a new pool for a changed LND address, TLS setting or proxy.
+        Calls already running finish on the old session.
+        """
+        session, adapter = self._build_session(socks5h_proxy)
+        with self._lock:
+            old_session, old_adapter = self._session, self._adapter
+            connections, requests_done = self._count(old_adapter)
+            self._closed_connections += connections
+            self._closed_requests += requests_done
+            self._session, self._adapter = session, adapter
+            self._base_url = base_url
+            self._tls_verify = tls_verify
+            self._socks5h_proxy = socks5h_proxy
+        old_session.close()
+        self._logger.debug(f"LND client pool rebuilt for {base_url[:16]}...")
+
+    def _snapshot(self) -> tuple[requests.Session, str, object]:
+        with self._lock:
+            return self._session, self._base_url, self._tls_verify
+
+    def get(self, path: str, headers: dict = None, stream: bool = False) -> requests.Response:
+        session, base_url, tls_verify = self._snapshot()
+        # a stream is open for as long as LND keeps it, so no read timeout there
+        timeout = (self.CONNECT_TIMEOUT, None if stream else self.READ_TIMEOUT)
+        return session.get(base_url + path, headers=headers, stream=stream, verify=tls_verify, timeout=timeout)
+
+    def post(self, path: str, headers: dict = None, data: str = None) -> requests.Response:
+        session, base_url, tls_verify = self._snapshot()
+        return session.post(base_url + path, headers=headers, data=data, verify=tls_verify,
+                            timeout=(self.CONNECT_TIMEOUT, self.READ_TIMEOUT))
+
+    @staticmethod
+    def _count(adapter: HTTPAdapter) -> tuple[int, int]:
+        """
+        Sum up opened connections and requests sent over all urllib3 pools of an adapter.
+        :return: (connections, requests)
+        """
+        connections = 0
+        requests_done = 0
+        managers = [adapter.poolmanager] + list(adapter.proxy_manager.values())
+        for manager in managers:
+            for key in manager.pools.keys():
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                connections += pool.num_connections
+                requests_done += pool.num_requests
+        return connections, requests_done
+
+    def stats(self) -> dict:
+        """
+        A request on a pooled connection is a hit, a request that had to open a new connection is a miss.
+        """
+        with self._lock:
+            connections, requests_done = self._count(self._adapter)
+            connections += self._closed_connections
+            requests_done += self._closed_requests
+        return {"pool_size": self.POOL_SIZE,
+                "requests": requests_done,
+                "pool_hits": max(requests_done - connections, 0),
+                "pool_misses": connections}
+
+    def close(self):
+        with self._lock:
+            session = self._session
+        session.close()
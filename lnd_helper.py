@@ -6,12 +6,28 @@ import logging
 import os
 import threading
 import time
-from unittest import TestCase
+from typing import Iterator
 
 import requests
-from requests.exceptions import ChunkedEncodingError
 
+from invoice_store import PendingInvoiceStore, SharedInvoiceStore, SqliteInvoiceBackend
+from lnd_backend import LndBackend
+from lnd_pool import BackendPool
+from metrics import REGISTRY
 from nostr_helper import NostrHelper
+from shared_store import RespClient, StoreError
+from user_registry import UserConfig, UserSnapshot
+from zap_dedup import ZapRequestDedup
+from zap_request import ZapRequest
+
+LND_INVOICE_SECONDS = REGISTRY.histogram("nip57_lnd_invoice_seconds", "Round trip of POST /v1/invoices to LND",
+                                         ("backend",))
+INVOICE_SETTLE_SECONDS = REGISTRY.histogram("nip57_invoice_settle_seconds",
+                                            "From handing out an invoice to its settlement",
+                                            buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600))
+UNCACHED_SETTLEMENTS = REGISTRY.counter("nip57_uncached_settlements_total",
+                                        "Settled invoices without a pending zap request (expired, or not a zap)",
+                                        ("backend",))
 
 
 class LndHelper:
@@ -23,138 +39,411 @@ class LndHelper:
     DYNIP_SECRET = os.environ.get("DYNIP_SECRET", "")  # empty means function deactivated
     DYNIP_PORT = os.environ.get("DYNIP_PORT", "8080")
     TLS_VERIFY = os.environ.get("TLS_VERIFY", "./tls.cert")
-    # secs until we remove a 9734 from mem cache
-    CACHE_TIMEOUT = 120
+    INVOICE_DB = os.environ.get("INVOICE_DB", "")  # empty means pending invoices live in memory only
+    CLEANUP_INTERVAL = float(os.environ.get("INVOICE_CLEANUP_INTERVAL", 113))
+    PROBE_INTERVAL = float(os.environ.get("LND_PROBE_INTERVAL", 30))  # 0 disables the health probes
+    LND_BACKENDS = os.environ.get("LND_BACKENDS", "")  # json file of named LND nodes, empty means none
+    LND_DEFAULT_POOL = os.environ.get("LND_DEFAULT_POOL", "")  # node names, empty means all nodes
+    FAILOVER_ATTEMPTS = int(os.environ.get("LND_FAILOVER_ATTEMPTS", 3))
 
-    def __init__(self, logger: logging.Logger, nostr_helper: NostrHelper):
-        self._invoice_cache = {}
+    def __init__(self, logger: logging.Logger, nostr_helper: NostrHelper, dedup: ZapRequestDedup,
+                 store: RespClient = None):
+        """
+        :param store: shared store for the pending invoices of all workers, None keeps them in this process
+        """
+        if store is not None:
+            self._invoice_cache = SharedInvoiceStore(logger, store)
+        else:
+            backend = SqliteInvoiceBackend(logger, self.INVOICE_DB) if self.INVOICE_DB != "" else None
+            self._invoice_cache = PendingInvoiceStore(logger, backend=backend)
         self._nostr_helper = nostr_helper
-        self._listener_running = False
+        self._dedup = dedup
         self._logger = logger
         if self.TLS_VERIFY.lower() == "false":
             self.TLS_VERIFY = False
+        self._backends_lock = threading.Lock()
+        self._listener_started = False
+        self._default = self._add_backend("default", self.LND_RESTADDR, self.INVOICE_MACAROON, self.TLS_VERIFY,
+                                          self.SOCKS5H_PROXY)
+        # named nodes from LND_BACKENDS and per user nodes from users.json, by name
+        self._backends: dict[str, LndBackend] = {}
+        # names of the nodes written inline in users.json, these follow edits of the file
+        self._user_nodes: set[str] = set()
+        if self.LND_BACKENDS != "":
+            self._load_nodes(self.LND_BACKENDS)
+        self._default_pool = self._build_default_pool()
+        # pools of users.json entries, by their tuple of node names
+        self._pools: dict[tuple, BackendPool] = {}
+        self._invoice_cache.warm_load()
+
+    @classmethod
+    def check_config(cls) -> list[str]:
+        """
+        :return: what is wrong with the LND settings, empty if nothing
+        """
+        problems = []
+        if cls.LND_RESTADDR != "please_set" and not cls.LND_RESTADDR.startswith(("http://", "https://")):
+            problems.append(f"LND_RESTADDR must start with http:// or https://, got {cls.LND_RESTADDR[:16]}...")
+        if cls.INVOICE_MACAROON != "please_set":
+            try:
+                bytes.fromhex(cls.INVOICE_MACAROON)
+            except ValueError:
+                problems.append("INVOICE_MACAROON must be the hex encoded invoice macaroon")
+        if (cls.LND_RESTADDR.startswith("https://") and cls.TLS_VERIFY.lower() != "false"
+                and not os.path.exists(cls.TLS_VERIFY)):
+            problems.append(f"TLS_VERIFY {cls.TLS_VERIFY} does not exist, set the path of LND's tls.cert or false")
+        if cls.LND_BACKENDS != "" and not os.path.isfile(cls.LND_BACKENDS):
+            problems.append(f"LND_BACKENDS {cls.LND_BACKENDS} is no file")
+        return problems
+
+    @classmethod
+    def uses_proxy(cls) -> bool:
+        """
+        :return: True if the default node or a node of LND_BACKENDS is reached through a SOCKS proxy
+        """
+        if cls.SOCKS5H_PROXY != "":
+            return True
+        try:
+            with open(cls.LND_BACKENDS) as nodes_file:
+                nodes = json.load(nodes_file)
+        except (OSError, ValueError):
+            return False
+        return isinstance(nodes, dict) and any(isinstance(node, dict) and node.get("socks5h_proxy")
+                                               for node in nodes.values())
+
+    def _default_configured(self) -> bool:
+        return self.LND_RESTADDR != "please_set"
+
+    def _node_config(self, node: dict) -> tuple:
+        """
+        :return: restaddr, macaroon, tls_verify and socks5h_proxy of a node
+        """
+        tls_verify = node.get("tls_verify", True)
+        if isinstance(tls_verify, str) and tls_verify.lower() == "false":
+            tls_verify = False
+        return node["restaddr"], node["macaroon"], tls_verify, node.get("socks5h_proxy", self.SOCKS5H_PROXY)
+
+    def _node_backend(self, name: str, node: dict) -> LndBackend:
+        return self._add_backend(name, *self._node_config(node))
+
+    def _update_backend(self, backend: LndBackend, node: dict) -> bool:
+        """
+        Apply an edited node to its backend.
+        :return: True if anything changed
+        """
+        restaddr, macaroon, tls_verify, socks5h_proxy = self._node_config(node)
+        changed = False
+        if (restaddr, tls_verify, socks5h_proxy) != (backend.restaddr, backend.tls_verify, backend.socks5h_proxy):
+            backend.configure(restaddr, tls_verify, socks5h_proxy)
+            changed = True
+        if macaroon != backend.macaroon:
+            backend.set_macaroon(macaroon)
+            changed = True
+        return changed
+
+    def _load_nodes(self, path: str):
+        """
+        Read the named nodes, a json object like {"node-a": {"restaddr": ..., "macaroon": ..., "tls_verify": ...}}
+        :raise ValueError: on an unreadable file or a node without restaddr or macaroon
+        """
+        try:
+            with open(path) as nodes_file:
+                nodes = json.load(nodes_file)
+        except OSError as e:
+            raise ValueError(f"LND_BACKENDS {path} can't be read: {e}") from e
+        if not isinstance(nodes, dict):
+            raise ValueError(f"LND_BACKENDS {path} must be an object of name: node")
+        for name, node in nodes.items():
+            if name == "default" or not isinstance(node, dict) or "restaddr" not in node or "macaroon" not in node:
+                raise ValueError(f"LND_BACKENDS node {name} needs restaddr and macaroon (and can't be 'default')")
+            self._backends[name] = self._node_backend(name, node)
+        self._logger.info(f"Loaded {len(nodes)} LND nodes from {path}")
+
+    def _build_default_pool(self) -> BackendPool:
+        if self.LND_DEFAULT_POOL != "":
+            names = [n.strip() for n in self.LND_DEFAULT_POOL.split(",") if n.strip() != ""]
+            unknown = [n for n in names if n != "default" and n not in self._backends]
+            if len(unknown) > 0:
+                raise ValueError(f"LND_DEFAULT_POOL names unknown nodes: {', '.join(unknown)}")
+            backends = [self._default if n == "default" else self._backends[n] for n in names]
+        else:
+            backends = list(self._backends.values())
+            if self._default_configured() or len(backends) == 0:
+                backends.insert(0, self._default)
+        return BackendPool("default", backends)
 
-    def fetch_invoice(self, amount: int, nostr_event_9734: str):
-        with requests.Session() as session:
-            session.proxies = {'http': self.SOCKS5H_PROXY, 'https': self.SOCKS5H_PROXY}
-            description = nostr_event_9734
-            d_hash = hashlib.sha256(description.encode('UTF-8'))
-            b64_d_hash = base64.b64encode(d_hash.digest())
-            headers = {"Content-Type": "application/json; charset=utf-8",
-                       "Grpc-Metadata-macaroon": self.INVOICE_MACAROON}
-            data = {"value_msat": amount,
-                    "description_hash": b64_d_hash.decode("UTF-8")}
-            json_data = json.dumps(data)
-            self._logger.debug("Sending to LND: ")
-            self._logger.debug(json_data)
-            response = session.post(self.LND_RESTADDR + "/v1/invoices", headers=headers, data=json_data,
-                                    verify=self.TLS_VERIFY)
-            self._logger.debug("LND response " + str(response.json()))
-        if response.status_code != 200:
-            self._logger.error("No 200 from lnd: ")
-            self._logger.error(response.json())
-            self._logger.error(response.headers)
+    def _add_backend(self, name: str, restaddr: str, macaroon: str, tls_verify, socks5h_proxy: str) -> LndBackend:
+        backend = LndBackend(self._logger, name, restaddr, macaroon, tls_verify, socks5h_proxy,
+                             self.post_process_payment)
+        backend.subscription.resume_from(*self._invoice_cache.load_indices(name))
+        return backend
+
+    def sync_backends(self, snapshot: UserSnapshot):
+        """
+        Create the per user LND backends of a users.json snapshot, reconfigure the edited ones and drop the
+        cached user pools. Backends no longer referenced keep running, invoices on them may still be paid.
+        """
+        for user in snapshot.users.values():
+            for node in user.lnd or ():
+                name = self._backend_name(node)
+                if isinstance(node, str):
+                    if name not in self._backends:
+                        self._logger.warning(f"User {user.name} refers to unknown LND node {name}")
+                    continue
+                with self._backends_lock:
+                    backend = self._backends.get(name)
+                    if backend is not None:
+                        if name in self._user_nodes and self._update_backend(backend, node):
+                            self._logger.info(f"Reconfigured LND backend {name} for user {user.name}")
+                        continue
+                    backend = self._node_backend(name, node)
+                    self._backends[name] = backend
+                    self._user_nodes.add(name)
+                    if self._listener_started:
+                        backend.subscription.start()
+                self._logger.info(f"Added LND backend {name} for user {user.name}")
+        with self._backends_lock:
+            self._pools = {}
+
+    @staticmethod
+    def _backend_name(node: str | dict) -> str:
+        if isinstance(node, str):
+            return node
+        if "name" in node:
+            return str(node["name"])
+        return "user-" + hashlib.sha256(node["restaddr"].encode()).hexdigest()[:8]
+
+    def pool_for(self, user: UserConfig | None) -> BackendPool | None:
+        """
+        :return: the nodes of the user's "lnd" entry, the default pool for users without one, None if none of
+            the user's nodes is known (the zaps must not end up in the default node's wallet)
+        """
+        if user is None or user.lnd is None:
+            return self._default_pool
+        names = tuple(self._backend_name(node) for node in user.lnd)
+        with self._backends_lock:
+            pool = self._pools.get(names)
+            if pool is None:
+                backends = [self._backends[n] for n in names if n in self._backends]
+                if len(backends) == 0:
+                    return None
+                pool = BackendPool(user.name, backends)
+                self._pools[names] = pool
+        return pool
+
+    def invoice_request(self, amount: int, nostr_event_9734: str, backend: LndBackend) -> tuple[dict, str]:
+        """
+        :return: headers and json body of the POST /v1/invoices for a zap request
+        """
+        description = nostr_event_9734
+        d_hash = hashlib.sha256(description.encode('UTF-8'))
+        b64_d_hash = base64.b64encode(d_hash.digest())
+        headers = {"Content-Type": "application/json; charset=utf-8",
+                   "Grpc-Metadata-macaroon": backend.macaroon}
+        data = {"value_msat": amount,
+                "description_hash": b64_d_hash.decode("UTF-8")}
+        json_data = json.dumps(data)
+        self._logger.debug("Sending to LND: ")
+        self._logger.debug(json_data)
+        return headers, json_data
+
+    def invoice_attempts(self, pool: BackendPool) -> Iterator[LndBackend]:
+        """
+        Yield the backends to ask for an invoice, in this order, until one provides it. The half open
+        trial of a node is only claimed when the node is reached, stopping early leaves the rest untouched.
+        """
+        candidates = pool.candidates()[:self.FAILOVER_ATTEMPTS]
+        # every circuit open: the candidates are all nodes by latency, try them anyway
+        all_open = not any(b.available() for b in pool.backends)
+        for backend in candidates:
+            if backend.try_acquire_trial() or all_open:
+                yield backend
+
+    def invoice_response(self, backend: LndBackend, status_code: int, body: dict, headers, latency: float):
+        LND_INVOICE_SECONDS.labels(backend.name).observe(latency)
+        self._logger.debug("LND response " + str(body))
+        if status_code != 200:
+            backend.record_failure()
+            self._logger.error(f"No 200 from lnd {backend.name}: ")
+            self._logger.error(body)
+            self._logger.error(headers)
             return ""
 
-        return response.json()
+        backend.record_success(latency)
+        return body
 
-    def cache_payment(self, idx, event_kind_9734_json):
-        self._logger.debug("caching open invoice " + idx)
-        self._invoice_cache[idx] = {
-            "timestamp": int(time.time()),
-            "event": event_kind_9734_json,
-            "idx": idx
-        }
-        self._logger.info("Invoice cache length is " + str(len(self._invoice_cache)))
+    def invoice_failed(self, backend: LndBackend, latency: float, error: Exception):
+        LND_INVOICE_SECONDS.labels(backend.name).observe(latency)
+        backend.record_failure()
+        self._logger.error(f"LND connection error at {backend.name} {backend.restaddr[:16]}...: {error}")
 
-    def lnd_state(self):
-        url = self.LND_RESTADDR + '/v1/state'
-        with requests.Session() as session:
-            session.proxies = {'http': self.SOCKS5H_PROXY, 'https': self.SOCKS5H_PROXY}
-            self._logger.debug("Requesting LND state")
+    def fetch_invoice(self, amount: int, nostr_event_9734: str,
+                      pool: BackendPool = None) -> tuple[dict | str, LndBackend | None]:
+        """
+        :return: LND's invoice and the backend that issued it, or ("", None) if no backend did
+        """
+        for backend in self.invoice_attempts(pool or self._default_pool):
+            headers, json_data = self.invoice_request(amount, nostr_event_9734, backend)
+            start = time.perf_counter()
             try:
-                r = session.get(url, verify=self.TLS_VERIFY)
-                return r.json()
-            except requests.exceptions.ConnectionError:
-                self._logger.error(f"LND connection error at {self.LND_RESTADDR}")
-                return {"status": "ERROR", "reason": "LND unreachable"}, 500
-
-    def _listen_for_invoices(self):
-        url = self.LND_RESTADDR + '/v1/invoices/subscribe'
-        session = requests.Session()
-        session.proxies = {'http': self.SOCKS5H_PROXY, 'https': self.SOCKS5H_PROXY}
-        headers = {'Grpc-Metadata-macaroon': self.INVOICE_MACAROON}
-        self._logger.debug("Sending invoice subscribe to LND")
-        response = session.get(url, headers=headers, stream=True, verify=self.TLS_VERIFY)
+                response = backend.client.post("/v1/invoices", headers=headers, data=json_data)
+                body = response.json()
+            except requests.exceptions.RequestException as e:
+                self.invoice_failed(backend, time.perf_counter() - start, e)
+                continue
+            bech32_invoice = self.invoice_response(backend, response.status_code, body, response.headers,
+                                                   time.perf_counter() - start)
+            if bech32_invoice != "":
+                return bech32_invoice, backend
+        return "", None
+
+    def cache_payment(self, idx, zap_request: ZapRequest, backend: LndBackend) -> bool:
+        """
+        :return: False if the shared store is unreachable, the invoice would be paid without a receipt
+        """
+        self._logger.debug(f"caching open invoice {idx} on {backend.name}")
         try:
-            for raw_response in response.iter_lines():
-                json_response = json.loads(raw_response)
-                self._logger.debug(f"Got streamed from LND: {json_response}")
-                if not self.post_process_payment(raw_response):
-                    response.close()
-                    self._listener_running = False
-                    self._logger.info("LND invoice listener closed")
-                    break
-        except ChunkedEncodingError:
-            self._logger.error("LND closed subscription")
-            self._listener_running = False
+            self._invoice_cache.put(backend.key(idx), zap_request)
+        except StoreError as e:
+            self._logger.error(f"Caching open invoice {idx} on {backend.name} failed: {e}")
+            return False
+        return True
+
+    def lnd_state(self):
+        """
+        LND's /v1/state of every backend, their breakers and which pools can issue invoices.
+        The top level has the answer of the default node, if it is used, as before there were several nodes.
+        :return: the state, with a 500 if no pool has a reachable node with a closed circuit
+        """
+        self._logger.debug("Requesting LND state")
+        lnd_states = {}
+        for backend in self._all_backends():
+            try:
+                lnd_states[backend.name] = backend.state()
+            except (requests.exceptions.RequestException, ValueError):
+                self._logger.error(f"LND connection error at {backend.name} {backend.restaddr[:16]}...")
+                lnd_states[backend.name] = None
+        with self._backends_lock:
+            backends = list(self._backends.values())
+            pools = [self._default_pool] + list(self._pools.values())
+        if self._default.name in lnd_states:
+            backends.insert(0, self._default)
+        state = dict(lnd_states.get(self._default.name) or {})
+        state["backends"] = {b.name: {"state": lnd_states.get(b.name), "lnd_client": b.client.stats(),
+                                      "health": b.health(), "available": b.available(),
+                                      "invoice_subscription": b.subscription.state()} for b in backends}
+        state["pools"] = {p.name: {"backends": p.names(),
+                                   "available": any(lnd_states.get(b.name) is not None and b.available()
+                                                    for b in p.backends)} for p in pools}
+        state["default_pool"] = self._default_pool.names()
+        state["invoice_cache"] = self._invoice_cache.stats()
+        state["invoice_listener"] = self._listener_started
+        if not any(p["available"] for p in state["pools"].values()):
+            state["status"] = "ERROR"
+            state["reason"] = "LND unreachable"
+            return state, 500
+        return state
+
+    def _all_backends(self) -> list[LndBackend]:
+        """
+        :return: every backend with a subscription to run and health to probe
+        """
+        with self._backends_lock:
+            backends = list(self._backends.values())
+        if self._default_configured() or self._default in self._default_pool.backends:
+            backends.insert(0, self._default)
+        return backends
 
     def start_invoice_listener(self):
-        if self._listener_running:
-            return
-        self._logger.info("Starting LND invoice listener")
-        listener = threading.Thread(target=self._listen_for_invoices)
-        listener.start()
-        self._listener_running = True
+        with self._backends_lock:
+            self._listener_started = True
+        for backend in self._all_backends():
+            try:
+                # with a shared store another process may have been the listener until now
+                backend.subscription.resume_from(*self._invoice_cache.load_indices(backend.name))
+            except StoreError as e:
+                self._logger.warning(f"Loading the subscription indices of {backend.name} failed: {e}")
+            backend.subscription.start()
 
-    def post_process_payment(self, raw_result: str) -> bool:
+    def stop_invoice_listener(self):
+        with self._backends_lock:
+            self._listener_started = False
+        for backend in self._all_backends():
+            backend.subscription.stop()
+
+    def post_process_payment(self, backend: LndBackend, result: dict):
+        self._process_payment(backend, result)
+        # persist only after the receipt was handed over, a crash in between replays the settlement,
+        # which finds its zap request gone
+        try:
+            self._invoice_cache.save_indices(backend.name, *backend.subscription.indices())
+        except StoreError as e:
+            self._logger.warning(f"Saving the subscription indices of {backend.name} failed: {e}")
+
+    def _process_payment(self, backend: LndBackend, result: dict):
+        settled_at = time.monotonic()
         self._logger.debug("Processing LND input")
-        if len(self._invoice_cache) == 0:
-            self._logger.debug("No invoices in cache, closing subscription")
-            return False
-        result: dict = json.loads(raw_result)
         if "result" not in result:
             self._logger.error("Got unexpected whatever from lnd: " + str(result))
-            return True
+            return
         invoice = result["result"]
         if "settled" not in invoice:
             self._logger.error("No 'settled' in invoice from lnd: " + str(invoice))
-            return True
+            return
         if "value_msat" not in invoice:
             self._logger.error("No 'value_msat' in invoice from lnd: " + str(invoice))
-            return True
+            return
         if not invoice["settled"]:
             self._logger.debug("Ignoring unsettled invoice from lnd: " + str(invoice))
-            return True
+            return
         if "add_index" not in invoice:
             self._logger.error("No 'add_index' in invoice from lnd: " + str(invoice))
-            return True
+            return
         idx = invoice["add_index"]
-        self._logger.info(f"Got payment of {str(invoice["value_msat"])} msats for idx {str(idx)}")
+        self._logger.info(f"Got payment of {str(invoice['value_msat'])} msats for idx {str(idx)} on {backend.name}")
+        key = backend.key(idx)
+        if not self._dedup.first_settlement(key):
+            self._logger.info(f"Ignoring replayed settlement of idx {str(idx)} on {backend.name}")
+            return
         self._logger.debug("Checking for invoice idx: " + str(idx))
-        # improve: Thread lock these ops on _invoice_cache
-        if idx not in self._invoice_cache:
+        try:
+            event = self._invoice_cache.pop(key)
+        except StoreError as e:
+            self._dedup.forget_settlement(key)
+            self._logger.error(f"Looking up settled idx {str(idx)} on {backend.name} failed: {e}")
+            return
+        if event is None:
+            UNCACHED_SETTLEMENTS.labels(backend.name).inc()
             self._logger.info("uncached 'add_index' in invoice from lnd: " + str(invoice))
-            return True
-        event = self._invoice_cache[idx]
-        del self._invoice_cache[idx]
-        self._nostr_helper.confirm_payment(idx, event['event'], json.dumps(invoice))
-        if len(self._invoice_cache) == 0:
-            return False
-        return True
+            return
+        # the zap request leaves the disk before its receipt goes out, a restart must not receipt it again
+        self._invoice_cache.flush()
+        INVOICE_SETTLE_SECONDS.observe(time.time() - event['timestamp'])
+        self._nostr_helper.confirm_payment(idx, event['event'], invoice, settled_at)
 
     def cleanup_invoice_cache(self):
         self._logger.debug(f"running cleanup_invoice_cache in thread {threading.get_native_id()}")
         self._logger.debug(f"{threading.active_count()} Threads active")
-        self._logger.debug("Before: Invoice cache length is " + str(len(self._invoice_cache)))
-        purge_time = int(time.time()) - self.CACHE_TIMEOUT
-        drop_list = []
-        for element in self._invoice_cache.values():
-            if element['timestamp'] < purge_time:
-                drop_list.append(element['idx'])
-        for idx in drop_list:
-            del self._invoice_cache[idx]
-        self._logger.debug("After: Invoice cache length is " + str(len(self._invoice_cache)))
+        dropped = self._invoice_cache.expire()
+        self._logger.debug(f"Dropped {dropped} expired invoices, cache length is {len(self._invoice_cache)}")
+
+    def cache_stats(self) -> dict:
+        return self._invoice_cache.stats()
+
+    def probe_backends(self):
+        for backend in self._all_backends():
+            was_healthy = backend.healthy
+            healthy = backend.probe()
+            if healthy != was_healthy and (was_healthy is not None or not healthy):
+                level = logging.INFO if healthy else logging.WARNING
+                self._logger.log(level, f"LND backend {backend.name} is {'up' if healthy else 'down'}")
+
+    def close(self):
+        with self._backends_lock:
+            backends = [self._default] + list(self._backends.values())
+        for backend in backends:
+            backend.close()
+        self._invoice_cache.close()
 
     def _validate_ip_address(self, ip: str) -> bool:
         try:
@@ -170,20 +459,18 @@ class LndHelper:
             return {"status": "ERROR", "reason": "Denied"}, 403
         if not self._validate_ip_address(ipv4):
             return {"status": "ERROR", "reason": "Denied"}, 403
-        new_addr = f"https://{ipv4}:{port}"
-        if new_addr != self.LND_RESTADDR:
-            #  need a reconnect later
-            self._listener_running = False
-
-        self.LND_RESTADDR = new_addr
+        self.LND_RESTADDR = f"https://{ipv4}:{port}"
         self.TLS_VERIFY = tls_verify
         self.DYNIP_PORT = port
         self.SOCKS5H_PROXY = ""
+        self._default.configure(self.LND_RESTADDR, self.TLS_VERIFY, self.SOCKS5H_PROXY)
         self._logger.info("LND Rest addr set to " + self.LND_RESTADDR)
         return {}, 204
 
 
 if __name__ == '__main__':
+    from unittest import TestCase
+
     testlogger = logging.getLogger("Testcases")
     formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
     ch = logging.StreamHandler()
@@ -192,7 +479,7 @@ if __name__ == '__main__':
     testlogger.setLevel(logging.DEBUG)
     testlogger.addHandler(ch)
     tc = TestCase()
-    helper = LndHelper(testlogger, NostrHelper(testlogger))
+    helper = LndHelper(testlogger, NostrHelper(testlogger), ZapRequestDedup(testlogger))
 
     testlogger.info("Starting Tests")
 
@@ -0,0 +1,32 @@
+import random
+
+from lnd_backend import LndBackend
+
+
+class BackendPool:
+    """
+    The LND nodes that may issue invoices for a user. Each invoice request tries the nodes in the
+    order of candidates(): a random pick weighted by 1/latency first, so faster nodes take more of the
+    load without starving the others, then the remaining nodes by latency. Nodes with an open circuit
+    are left out unless every node is out.
+    """
+
+    def __init__(self, name: str, backends: list[LndBackend]):
+        if len(backends) == 0:
+            raise ValueError(f"LND pool {name} has no backends")
+        self.name = name
+        self.backends = backends
+
+    def candidates(self) -> list[LndBackend]:
+        available = [b for b in self.backends if b.available()]
+        if len(available) == 0:
+            # better a slow try than failing outright, a node may be back before its cooldown ends
+            return sorted(self.backends, key=lambda b: b.latency)
+        if len(available) == 1:
+            return available
+        weights = [1.0 / max(b.latency, 0.001) for b in available]
+        first = random.choices(available, weights)[0]
+        return [first] + sorted((b for b in available if b is not first), key=lambda b: b.latency)
+
+    def names(self) -> list[str]:
+        return [b.name for b in self.backends]
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import urllib.parse
+from collections import OrderedDict
+from typing import Callable
+
+from user_registry import UserConfig
+
+NIP05_NAME = re.compile(r"^[-a-z0-9._]+$")
+
+
+def check_nip05_rules(name: str) -> bool:
+    return NIP05_NAME.match(name.lower()) is not None
+
+
+class CachedResponse:
+    __slots__ = ("body", "etag", "status")
+
+    def __init__(self, body: dict, status: int = 200):
+        self.body = json.dumps(body, separators=(',', ':')).encode()
+        # unquoted, as werkzeug compares it
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+        self.status = status
+
+
+class LnurlpResponseCache:
+    """
+    Serialized /.well-known/lnurlp/<username> responses. Users from users.json are built once per load,
+    names not in users.json are built on first request and kept in a bounded LRU, so the endpoint only
+    does a dict lookup in the common case.
+    """
+    UNKNOWN_CACHE_SIZE = int(os.environ.get("LNURLP_UNKNOWN_CACHE_SIZE", 10000))
+    MAX_AGE = int(os.environ.get("LNURLP_MAX_AGE", 300))
+
+    def __init__(self, logger: logging.Logger, lnurl_origin: str, defaults: Callable[[str], UserConfig],
+                 nostr_pubkey: str, server_version: str):
+        """
+        :param defaults: config for names not in users.json
+        """
+        self._logger = logger
+        self._lnurl_origin = lnurl_origin
+        self._netloc = urllib.parse.urlparse(lnurl_origin).netloc
+        self._defaults = defaults
+        self._nostr_pubkey = nostr_pubkey
+        self._server_version = server_version
+        self.cache_control = f"public, max-age={self.MAX_AGE}"
+        self.not_found = CachedResponse({"status": "ERROR", "reason": "User unknown"}, 404)
+        self._known: dict[str, CachedResponse] = {}
+        self._unknown: OrderedDict[str, CachedResponse] = OrderedDict()
+        self._unknown_lock = threading.Lock()
+
+    def _build(self, user: UserConfig) -> CachedResponse:
+        username = user.name
+        return CachedResponse({
+            "callback": f"{self._lnurl_origin}/lnurlp/invoice/{username}",
+            "maxSendable": user.max_sendable,
+            "minSendable": user.min_sendable,
+            "metadata": [["text/identifier", username + "@" + self._netloc],
+                         ["text/plain", "Sats for " + username]],
+            "tag": "payRequest",
+            "allowsNostr": True,
+            "commentAllowed": user.comment_allowed,
+            "status": "OK",
+            "nostrPubkey": self._nostr_pubkey,
+            "server_version": self._server_version
+        })
+
+    def load(self, users: dict[str, UserConfig]):
+        """
+        Prebuild the responses for all valid names in users and swap them in at once.
+        """
+        known = {name: self._build(user) for name, user in users.items() if check_nip05_rules(name)}
+        self._known = known
+        with self._unknown_lock:
+            self._unknown.clear()
+        self._logger.info(f"Prebuilt lnurlp responses for {len(known)} users")
+
+    def get(self, username: str) -> CachedResponse:
+        response = self._known.get(username)
+        if response is not None:
+            return response
+        with self._unknown_lock:
+            response = self._unknown.get(username)
+            if response is not None:
+                self._unknown.move_to_end(username)
+                return response
+        if not check_nip05_rules(username):
+            self._logger.warning(f"WARN: {username} is not a valid NIP-05 name")
+            response = self.not_found
+        else:
+            self._logger.info(f"INFO: {username} is not in users.json list")
+            response = self._build(self._defaults(username))
+        with self._unknown_lock:
+            self._unknown[username] = response
+            if len(self._unknown) > self.UNKNOWN_CACHE_SIZE:
+                self._unknown.popitem(last=False)
+        return response
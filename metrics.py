@@ -0,0 +1,260 @@
+import bisect
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable
+
+# latency buckets in secs, from a local signature check up to a slow Tor round trip
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric(ABC):
+    """
+    A metric family, rendered in the Prometheus text format.
+    """
+    TYPE = ""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.TYPE}"]
+
+    @abstractmethod
+    def render(self) -> list[str]:
+        """
+        :return: the lines of the family, HELP and TYPE first
+        """
+
+
+class _LabeledMetric(_Metric):
+    """
+    A metric family with children. With label names, labels(*values) returns the child to update. The number of
+    children is capped at MAX_SERIES, further label values all land in one "other" child so label
+    values taken from requests (relay urls) can't grow the registry without bound.
+    """
+    MAX_SERIES = int(os.environ.get("METRICS_MAX_SERIES", 100))
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        super().__init__(name, help_text)
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: dict[tuple, object] = {}
+
+    @abstractmethod
+    def _new_child(self):
+        """
+        :return: a child holding the values of one label combination
+        """
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is not None:
+            return child
+        with self._lock:
+            if values not in self._children:
+                if len(self._children) >= self.MAX_SERIES:
+                    values = ("other",) * len(self.labelnames)
+                    if values in self._children:
+                        return self._children[values]
+                self._children[values] = self._new_child()
+            return self._children[values]
+
+    def _series(self) -> list[tuple[tuple, object]]:
+        with self._lock:
+            return list(self._children.items())
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        for values, child in self._series():
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    @abstractmethod
+    def _render_child(self, values: tuple, child) -> list[str]:
+        """
+        :return: the sample lines of one child
+        """
+
+
+class _CounterChild:
+    __slots__ = ("_lock", "value")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_LabeledMetric):
+    TYPE = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        super().__init__(name, help_text, labelnames)
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+    def _render_child(self, values: tuple, child: _CounterChild) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {child.value}"]
+
+
+class _HistogramChild:
+    __slots__ = ("_lock", "_bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple):
+        self._lock = threading.Lock()
+        self._bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Histogram(_LabeledMetric):
+    TYPE = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help_text, labelnames)
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def _render_child(self, values: tuple, child: _HistogramChild) -> list[str]:
+        with child._lock:
+            counts, total, count = list(child.counts), child.sum, child.count
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            cumulative += n
+            le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    A gauge read from a callback at scrape time, so nothing needs updating on the hot path.
+    A callback returning None (value unknown right now) leaves the sample out.
+    """
+    TYPE = "gauge"
+
+    def __init__(self, name: str, help_text: str, func: Callable[[], float | None]):
+        super().__init__(name, help_text)
+        self._func = func
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        value = self._func()
+        if value is not None:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+class Registry:
+    enabled = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name: str, help_text: str, func: Callable[[], float | None]) -> Gauge:
+        return self._register(Gauge(name, help_text, func))
+
+    def render(self) -> str:
+        """
+        :return: all metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class _NullMetric:
+    """
+    Stands in for every metric while metrics are disabled: all updates are empty method calls.
+    """
+    __slots__ = ()
+
+    def labels(self, *values):
+        return self
+
+    def inc(self, amount: float = 1.0):
+        pass
+
+    def observe(self, value: float):
+        pass
+
+
+class NullRegistry:
+    enabled = False
+    _null = _NullMetric()
+
+    def counter(self, name: str, help_text: str, labelnames: tuple = ()) -> _NullMetric:
+        return self._null
+
+    def histogram(self, name: str, help_text: str, labelnames: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> _NullMetric:
+        return self._null
+
+    def gauge(self, name: str, help_text: str, func: Callable[[], float | None]) -> _NullMetric:
+        return self._null
+
+    def render(self) -> str:
+        return ""
+
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "false").lower() == "true"
+REGISTRY: Registry | NullRegistry = Registry() if METRICS_ENABLED else NullRegistry()
@@ -1,20 +1,10 @@
-import json
+import importlib.util
 import logging
 import os
-import re
+import signal
+import socket
 import sys
-import threading
-import time
-import urllib.parse
-
-import requests
-from flask import Flask
-from flask import request
-from flask_cors import CORS
-from waitress import serve
-
-from lnd_helper import LndHelper
-from nostr_helper import NostrHelper
+import tempfile
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO, stream=sys.stdout,
@@ -22,110 +12,118 @@ if __name__ == '__main__':
     logging.getLogger().setLevel(logging.INFO)
 
     app_logger = logging.getLogger("nip57Server")
-    app = Flask("nip57Server")
-    CORS(app)
     LNURL_ORIGIN = os.environ.get("LNURL_ORIGIN", "http://localhost:8080")
     SERVER_PORT = os.environ.get("SERVER_PORT", "8080")
+    SERVER_MODE = os.environ.get("SERVER_MODE", "threads")  # or async, needs aiohttp
     MIN_SENDABLE = os.environ.get("MIN_SENDABLE", 1000)
     MAX_SENDABLE = os.environ.get("MAX_SENDABLE", 1000000000)
+    STATS_LOG_INTERVAL = float(os.environ.get("STATS_LOG_INTERVAL", 600))  # 0 disables the stats log line
+    WORKERS = os.environ.get("WORKERS", "1")
+    # redis://host:port/db or unix:///path of the store shared by all workers and hosts, empty means none,
+    # or a stand-in on SHARED_STORE_SOCKET with WORKERS > 1
+    SHARED_STORE = os.environ.get("SHARED_STORE", "")
+    # in the temp dir by default, the working directory may not be writable (it is not in the Docker image)
+    SHARED_STORE_SOCKET = os.path.abspath(os.environ.get("SHARED_STORE_SOCKET", "") or os.path.join(
+        tempfile.gettempdir(), f"nip57_store_{SERVER_PORT}.sock"))
     NIP57S_VERSION = "NIP57S V1.1.0"
-    app_logger.debug("Loading file users.json")
-    users_file = open('users.json')
-    users: dict = json.load(users_file)
-    users_file.close()
-    app_logger.debug(f"Found {len(users)} users in users.json")
+    listen_socket = None
+    if SERVER_PORT.isdigit():
+        # taken before the imports below: a wallet calling in during a cold start waits in the listen backlog
+        # until the server is up instead of getting connection refused
+        try:
+            listen_socket = socket.create_server(("0.0.0.0", int(SERVER_PORT)), backlog=1024)
+        except OSError as e:
+            app_logger.error(f"Config: SERVER_PORT {SERVER_PORT} can't be listened on: {e}")
+            sys.exit(2)
+
+    from admission import AdmissionControl
+    from leader_election import LeaderElection
+    from lnd_helper import LndHelper
+    from lnurlp_cache import LnurlpResponseCache
+    from metrics import METRICS_ENABLED, REGISTRY
+    from nostr_helper import NostrHelper
+    from scheduler import Scheduler
+    from shared_store import RespClient
+    from user_registry import UserRegistry
+    from zap_dedup import ZapRequestDedup
+    from workers import WorkerSupervisor
+    from zap_endpoints import ZapEndpoints
+
+    # all settings a worker would only trip over later, checked before forking or starting anything
+    problems = NostrHelper.check_config() + LndHelper.check_config()
+    if SERVER_MODE not in ("threads", "async"):
+        problems.append(f"SERVER_MODE must be threads or async, got {SERVER_MODE}")
+    elif SERVER_MODE == "async" and importlib.util.find_spec("aiohttp") is None:
+        problems.append("SERVER_MODE=async needs the aiohttp package")
+    elif SERVER_MODE == "async" and LndHelper.uses_proxy() and importlib.util.find_spec("aiohttp_socks") is None:
+        problems.append("SERVER_MODE=async with a SOCKS5H_PROXY needs the aiohttp-socks package")
+    for name, value in (("SERVER_PORT", SERVER_PORT), ("WORKERS", WORKERS), ("MIN_SENDABLE", MIN_SENDABLE),
+                        ("MAX_SENDABLE", MAX_SENDABLE)):
+        if not str(value).isdigit() or int(value) == 0:
+            problems.append(f"{name} must be a positive whole number, got {value}")
+    if SHARED_STORE != "" and not SHARED_STORE.startswith(("redis://", "unix://")):
+        problems.append(f"SHARED_STORE must start with redis:// or unix://, got {SHARED_STORE.split('@')[-1]}")
+    if (SHARED_STORE == "" and WORKERS.isdigit() and int(WORKERS) > 1
+            and not os.access(os.path.dirname(SHARED_STORE_SOCKET), os.W_OK)):
+        problems.append(f"SHARED_STORE_SOCKET {SHARED_STORE_SOCKET} is in a directory the server can't write to")
+    if len(problems) > 0:
+        for problem in problems:
+            app_logger.error("Config: " + problem)
+        sys.exit(2)
+    WORKERS = int(WORKERS)
+    if WORKERS > 1:
+        # fork before anything starts a thread
+        store_socket = None
+        if SHARED_STORE == "":
+            store_socket = SHARED_STORE_SOCKET
+            SHARED_STORE = "unix://" + store_socket
+        listen_socket = WorkerSupervisor(app_logger, WORKERS, listen_socket, store_socket).run()
+    store = RespClient(SHARED_STORE) if SHARED_STORE != "" else None
     nostr_helper: NostrHelper = NostrHelper(app_logger)
-    lnd_helper: LndHelper = LndHelper(app_logger, nostr_helper)
-
-
-    def checkNIP05Rules(name: str)->bool:
-        pattern = r"^[-a-z0-9._]+$"
-        return re.match(pattern, name.lower()) is not None
-
-
-    def cleanup_cron():
-        time.sleep(113)  # whatever...
-        lnd_helper.cleanup_invoice_cache()
-        threading.Thread(target=cleanup_cron).start()
-
-
-    @app.route('/.well-known/lnurlp/<string:username>')
-    def lnurlp(username):
-        app_logger.debug("got lnurlp request for: " + username)
-        if checkNIP05Rules(username) is not True:
-            app_logger.warning(f"WARN: {username} is not a valid NIP-05 name")
-            return {"status": "ERROR", "reason": "User unknown"}, 404
-        parsed_url = urllib.parse.urlparse(LNURL_ORIGIN)
-        if users.get(username) is None:
-            app_logger.info(f"INFO: {username} is not in users.json list")
-        return {
-            "callback": f"{LNURL_ORIGIN}/lnurlp/invoice/{username}",
-            "maxSendable": int(MAX_SENDABLE),
-            "minSendable": int(MIN_SENDABLE),
-            "metadata": [["text/identifier", username + "@" + parsed_url.netloc],
-                         ["text/plain", "Sats for " + username]],
-            "tag": "payRequest",
-            "allowsNostr": True,
-            "commentAllowed": 255,
-            "status": "OK",
-            "nostrPubkey": nostr_helper.get_zapper_hexpub(),
-            "server_version": NIP57S_VERSION
-        }
-
-
-    @app.route('/lnurlp/state')
-    def state():
-        return lnd_helper.lnd_state()
-
-
-    @app.route('/lnurlp/set_clearnet')
-    def set_clearnet():
-        app_logger.debug("got set_clearnet request")
-
-        secret = request.args.get(key='secret', type=str)
-        if secret is None:
-            return {"status": "ERROR", "reason": "No secret given"}, 403
-
-        ipv4 = request.args.get(key='ipv4', type=str)
-        if ipv4 is None:
-            return {"status": "ERROR", "reason": "No valid IP given"}, 400
-
-        port = request.args.get(key='port', type=int)
-        if port is None:
-            port = lnd_helper.DYNIP_PORT
-
-        tls_verify = request.args.get(key='tls_verify', type=str)
-        if tls_verify is None:
-            tls_verify = lnd_helper.TLS_VERIFY
-        elif tls_verify.lower() == "false":
-            requests.packages.urllib3.disable_warnings()
-            tls_verify = False
-
-        return lnd_helper.set_clearnet(ipv4=ipv4, secret=secret, port=port, tls_verify=tls_verify)
-
-
-    @app.route('/lnurlp/invoice/<string:username>')
-    def invoice(username):
-        amount = request.args.get(key='amount', type=int)
-        if amount is None:
-            return {"status": "ERROR", "reason": "No valid amount given"}, 400
-
-        app_logger.info(f"got invoice request for {username} amount {str(amount)} msats")
-
-        nostr = request.args.get(key='nostr', type=str)
-        if nostr is None:
-            return {"status": "ERROR", "reason": "No valid nostr given"}, 400
-        if not nostr_helper.check_9734_event(nostr, amount):
-            return {"status": "ERROR", "reason": "nostr event is not a valid kind 9734"}, 400
-
-        bech32_invoice = lnd_helper.fetch_invoice(amount, urllib.parse.unquote_plus(nostr))
-        if bech32_invoice == "":
-            return {"status": "ERROR", "reason": "LND did not provide an invoice"}, 500
-
-        lnd_helper.cache_payment(bech32_invoice["add_index"], urllib.parse.unquote_plus(nostr))
-        lnd_helper.start_invoice_listener()
-
-        return {"status": "OK", "pr": bech32_invoice["payment_request"], "routes": []}
+    dedup = ZapRequestDedup(app_logger, store)
+    lnd_helper: LndHelper = LndHelper(app_logger, nostr_helper, dedup, store)
+    # with a shared store one process of all holds the LND subscriptions, else this one does
+    election = LeaderElection(app_logger, store, lnd_helper.start_invoice_listener,
+                              lnd_helper.stop_invoice_listener) if store is not None else None
+    user_registry = UserRegistry(app_logger, 'users.json', MIN_SENDABLE, MAX_SENDABLE)
+    lnurlp_cache = LnurlpResponseCache(app_logger, LNURL_ORIGIN, user_registry.defaults,
+                                       nostr_helper.get_zapper_hexpub(), NIP57S_VERSION)
+    user_registry.add_listener(lambda snapshot: lnurlp_cache.load(snapshot.users))
+    user_registry.add_listener(lnd_helper.sync_backends)
+    admission = AdmissionControl(app_logger)
+    endpoints = ZapEndpoints(app_logger, user_registry, lnurlp_cache, nostr_helper, lnd_helper, admission,
+                             dedup)
+    scheduler = Scheduler(app_logger)
+    # the lease must be renewed on time, not after an lnd-probe waiting out a Tor timeout
+    election_scheduler = Scheduler(app_logger, "leader-election")
+    REGISTRY.gauge("nip57_open_invoices", "Invoices waiting for their payment",
+                   lambda: lnd_helper.cache_stats()["size"])
+    REGISTRY.gauge("nip57_receipts_queued", "Zap receipts waiting for a publisher thread",
+                   lambda: nostr_helper.relay_stats()["queued"])
+    REGISTRY.gauge("nip57_leader", "1 if this process holds the LND invoice subscriptions",
+                   lambda: 1 if election is None or election.is_leader() else 0)
+
+
+    def reload_users(signum, frame):
+        user_registry.reload()
+
+
+    def shutdown(signum, frame):
+        # unwinds serve() in the main thread, the finally below closes everything
+        app_logger.info("Got SIGTERM, shutting down")
+        raise SystemExit(0)
+
+
+    def log_stats():
+        publisher = nostr_helper.relay_stats()
+        cache = lnd_helper.cache_stats()
+        failures = sum(job["failures"] for s in (scheduler, election_scheduler) for job in s.stats().values())
+        shed = sum(admission.stats()["shed"].values())
+        repeated = dedup.stats()["hits"]
+        app_logger.info(f"Stats: {cache['size']} open invoices, {cache['expired']} expired, "
+                        f"{publisher['queued']} receipts queued, {publisher['dropped']} dropped, "
+                        f"{len(publisher['relays'])} relay connections, {shed} requests shed, "
+                        f"{repeated} repeated zap requests, {failures} failed jobs")
 
 
     app_logger.info(f"nip57_server {NIP57S_VERSION} starting on port " + str(SERVER_PORT))
@@ -133,6 +131,7 @@ if __name__ == '__main__':
     app_logger.info("GitHub: https://github.com/raymonostr/nip57-server")
     app_logger.info("A server to receive nostr nip-57 zaps to my own self-custodial LND server.")
     app_logger.info("This software is provided AS IS without any warranty. Use it at your own risk.")
+    app_logger.info("Config SERVER_MODE: " + str(SERVER_MODE))
     app_logger.info("Config LNURL_ORIGIN: " + str(LNURL_ORIGIN))
     app_logger.info("Config MIN_SENDABLE: " + str(MIN_SENDABLE))
     app_logger.info("Config MAX_SENDABLE: " + str(MAX_SENDABLE))
@@ -143,6 +142,42 @@ if __name__ == '__main__':
     app_logger.info("Config ZAPPER_KEY: " + str(nostr_helper.ZAPPER_KEY)[:14] + "...")
     app_logger.info("Config DYNIP_SECRET: " + str(lnd_helper.DYNIP_SECRET)[:3] + "...")
     app_logger.info("Config TLS_VERIFY: " + str(lnd_helper.TLS_VERIFY))
-
-    threading.Thread(target=cleanup_cron).start()
-    serve(app, host="0.0.0.0", port=SERVER_PORT)
+    app_logger.info("Config INVOICE_DB: " + str(lnd_helper.INVOICE_DB))
+    app_logger.info("Config LND_BACKENDS: " + str(lnd_helper.LND_BACKENDS))
+    app_logger.info("Config METRICS_ENABLED: " + str(METRICS_ENABLED))
+    app_logger.info("Config WORKERS: " + str(WORKERS))
+    app_logger.info("Config SHARED_STORE: " + SHARED_STORE.split("@")[-1])
+
+    user_registry.load()
+    signal.signal(signal.SIGHUP, reload_users)
+    signal.signal(signal.SIGTERM, shutdown)
+    scheduler.every("invoice-cleanup", lnd_helper.CLEANUP_INTERVAL, lnd_helper.cleanup_invoice_cache)
+    scheduler.every("dedup-expire", lnd_helper.CLEANUP_INTERVAL, dedup.expire)
+    scheduler.every("users-reload", user_registry.RELOAD_INTERVAL, user_registry.check_for_changes)
+    scheduler.every("lnd-probe", lnd_helper.PROBE_INTERVAL, lnd_helper.probe_backends, delay=0)
+    scheduler.every("relay-evict", nostr_helper.RELAY_EVICT_INTERVAL, nostr_helper.evict_idle_relays)
+    scheduler.every("rate-limit-evict", admission.EVICT_INTERVAL, admission.evict_idle)
+    scheduler.every("stats-log", STATS_LOG_INTERVAL, log_stats)
+    if election is not None:
+        election_scheduler.every("leader-election", election.renew_interval, election.tick, delay=0)
+        election_scheduler.start()
+    scheduler.start()
+    if election is None:
+        lnd_helper.start_invoice_listener()
+    try:
+        if SERVER_MODE == "async":
+            from async_server import serve_async
+            serve_async(app_logger, endpoints, lnd_helper, host="0.0.0.0", port=SERVER_PORT, sock=listen_socket)
+        else:
+            # imported here, the async mode never needs Flask
+            from flask_server import serve_threads
+            serve_threads(app_logger, endpoints, host="0.0.0.0", port=SERVER_PORT, sock=listen_socket)
+    finally:
+        scheduler.stop()
+        election_scheduler.stop()
+        if election is not None:
+            election.resign()
+        lnd_helper.close()
+        nostr_helper.close()
+        if store is not None:
+            store.close()
@@ -1,142 +1,220 @@
-import json
 import logging
 import os
-import ssl
+import threading
+import time
 import urllib.parse
-from unittest import TestCase
 
-from nostr.event import Event
-from nostr.key import PublicKey, PrivateKey
-from nostr.relay import Relay
-from nostr.relay_manager import RelayManager, RelayPolicy
+import secp256k1
 
+from batcher import Batcher
+from event_verifier import EventVerifier
+from metrics import REGISTRY
+from zap_request import ZapRequest
 
-class XRelay(Relay):
-    _event: Event = None
-    _logger: logging.Logger = None
-
-    def set_on_open_event(self, event: Event, logger: logging.Logger):
-        self._event = event
-        self._logger = logger
-
-    def _on_open(self, class_obj):
-        self.connected = True
-        if self._event is not None:
-            msg = self._event.to_message()
-            self._logger.debug("Publishing on " + self.url)
-            self.publish(msg)
-            self._logger.debug("Closing " + self.url)
-            self.close()
-
-
-class XRelayManager(RelayManager):
-    def add_x_relay(self, url: str, event: Event, logger: logging.Logger):
-        policy = RelayPolicy(True, True)
-        relay = XRelay(url, policy, self.message_pool, {})
-        relay.set_on_open_event(event, logger)
-        self.relays[url] = relay
+CHECK_9734_SECONDS = REGISTRY.histogram("nip57_check_9734_seconds", "Checking a decoded zap request")
+RECEIPT_BATCH_SIZE = REGISTRY.histogram("nip57_receipt_batch_size", "Settlements signed and published together",
+                                        buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
 
 
 class NostrHelper:
     ZAPPER_KEY = os.environ.get("ZAPPER_KEY", "please set")
-    DEFAULT_RELAYS = ["wss://nostr.mom/", "wss://nostr-pub.wellorder.net/", "wss://relay.damus.io/", "wss://nos.lol/"]
-
-    _private_key: PrivateKey = PrivateKey(bytes.fromhex(ZAPPER_KEY))
-    _public_key: PublicKey = _private_key.public_key
+    DEFAULT_RELAYS = [r for r in os.environ.get(
+        "DEFAULT_RELAYS", "wss://nostr.mom/,wss://nostr-pub.wellorder.net/,wss://relay.damus.io/,wss://nos.lol/"
+    ).split(",") if r != ""]
+    # secs settlements are collected to sign and publish together, and at most how many
+    RECEIPT_BATCH_WINDOW = float(os.environ.get("RECEIPT_BATCH_WINDOW", 0.005))
+    RECEIPT_BATCH_MAX = int(os.environ.get("RECEIPT_BATCH_MAX", 500))
+    RELAY_EVICT_INTERVAL = float(os.environ.get("RELAY_EVICT_INTERVAL", 60))
 
     def __init__(self, logger: logging.Logger):
+        """
+        :raise ValueError: if ZAPPER_KEY is no valid private key
+        """
         self._logger = logger
+        # derived once, nostr's sign_event would parse the secret for every signature
+        self._signing_key = self.parse_zapper_key(self.ZAPPER_KEY)
+        # x-only public key of BIP-340, as nostr wants it
+        self._public_key_hex = self._signing_key.pubkey.serialize()[1:].hex()
+        self._verifier = EventVerifier(logger)
+        # the relay and websocket stack is imported and started with the first settlement, see _relays()
+        self._relays_lock = threading.Lock()
+        self._relay_pool = None
+        self._publisher = None
+        self._receipts = Batcher(logger, "receipt-batcher", self._confirm_batch, self.RECEIPT_BATCH_WINDOW,
+                                 self.RECEIPT_BATCH_MAX)
+
+    @staticmethod
+    def parse_zapper_key(hex_key: str) -> secp256k1.PrivateKey:
+        """
+        :param hex_key: 32 bytes of hex
+        :raise ValueError: with what is wrong about the key
+        """
+        if hex_key == "please set":
+            raise ValueError("ZAPPER_KEY is not set, it needs the hex private key to sign the zap receipts with")
+        if hex_key.startswith("nsec"):
+            raise ValueError("ZAPPER_KEY must be the hex private key, not the nsec")
+        try:
+            secret = bytes.fromhex(hex_key)
+        except ValueError:
+            raise ValueError("ZAPPER_KEY must be the hex private key, it has non-hex characters") from None
+        if len(secret) != 32:
+            raise ValueError(f"ZAPPER_KEY must be 64 hex characters, it has {len(hex_key)}")
+        try:
+            return secp256k1.PrivateKey(secret)
+        except Exception:
+            # secp256k1 raises a bare Exception for 0 and keys beyond the curve order
+            raise ValueError("ZAPPER_KEY is no valid secp256k1 private key") from None
 
-    def _count_tag(self, tags: list[list[str]], tag: str) -> int:
-        n = 0
-        for inner_tags in tags:
-            if inner_tags[0] == tag:
-                n += 1
-        return n
-
-    def _get_tag(self, tags: list[list[str]], tag: str) -> list[str]:
-        for inner_tags in tags:
-            if inner_tags[0] == tag:
-                return inner_tags
-        return []
+    @classmethod
+    def check_config(cls) -> list[str]:
+        """
+        :return: what is wrong with the nostr settings, empty if nothing
+        """
+        problems = []
+        try:
+            cls.parse_zapper_key(cls.ZAPPER_KEY)
+        except ValueError as e:
+            problems.append(str(e))
+        invalid = [r for r in cls.DEFAULT_RELAYS if not r.startswith(("ws://", "wss://"))]
+        if len(invalid) > 0:
+            problems.append(f"DEFAULT_RELAYS must be ws:// or wss:// urls, got {', '.join(invalid)}")
+        return problems
+
+    def _relays(self):
+        """
+        :return: the ReceiptPublisher, created on first use
+        """
+        with self._relays_lock:
+            if self._publisher is None:
+                # imported here, websocket-client is the slowest import of all and only the process
+                # publishing the receipts needs it
+                from relay_pool import ReceiptPublisher, RelayPool
+                self._relay_pool = RelayPool(self._logger)
+                self._publisher = ReceiptPublisher(self._logger, self._relay_pool)
+            return self._publisher
 
     def get_zapper_hexpub(self):
-        return self._public_key.hex()
+        return self._public_key_hex
     
-    def check_9734_event(self, nostr_json_encoded: str, amount: int) -> bool:
+    @staticmethod
+    def decode_9734_event(nostr_json_encoded: str) -> ZapRequest | None:
         """
-        Check event for https://github.com/nostr-protocol/nips/blob/master/57.md App D
-        :param amount: amount in msat
         :param nostr_json_encoded: Urlencoded kind 9734 event
-        :return: true if event is valid, else false
+        :return: the decoded event, not checked yet, or None if it is no json object
         """
         try:
-            nostr_json = urllib.parse.unquote_plus(nostr_json_encoded)
-            nostr = json.loads(nostr_json)
+            return ZapRequest.from_json(urllib.parse.unquote_plus(nostr_json_encoded))
         except ValueError:
-            return False
+            return None
+
+    def verify_9734_event(self, zap_request: ZapRequest, amount: int) -> bool:
+        """
+        The checks of NIP-57 App D on a decoded event, signature included.
+        :param amount: amount in msat
+        """
+        start = time.perf_counter()
+        valid = self._verify_9734_event(zap_request, amount)
+        CHECK_9734_SECONDS.observe(time.perf_counter() - start)
+        return valid
+
+    def _verify_9734_event(self, zap_request: ZapRequest, amount: int) -> bool:
+        nostr = zap_request.event
         if (("kind" not in nostr) or ("tags" not in nostr) or ("sig" not in nostr)
-                or ("pubkey" not in nostr) or ("id" not in nostr)):
+                or ("pubkey" not in nostr) or ("id" not in nostr)
+                or ("created_at" not in nostr) or ("content" not in nostr)):
             return False
-        if nostr["kind"] != 9734:
+        if zap_request.kind != 9734:
             return False
-        if self._count_tag(nostr["tags"], "p") != 1:
+        if zap_request.count_tag("p") != 1:
             return False
-        if self._count_tag(nostr["tags"], "e") > 1:
+        if zap_request.count_tag("e") > 1:
             return False
-        if self._count_tag(nostr["tags"], "amount") == 1:
-            tag = self._get_tag(nostr["tags"], "amount")
-            if int(tag[1]) != amount:
+        if zap_request.count_tag("amount") == 1:
+            tag = zap_request.get_tag("amount")
+            try:
+                if int(tag[1]) != amount:
+                    return False
+            except (IndexError, ValueError):
                 return False
-        pub_key = PublicKey(bytes.fromhex(nostr["pubkey"]))
-        verified = pub_key.verify_signed_message_hash(nostr["id"], nostr["sig"])
-        if not verified:
+        if not self._verifier.verify(nostr):
             return False
 
         return True
 
-    def get_relays_from_9734(self, event_9734_json) -> list[str]:
-        nostr_9734 = json.loads(event_9734_json)
-        if self._count_tag(nostr_9734["tags"], "relays") != 1:
-            return []
-        relay_tag = self._get_tag(nostr_9734["tags"], "relays")
-        del relay_tag[0]
-        return relay_tag
-
     def add_default_relays(self, relays: list[str]):
         for r in self.DEFAULT_RELAYS:
             if r not in relays:
                 relays.append(r)
         return relays
 
-    def confirm_payment(self, idx, event_9734_json, lnd_invoice_json):
+    def confirm_payment(self, idx, zap_request: ZapRequest, lnd_invoice: dict, settled_at: float = None):
+        """
+        Queue the kind 9735 receipt for a settled invoice, it is signed and published with the other
+        settlements of the next few ms.
+        :param settled_at: time.monotonic() when the settlement came in, for the publish latency metric
+        """
+        if settled_at is None:
+            settled_at = time.monotonic()
+        self._receipts.add((idx, zap_request, lnd_invoice, settled_at))
+
+    def _confirm_batch(self, settlements: list[tuple]):
+        RECEIPT_BATCH_SIZE.observe(len(settlements))
+        by_relay: dict[str, list[tuple[str, str, float]]] = {}
+        for idx, zap_request, lnd_invoice, settled_at in settlements:
+            # one broken settlement must not cost the receipts of the rest of the batch
+            try:
+                nostr_event = self._receipt_event(idx, zap_request, lnd_invoice)
+                message = nostr_event.to_message()
+                relays = self.add_default_relays(zap_request.relays())
+            except Exception:
+                self._logger.exception(f"Skipping the 9735 event for idx {idx}, it can't be built")
+                continue
+            self._logger.debug(message)
+            for url in relays:
+                by_relay.setdefault(url, []).append((nostr_event.id, message, settled_at))
+        self._logger.info(f"Sending {len(settlements)} 9735 events to {len(by_relay)} relays now")
+        self._relays().publish_batch(by_relay)
+
+    def _receipt_event(self, idx, zap_request: ZapRequest, lnd_invoice: dict):
         self._logger.debug(f"Creating event kind 9735 for idx {idx}")
-        self._logger.debug(f"Have 9734 Event: {event_9734_json}")
-        self._logger.debug(f"Have LND invoice: {lnd_invoice_json}")
-        nostr_9734 = json.loads(event_9734_json)
-        lnd_invoice = json.loads(lnd_invoice_json)
-        nostr_event_tags = [["description", event_9734_json], ["bolt11", lnd_invoice["payment_request"]],
-                            self._get_tag(nostr_9734["tags"], "p")]
-        if self._count_tag(nostr_9734["tags"], "e") == 1:
-            nostr_event_tags.append(self._get_tag(nostr_9734["tags"], "e"))
-        if self._count_tag(nostr_9734["tags"], "a") == 1:
-            nostr_event_tags.append(self._get_tag(nostr_9734["tags"], "a"))
-        nostr_event = Event(content="", kind=9735, public_key=self._public_key.hex(), tags=nostr_event_tags,
+        self._logger.debug(f"Have 9734 Event: {zap_request.raw}")
+        self._logger.debug(f"Have LND invoice: {lnd_invoice}")
+        nostr_event_tags = [["description", zap_request.raw], ["bolt11", lnd_invoice["payment_request"]],
+                            zap_request.get_tag("p")]
+        if zap_request.count_tag("e") == 1:
+            nostr_event_tags.append(zap_request.get_tag("e"))
+        if zap_request.count_tag("a") == 1:
+            nostr_event_tags.append(zap_request.get_tag("a"))
+        from nostr.event import Event
+        nostr_event = Event(content="", kind=9735, public_key=self._public_key_hex, tags=nostr_event_tags,
                             created_at=int(lnd_invoice["settle_date"]))
-        self._private_key.sign_event(nostr_event)
-        self._logger.debug(json.dumps(nostr_event.to_message()))
-        relays = self.add_default_relays(self.get_relays_from_9734(event_9734_json))
-        self.send_event_9735(relays, nostr_event)
-
-    def send_event_9735(self, relays: list[str], event: Event):
-        self._logger.info(f"Sending 9735 event to relays now")
-        relay_manager = XRelayManager()
-        for r in relays:
-            relay_manager.add_x_relay(r, event, self._logger)
-        relay_manager.open_connections({"cert_reqs": ssl.CERT_NONE})
+        nostr_event.signature = self._signing_key.schnorr_sign(bytes.fromhex(nostr_event.id), None, raw=True).hex()
+        return nostr_event
+
+    def evict_idle_relays(self):
+        if self._relay_pool is None:
+            return
+        evicted = self._relay_pool.evict_idle()
+        self._logger.debug(f"Closed {evicted} idle relay connections")
+
+    def relay_stats(self) -> dict:
+        if self._publisher is None:
+            stats = {"queued": 0, "dropped": 0, "relays": {}}
+        else:
+            stats = self._publisher.stats()
+        stats["batches"] = self._receipts.stats()
+        return stats
+
+    def close(self):
+        self._receipts.close()
+        if self._publisher is not None:
+            self._publisher.close()
+        self._verifier.close()
 
 
 if __name__ == '__main__':
+    from unittest import TestCase
+
     testlogger = logging.getLogger("Testcases")
     testlogger.setLevel(logging.DEBUG)
     formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
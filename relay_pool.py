@@ -0,0 +1,338 @@
+import json
+import logging
+import os
+import queue
+import random
+import ssl
+import threading
+import time
+from collections import deque
+
+import websocket
+
+from metrics import REGISTRY
+
+RELAY_FAILURES = REGISTRY.counter("nip57_relay_failures_total", "Failed relay connections and sends", ("relay",))
+RECEIPT_PUBLISH_SECONDS = REGISTRY.histogram("nip57_receipt_publish_seconds",
+                                             "From the LND settlement to the relay's OK for the zap receipt",
+                                             ("relay",))
+
+
+class RelayDownError(OSError):
+    """
+    The last connect to the relay failed, it isn't tried again before its cooldown passed.
+    """
+
+
+class RelayConnection:
+    """
+    A long-lived websocket to one relay. Connecting and sending are serialized by a lock. The EVENTs of a
+    batch go out back to back, then we read until the relay acknowledged each with OK (NIP-20) or the timeout
+    passed, so a batch costs one round trip instead of one per event. The wait for the OKs doesn't hold the
+    lock, one waiting sender at a time reads and files the OKs for all of them.
+    A failed connect takes the relay out for down_cooldown secs, sends meanwhile fail at once.
+    """
+
+    def __init__(self, logger: logging.Logger, url: str, timeout: float, connect_timeout: float = None,
+                 down_cooldown: float = 0.0):
+        self.url = url
+        self._logger = logger
+        self._timeout = timeout
+        self._connect_timeout = timeout if connect_timeout is None else connect_timeout
+        self._down_cooldown = down_cooldown
+        self._down_until = 0.0
+        self._lock = threading.Lock()
+        self._recv_lock = threading.Lock()
+        self._ws: websocket.WebSocket | None = None
+        # OK of each event waiting for one, None until it arrived
+        self._acks: dict[str, bool | None] = {}
+        self.last_used = time.monotonic()
+        self.ok = 0
+        self.rejected = 0
+        self.notices = 0
+        self.failures = 0
+        self.connects = 0
+        self.sends = 0
+
+    def _connect(self):
+        try:
+            self._ws = websocket.create_connection(self.url, timeout=self._connect_timeout,
+                                                   sslopt={"cert_reqs": ssl.CERT_NONE})
+        except (websocket.WebSocketException, OSError):
+            self._down_until = time.monotonic() + self._down_cooldown
+            raise
+        self._ws.settimeout(self._timeout)
+        self.connects += 1
+        self._logger.debug("Connected to " + self.url)
+
+    def publish_many(self, events: list[tuple[str, str]]) -> dict[str, bool]:
+        """
+        :param events: (event id, EVENT message) to send
+        :return: event id -> True if the relay accepted it, False if it rejected it
+        :raise websocket.WebSocketException, OSError: on connection problems and timeouts,
+            events acknowledged before are not reported, sending them again is harmless
+        :raise RelayDownError: without trying, if a connect failed less than down_cooldown secs ago
+        :raise ValueError: if the url is no websocket url
+        """
+        event_ids = {event_id for event_id, _ in events}
+        with self._lock:
+            self.last_used = time.monotonic()
+            if self.last_used < self._down_until:
+                raise RelayDownError(f"{self.url} is down for another {self._down_until - self.last_used:.0f} secs")
+            try:
+                if self._ws is None or not self._ws.connected:
+                    self._connect()
+                ws = self._ws
+                self._logger.debug(f"Publishing {len(events)} events on {self.url}")
+                for _, message in events:
+                    ws.send(message)
+                self.sends += 1
+                for event_id in event_ids:
+                    self._acks[event_id] = None
+            except (websocket.WebSocketException, OSError, ValueError):
+                self._failed_locked(self._ws)
+                raise
+        try:
+            return self._await_ok(ws, event_ids)
+        except (websocket.WebSocketException, OSError):
+            with self._lock:
+                self._failed_locked(ws)
+            raise
+        finally:
+            with self._lock:
+                for event_id in event_ids:
+                    self._acks.pop(event_id, None)
+
+    def _failed_locked(self, ws: websocket.WebSocket | None):
+        self.failures += 1
+        RELAY_FAILURES.labels(self.url).inc()
+        # another sender may already have replaced a broken socket
+        if ws is self._ws:
+            self._close_locked()
+
+    def _await_ok(self, ws: websocket.WebSocket, event_ids: set[str]) -> dict[str, bool]:
+        deadline = time.monotonic() + self._timeout
+        while True:
+            with self._lock:
+                results = {event_id: self._acks[event_id] for event_id in event_ids
+                           if self._acks.get(event_id) is not None}
+            if len(results) == len(event_ids):
+                return results
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise websocket.WebSocketTimeoutException(
+                    f"No OK from {self.url} for {len(event_ids) - len(results)} of {len(event_ids)} events")
+            if not self._recv_lock.acquire(timeout=remaining):
+                continue
+            try:
+                with self._lock:
+                    # the sender that read before us may have filed our OKs
+                    if all(self._acks.get(event_id) is not None for event_id in event_ids):
+                        continue
+                ws.settimeout(remaining)
+                message = ws.recv()
+            finally:
+                self._recv_lock.release()
+            self._file_reply(message)
+
+    def _file_reply(self, message: str):
+        try:
+            reply = json.loads(message)
+        except ValueError:
+            return
+        if not isinstance(reply, list) or len(reply) < 2:
+            return
+        if reply[0] == "NOTICE":
+            self.notices += 1
+            self._logger.info(f"NOTICE from {self.url}: {reply[1]}")
+            return
+        if reply[0] != "OK":
+            return
+        accepted = len(reply) > 2 and reply[2] is True
+        with self._lock:
+            if reply[1] not in self._acks or self._acks[reply[1]] is not None:
+                return
+            self._acks[reply[1]] = accepted
+            if accepted:
+                self.ok += 1
+            else:
+                self.rejected += 1
+        if not accepted:
+            self._logger.warning(f"{self.url} rejected {reply[1]}: {reply[3] if len(reply) > 3 else ''}")
+
+    def close(self):
+        with self._lock:
+            self._close_locked()
+
+    def _close_locked(self):
+        if self._ws is not None:
+            try:
+                self._ws.close(timeout=1)
+            except (websocket.WebSocketException, OSError):
+                pass
+            self._ws = None
+
+    def is_idle(self, max_idle: float) -> bool:
+        return time.monotonic() - self.last_used > max_idle and not self._lock.locked() and len(self._acks) == 0
+
+    def stats(self) -> dict:
+        return {"connected": self._ws is not None and self._ws.connected,
+                "connects": self.connects,
+                "sends": self.sends,
+                "ok": self.ok,
+                "rejected": self.rejected,
+                "notices": self.notices,
+                "failures": self.failures}
+
+
+class RelayPool:
+    """
+    One RelayConnection per relay url, reused across receipts and closed after MAX_IDLE secs without use.
+    A relay whose connect failed is skipped for DOWN_COOLDOWN secs.
+    """
+    TIMEOUT = float(os.environ.get("RELAY_TIMEOUT", 10))
+    CONNECT_TIMEOUT = float(os.environ.get("RELAY_CONNECT_TIMEOUT", 3))
+    DOWN_COOLDOWN = float(os.environ.get("RELAY_DOWN_COOLDOWN", 30))
+    MAX_IDLE = float(os.environ.get("RELAY_MAX_IDLE", 300))
+
+    def __init__(self, logger: logging.Logger):
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._connections: dict[str, RelayConnection] = {}
+
+    def get(self, url: str) -> RelayConnection:
+        with self._lock:
+            connection = self._connections.get(url)
+            if connection is None:
+                connection = RelayConnection(self._logger, url, self.TIMEOUT, self.CONNECT_TIMEOUT, self.DOWN_COOLDOWN)
+                self._connections[url] = connection
+            return connection
+
+    def evict_idle(self) -> int:
+        with self._lock:
+            idle = [c for c in self._connections.values() if c.is_idle(self.MAX_IDLE)]
+            for connection in idle:
+                del self._connections[connection.url]
+        for connection in idle:
+            self._logger.debug("Closing idle relay connection " + connection.url)
+            connection.close()
+        return len(idle)
+
+    def close(self):
+        with self._lock:
+            connections = list(self._connections.values())
+        for connection in connections:
+            connection.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {url: c.stats() for url, c in self._connections.items()}
+
+
+class ReceiptPublisher:
+    """
+    Publishes zap receipts in the background: a backlog of receipt chunks per relay, at most QUEUE_SIZE in all,
+    worked off by a thread pool, so a slow relay never holds up the LND subscription thread.
+    A job sends up to SEND_BATCH receipts in one go on the relay's connection. Only one worker at a time works
+    on a relay, so the relays of a zap request listing dead ones can't take all workers from the others.
+    """
+    QUEUE_SIZE = int(os.environ.get("PUBLISH_QUEUE_SIZE", 10000))
+    SEND_BATCH = int(os.environ.get("PUBLISH_SEND_BATCH", 50))
+    WORKERS = int(os.environ.get("PUBLISH_WORKERS", 8))
+    RETRIES = int(os.environ.get("PUBLISH_RETRIES", 3))
+    RETRY_BACKOFF = float(os.environ.get("PUBLISH_RETRY_BACKOFF", 1))
+
+    def __init__(self, logger: logging.Logger, pool: RelayPool):
+        self._logger = logger
+        self._pool = pool
+        # relays with receipts to send, each in it at most once and not while a worker is on it
+        self._queue: queue.Queue = queue.Queue()
+        self._backlog: dict[str, deque[list[tuple[str, str, float]]]] = {}
+        self._queued = 0
+        self._lock = threading.Lock()
+        self._workers: list[threading.Thread] = []
+        self.dropped = 0
+
+    def _start_workers(self):
+        with self._lock:
+            if len(self._workers) > 0:
+                return
+            for n in range(self.WORKERS):
+                worker = threading.Thread(target=self._work, name=f"receipt-publisher-{n}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def publish_batch(self, by_relay: dict[str, list[tuple[str, str, float]]]):
+        """
+        :param by_relay: relay url -> (event id, EVENT message, time.monotonic() of the settlement) to send there
+        """
+        self._start_workers()
+        for url, receipts in by_relay.items():
+            for start in range(0, len(receipts), self.SEND_BATCH):
+                chunk = receipts[start:start + self.SEND_BATCH]
+                with self._lock:
+                    full = self._queued >= self.QUEUE_SIZE
+                    if not full:
+                        self._queued += 1
+                        backlog = self._backlog.get(url)
+                        if backlog is None:
+                            backlog = self._backlog[url] = deque()
+                            self._queue.put_nowait(url)
+                        backlog.append(chunk)
+                if full:
+                    self.dropped += len(chunk)
+                    self._logger.error(f"Publish queue full, dropping {len(chunk)} receipts for {url}")
+
+    def _work(self):
+        while True:
+            url = self._queue.get()
+            if url is None:
+                break
+            with self._lock:
+                chunk = self._backlog[url].popleft()
+                self._queued -= 1
+            try:
+                self._publish(url, chunk)
+            except Exception:
+                # a worker that dies here is never replaced, keep going with the next job
+                self._logger.exception(f"Publishing receipts on {url!r} failed")
+            finally:
+                with self._lock:
+                    if len(self._backlog[url]) > 0:
+                        # back in line behind the other relays
+                        self._queue.put_nowait(url)
+                    else:
+                        del self._backlog[url]
+                self._queue.task_done()
+
+    def _publish(self, url: str, receipts: list[tuple[str, str, float]]):
+        connection = self._pool.get(url)
+        settled = {event_id: settled_at for event_id, _, settled_at in receipts}
+        for attempt in range(self.RETRIES + 1):
+            try:
+                results = connection.publish_many([(event_id, message) for event_id, message, _ in receipts])
+                now = time.monotonic()
+                for event_id, accepted in results.items():
+                    if accepted:
+                        RECEIPT_PUBLISH_SECONDS.labels(url).observe(now - settled[event_id])
+                return
+            except (ValueError, RelayDownError) as e:
+                self._logger.warning(f"Not publishing {len(receipts)} receipts on {url}: {e}")
+                return
+            except (websocket.WebSocketException, OSError) as e:
+                self._logger.warning(f"Publishing {len(receipts)} receipts on {url} failed "
+                                     f"(attempt {attempt + 1}): {e}")
+            if attempt < self.RETRIES:
+                time.sleep(self.RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1))
+        self._logger.error(f"Giving up publishing {len(receipts)} receipts on {url}")
+
+    def join(self):
+        self._queue.join()
+
+    def close(self):
+        for _ in self._workers:
+            self._queue.put_nowait(None)
+        self._pool.close()
+
+    def stats(self) -> dict:
+        return {"queued": self._queued, "dropped": self.dropped, "relays": self._pool.stats()}
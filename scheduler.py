@@ -0,0 +1,125 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Callable
+
+
+class ScheduledJob:
+    __slots__ = ("name", "interval", "func", "runs", "failures", "last_duration", "cancelled")
+
+    def __init__(self, name: str, interval: float, func: Callable[[], None]):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.runs = 0
+        self.failures = 0
+        self.last_duration = 0.0
+        self.cancelled = False
+
+
+class Scheduler:
+    """
+    Runs all periodic housekeeping on one thread: a heap of (due time, seq, job), the thread
+    sleeps until the earliest job is due or stop() wakes it up.
+    Jobs should be short, a slow job delays the ones due after it.
+    """
+
+    def __init__(self, logger: logging.Logger, name: str = "scheduler"):
+        """
+        :param name: of the thread, a job that must not wait behind slow ones gets a Scheduler of its own
+        """
+        self._logger = logger
+        self._name = name
+        self._heap: list[tuple[float, int, ScheduledJob]] = []
+        self._jobs: dict[str, ScheduledJob] = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread: threading.Thread | None = None
+
+    def every(self, name: str, interval: float, func: Callable[[], None], delay: float = None) -> ScheduledJob | None:
+        """
+        Run func every interval secs, the first time after delay secs (default: one interval).
+        An interval <= 0 disables the job.
+        """
+        if interval <= 0:
+            self._logger.info(f"Scheduled job {name} is disabled")
+            return None
+        job = ScheduledJob(name, float(interval), func)
+        with self._cond:
+            old = self._jobs.get(name)
+            if old is not None:
+                old.cancelled = True
+            self._jobs[name] = job
+            self._push_locked(time.monotonic() + (interval if delay is None else delay), job)
+            self._cond.notify()
+        return job
+
+    def cancel(self, name: str):
+        with self._cond:
+            job = self._jobs.pop(name, None)
+            if job is not None:
+                job.cancelled = True
+
+    def _push_locked(self, due: float, job: ScheduledJob):
+        heapq.heappush(self._heap, (due, next(self._seq), job))
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if self._heap and self._heap[0][2].cancelled:
+                        heapq.heappop(self._heap)
+                        continue
+                    now = time.monotonic()
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    self._cond.wait(self._heap[0][0] - now if self._heap else None)
+                if self._stopped:
+                    return
+                due, _, job = heapq.heappop(self._heap)
+            self._execute(job)
+            with self._cond:
+                if not job.cancelled:
+                    # keep the cadence, but skip runs that were missed while a job was slow
+                    now = time.monotonic()
+                    due += job.interval
+                    if due <= now:
+                        due = now + job.interval
+                    self._push_locked(due, job)
+
+    def _execute(self, job: ScheduledJob):
+        start = time.perf_counter()
+        try:
+            job.func()
+        except Exception as e:
+            job.failures += 1
+            self._logger.exception(f"Scheduled job {job.name} failed: {e}")
+        job.runs += 1
+        job.last_duration = time.perf_counter() - start
+
+    def stop(self, timeout: float = 5.0):
+        """
+        Stop after the running job, if any, returned. Pending jobs are dropped.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def stats(self) -> dict:
+        with self._cond:
+            jobs = list(self._jobs.values())
+        return {job.name: {"interval": job.interval, "runs": job.runs, "failures": job.failures,
+                           "last_duration": round(job.last_duration, 4)} for job in jobs}
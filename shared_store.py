@@ -0,0 +1,172 @@
+import os
+import queue
+import socket
+import threading
+import urllib.parse
+
+# prepended to every key, so several deployments can share one store
+KEY_PREFIX = os.environ.get("SHARED_STORE_PREFIX", "nip57:")
+
+
+class StoreError(Exception):
+    """
+    The shared store is unreachable or rejected a command.
+    """
+
+
+class _Connection:
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.reader = sock.makefile("rb")
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RespClient:
+    """
+    Minimal thread-safe client for the Redis protocol (RESP2), enough for the shared pending invoices,
+    zap request dedup and leader lease: a real Redis/Valkey/KeyDB, or the stand-in of store_server.py.
+    url is redis://[:password@]host:port/db or unix:///path/to/socket. Connections are pooled, a
+    pipeline() sends several commands in one round trip. Replies come back decoded (str, int, list, None),
+    error replies and connection problems raise StoreError.
+    """
+    POOL_SIZE = int(os.environ.get("SHARED_STORE_POOL_SIZE", 8))
+    TIMEOUT = float(os.environ.get("SHARED_STORE_TIMEOUT", 2))
+
+    def __init__(self, url: str):
+        parsed = urllib.parse.urlparse(url)
+        # without the password, it goes into log lines, errors and /lnurlp/state
+        self.url = url
+        if "@" in parsed.netloc:
+            self.url = parsed._replace(netloc=parsed.netloc.rpartition("@")[2]).geturl()
+        if parsed.scheme == "unix":
+            self._address = parsed.path
+            self._family = socket.AF_UNIX
+        elif parsed.scheme == "redis":
+            self._address = (parsed.hostname or "127.0.0.1", parsed.port or 6379)
+            self._family = socket.AF_INET
+        else:
+            raise ValueError(f"Shared store url must start with redis:// or unix://, got {self.url}")
+        self._password = urllib.parse.unquote(parsed.password) if parsed.password else None
+        self._db = int(parsed.path.strip("/") or 0) if parsed.scheme == "redis" else 0
+        self._idle: queue.LifoQueue[_Connection] = queue.LifoQueue(maxsize=self.POOL_SIZE)
+        self._lock = threading.Lock()
+        self.errors = 0
+
+    def _connect(self) -> _Connection:
+        sock = socket.socket(self._family, socket.SOCK_STREAM)
+        sock.settimeout(self.TIMEOUT)
+        try:
+            sock.connect(self._address)
+            if self._family == socket.AF_INET:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = _Connection(sock)
+            setup = []
+            if self._password is not None:
+                setup.append(("AUTH", self._password))
+            if self._db != 0:
+                setup.append(("SELECT", self._db))
+            for reply in self._roundtrip(connection, setup) if len(setup) > 0 else ():
+                if isinstance(reply, StoreError):
+                    connection.close()
+                    raise StoreError(f"Shared store {self.url} refused the connection: {reply}")
+            return connection
+        except OSError as e:
+            sock.close()
+            raise StoreError(f"Cannot connect to shared store {self.url}: {e}")
+
+    def _checkout(self) -> _Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _checkin(self, connection: _Connection):
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def execute(self, *args):
+        return self.pipeline([args])[0]
+
+    def pipeline(self, commands: list[tuple]) -> list:
+        """
+        :return: the replies in command order
+        :raise StoreError: if the store is unreachable or any command failed
+        """
+        connection = self._checkout()
+        try:
+            replies = self._roundtrip(connection, commands)
+        except (OSError, StoreError) as e:
+            # the connection may be half way through a reply, never reuse it
+            connection.close()
+            with self._lock:
+                self.errors += 1
+            if isinstance(e, StoreError):
+                raise
+            raise StoreError(f"Shared store {self.url} failed: {e}")
+        self._checkin(connection)
+        for reply in replies:
+            if isinstance(reply, StoreError):
+                raise reply
+        return replies
+
+    def _roundtrip(self, connection: _Connection, commands: list[tuple]) -> list:
+        connection.sock.sendall(b"".join(_encode(command) for command in commands))
+        return [self._read_reply(connection.reader) for _ in commands]
+
+    def _read_reply(self, reader):
+        line = reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise StoreError(f"Shared store {self.url} closed the connection")
+        kind, value = line[:1], line[1:-2]
+        if kind == b"+":
+            return value.decode()
+        if kind == b"-":
+            # returned, not raised, so the rest of a pipeline is still read off the connection
+            return StoreError(value.decode())
+        if kind == b":":
+            return int(value)
+        if kind == b"$":
+            n = int(value)
+            if n < 0:
+                return None
+            data = reader.read(n + 2)
+            if len(data) < n + 2:
+                raise StoreError(f"Shared store {self.url} closed the connection")
+            return data[:-2].decode()
+        if kind == b"*":
+            n = int(value)
+            if n < 0:
+                return None
+            return [self._read_reply(reader) for _ in range(n)]
+        raise StoreError(f"Unexpected reply from shared store {self.url}: {line[:32]!r}")
+
+    def ping(self) -> bool:
+        try:
+            return self.execute("PING") == "PONG"
+        except StoreError:
+            return False
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def _encode(command: tuple) -> bytes:
+    parts = [b"*%d\r\n" % len(command)]
+    for arg in command:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
@@ -0,0 +1,313 @@
+"""
+Local stand-in for a Redis server, stdlib only: the commands nip57_server uses for its shared state,
+in memory, over a Unix socket or TCP. nip57_server starts one on a Unix socket by itself when it runs
+several WORKERS on one host. For several hosts, point SHARED_STORE at a Redis, or run this on one of
+them, on a trusted network only, it has no auth:
+python store_server.py --host 10.0.0.5 --port 6390
+"""
+import argparse
+import logging
+import os
+import socketserver
+import sys
+import threading
+import time
+
+
+class CommandError(Exception):
+    pass
+
+
+class StoreServer:
+    """
+    Strings, hashes and sorted sets with key expiry, behind one lock. Enough of RESP2 to serve
+    RespClient: commands come as arrays of bulk strings, pipelined or not.
+    """
+    SWEEP_INTERVAL = 1.0
+
+    def __init__(self, logger: logging.Logger):
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._data: dict[str, object] = {}
+        # key -> time.monotonic() it expires at
+        self._expires: dict[str, float] = {}
+        self._server: socketserver.BaseServer | None = None
+        self._stop = threading.Event()
+        self.commands = 0
+
+    def _alive(self, key: str, now: float) -> bool:
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at <= now:
+            del self._expires[key]
+            self._data.pop(key, None)
+        return key in self._data
+
+    def _typed(self, key: str, kind: type, now: float, create: bool = False):
+        if not self._alive(key, now):
+            if not create:
+                return None
+            self._data[key] = kind()
+        value = self._data[key]
+        if type(value) is not kind:
+            raise CommandError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def _drop_if_empty(self, key: str):
+        if not self._data.get(key):
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+
+    def sweep(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, expires_at in self._expires.items() if expires_at <= now]
+            for key in expired:
+                del self._expires[key]
+                self._data.pop(key, None)
+        return len(expired)
+
+    def execute(self, args: list[str]):
+        """
+        :return: the reply: str, int, None, list, or a CommandError for an error reply
+        """
+        if len(args) == 0:
+            return CommandError("ERR empty command")
+        name = args[0].upper()
+        handler = getattr(self, "_cmd_" + name.lower(), None)
+        if handler is None:
+            return CommandError(f"ERR unknown command '{args[0]}'")
+        try:
+            with self._lock:
+                self.commands += 1
+                return handler(time.monotonic(), *args[1:])
+        except CommandError as e:
+            return e
+        except (TypeError, ValueError):
+            return CommandError(f"ERR wrong arguments for '{args[0]}' command")
+
+    def _cmd_ping(self, now, *args):
+        return args[0] if args else Simple("PONG")
+
+    def _cmd_auth(self, now, *args):
+        return Simple("OK")
+
+    def _cmd_select(self, now, db):
+        if int(db) != 0:
+            raise CommandError("ERR only db 0 is served")
+        return Simple("OK")
+
+    def _cmd_dbsize(self, now):
+        return sum(1 for key in list(self._data) if self._alive(key, now))
+
+    def _cmd_flushall(self, now, *args):
+        self._data.clear()
+        self._expires.clear()
+        return Simple("OK")
+
+    def _cmd_get(self, now, key):
+        return self._typed(key, str, now)
+
+    def _cmd_set(self, now, key, value, *options):
+        ttl, nx, xx, i = None, False, False, 0
+        while i < len(options):
+            option = options[i].upper()
+            if option in ("EX", "PX"):
+                ttl = float(options[i + 1]) / (1 if option == "EX" else 1000)
+                i += 1
+            elif option == "NX":
+                nx = True
+            elif option == "XX":
+                xx = True
+            else:
+                raise CommandError("ERR syntax error")
+            i += 1
+        exists = self._alive(key, now)
+        if (nx and exists) or (xx and not exists):
+            return None
+        self._data[key] = value
+        if ttl is not None:
+            self._expires[key] = now + ttl
+        else:
+            self._expires.pop(key, None)
+        return Simple("OK")
+
+    def _cmd_del(self, now, *keys):
+        deleted = 0
+        for key in keys:
+            if self._alive(key, now):
+                del self._data[key]
+                self._expires.pop(key, None)
+                deleted += 1
+        return deleted
+
+    def _cmd_pexpire(self, now, key, ms):
+        if not self._alive(key, now):
+            return 0
+        self._expires[key] = now + int(ms) / 1000
+        return 1
+
+    def _cmd_pttl(self, now, key):
+        if not self._alive(key, now):
+            return -2
+        expires_at = self._expires.get(key)
+        return -1 if expires_at is None else int((expires_at - now) * 1000)
+
+    def _cmd_hset(self, now, key, *pairs):
+        if len(pairs) == 0 or len(pairs) % 2 != 0:
+            raise ValueError()
+        table = self._typed(key, dict, now, create=True)
+        added = 0
+        for field, value in zip(pairs[::2], pairs[1::2]):
+            added += field not in table
+            table[field] = value
+        return added
+
+    def _cmd_hget(self, now, key, field):
+        table = self._typed(key, dict, now)
+        return None if table is None else table.get(field)
+
+    def _cmd_hdel(self, now, key, *fields):
+        table = self._typed(key, dict, now)
+        if table is None:
+            return 0
+        deleted = sum(1 for field in fields if table.pop(field, None) is not None)
+        self._drop_if_empty(key)
+        return deleted
+
+    def _cmd_hlen(self, now, key):
+        table = self._typed(key, dict, now)
+        return 0 if table is None else len(table)
+
+    def _cmd_zadd(self, now, key, *pairs):
+        if len(pairs) == 0 or len(pairs) % 2 != 0:
+            raise ValueError()
+        scores = self._typed(key, _Scores, now, create=True)
+        added = 0
+        for score, member in zip(pairs[::2], pairs[1::2]):
+            added += member not in scores
+            scores[member] = float(score)
+        return added
+
+    def _cmd_zrem(self, now, key, *members):
+        scores = self._typed(key, _Scores, now)
+        if scores is None:
+            return 0
+        removed = sum(1 for member in members if scores.pop(member, None) is not None)
+        self._drop_if_empty(key)
+        return removed
+
+    def _cmd_zrangebyscore(self, now, key, low, high, *options):
+        scores = self._typed(key, _Scores, now)
+        if scores is None:
+            return []
+        low, high = float(low), float(high)
+        members = sorted((score, member) for member, score in scores.items() if low <= score <= high)
+        if len(options) == 3 and options[0].upper() == "LIMIT":
+            offset, count = int(options[1]), int(options[2])
+            members = members[offset:] if count < 0 else members[offset:offset + count]
+        return [member for _, member in members]
+
+    def handler(self):
+        store = self
+
+        class Handler(socketserver.StreamRequestHandler):
+
+            def handle(self):
+                while True:
+                    try:
+                        args = self._read_command()
+                    except (OSError, ValueError):
+                        return
+                    if args is None:
+                        return
+                    try:
+                        self.wfile.write(_encode_reply(store.execute(args)))
+                    except OSError:
+                        return
+
+            def _read_command(self) -> list[str] | None:
+                line = self.rfile.readline()
+                if not line:
+                    return None
+                if not line.startswith(b"*"):
+                    # inline command, as typed into telnet
+                    return line.decode().split()
+                args = []
+                for _ in range(int(line[1:])):
+                    header = self.rfile.readline()
+                    if not header.startswith(b"$"):
+                        raise ValueError("bulk string expected")
+                    n = int(header[1:])
+                    args.append(self.rfile.read(n + 2)[:-2].decode())
+                return args
+
+        return Handler
+
+    def start(self, unix_path: str = None, host: str = "127.0.0.1", port: int = 6390):
+        if unix_path is not None:
+            if os.path.exists(unix_path):
+                os.unlink(unix_path)
+            self._server = socketserver.ThreadingUnixStreamServer(unix_path, self.handler())
+            self._logger.info(f"Shared store stand-in on unix://{unix_path}")
+        else:
+            socketserver.ThreadingTCPServer.allow_reuse_address = True
+            self._server = socketserver.ThreadingTCPServer((host, port), self.handler())
+            self._logger.info(f"Shared store stand-in on redis://{host}:{port}")
+        self._server.daemon_threads = True
+        threading.Thread(target=self._sweep_loop, name="store-sweep", daemon=True).start()
+
+    def _sweep_loop(self):
+        while not self._stop.wait(self.SWEEP_INTERVAL):
+            self.sweep()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._stop.set()
+        server, self._server = self._server, None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+
+class Simple(str):
+    """
+    A status reply (+OK) rather than a bulk string.
+    """
+
+
+class _Scores(dict):
+    """
+    Sorted set: member -> score, ordered on read.
+    """
+
+
+def _encode_reply(reply) -> bytes:
+    if isinstance(reply, CommandError):
+        return f"-{reply}\r\n".encode()
+    if isinstance(reply, Simple):
+        return f"+{reply}\r\n".encode()
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, str):
+        data = reply.encode()
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+    return b"*%d\r\n" % len(reply) + b"".join(_encode_reply(item) for item in reply)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--unix", help="serve on this Unix socket path instead of TCP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout, format="[%(asctime)s - %(levelname)s] %(message)s")
+    store_server = StoreServer(logging.getLogger("storeServer"))
+    store_server.start(args.unix, args.host, args.port)
+    try:
+        store_server.serve_forever()
+    except KeyboardInterrupt:
+        store_server.stop()
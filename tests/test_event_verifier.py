@@ -0,0 +1,39 @@
+import json
+import logging
+import os
+import signal
+import sys
+import time
+
+from nostr.event import Event
+from nostr.key import PrivateKey
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_verifier import EventVerifier  # noqa: E402
+
+
+def signed_event() -> dict:
+    sender = PrivateKey()
+    event = Event(public_key=sender.public_key.hex(), content="", kind=9734, created_at=int(time.time()),
+                  tags=[["p", sender.public_key.hex()], ["amount", "21000"]])
+    sender.sign_event(event)
+    return json.loads(event.to_message())[1]
+
+
+def test_verification_recovers_after_a_worker_dies():
+    verifier = EventVerifier(logging.getLogger("test"), workers=1)
+    try:
+        event = signed_event()
+        assert verifier.verify(event)
+        for pid in list(verifier._pool._processes):
+            os.kill(pid, signal.SIGKILL)
+        # the batch in flight when the worker died may fail, later ones go to a new pool
+        deadline = time.monotonic() + 20
+        while not verifier.verify(event):
+            assert time.monotonic() < deadline, "verification did not recover"
+            time.sleep(0.1)
+        forged = dict(event, content="forged")
+        assert not verifier.verify(forged)
+    finally:
+        verifier.close()
@@ -0,0 +1,144 @@
+import json
+import logging
+import os
+import re
+import threading
+from typing import Callable
+
+HEX_PUBKEY = re.compile(r"^[0-9a-f]{64}$")
+
+
+class UserConfig:
+    """
+    One users.json entry. An entry is either just the hex pubkey or an object like
+    {"pubkey": "...", "min_sendable": 1000, "max_sendable": 100000000, "comment_allowed": 120,
+     "lnd": {"restaddr": "https://...", "macaroon": "...", "tls_verify": "./tls2.cert", "socks5h_proxy": "..."}}
+    "lnd" can also be the name of a node from LND_BACKENDS, or a list of names and node objects
+    for a pool of nodes. It is kept as a list either way.
+    """
+    __slots__ = ("name", "pubkey", "min_sendable", "max_sendable", "comment_allowed", "lnd")
+
+    def __init__(self, name: str, pubkey: str, min_sendable: int, max_sendable: int, comment_allowed: int,
+                 lnd: list[str | dict] | None = None):
+        self.name = name
+        self.pubkey = pubkey
+        self.min_sendable = min_sendable
+        self.max_sendable = max_sendable
+        self.comment_allowed = comment_allowed
+        self.lnd = lnd
+
+
+class UserSnapshot:
+    """
+    An immutable view of users.json, replaced as a whole on reload.
+    """
+    __slots__ = ("users", "mtime")
+
+    def __init__(self, users: dict[str, UserConfig], mtime: float):
+        self.users = users
+        self.mtime = mtime
+
+
+class UserRegistry:
+    """
+    In-memory index of users.json. check_for_changes() (run by the scheduler every RELOAD_INTERVAL secs)
+    polls the file's mtime and swaps in a new snapshot, readers just dereference the current snapshot
+    without any locking.
+    """
+    RELOAD_INTERVAL = float(os.environ.get("USERS_RELOAD_INTERVAL", 5))
+
+    def __init__(self, logger: logging.Logger, path: str, min_sendable: int, max_sendable: int,
+                 comment_allowed: int = 255):
+        self._logger = logger
+        self._path = path
+        self.min_sendable = int(min_sendable)
+        self.max_sendable = int(max_sendable)
+        self.comment_allowed = comment_allowed
+        self.snapshot = UserSnapshot({}, 0.0)
+        self._listeners: list[Callable[[UserSnapshot], None]] = []
+        self._reload_lock = threading.Lock()
+        self._failed_mtime = None
+
+    def add_listener(self, listener: Callable[[UserSnapshot], None]):
+        """
+        :param listener: called with every new snapshot
+        """
+        self._listeners.append(listener)
+
+    def get(self, name: str) -> UserConfig | None:
+        return self.snapshot.users.get(name)
+
+    def defaults(self, name: str) -> UserConfig:
+        return UserConfig(name, "", self.min_sendable, self.max_sendable, self.comment_allowed)
+
+    def _parse(self, name: str, entry) -> UserConfig | None:
+        if isinstance(entry, str):
+            entry = {"pubkey": entry}
+        if not isinstance(entry, dict):
+            self._logger.warning(f"Ignoring users.json entry {name}: not a pubkey or object")
+            return None
+        pubkey = entry.get("pubkey", "")
+        if not isinstance(pubkey, str) or HEX_PUBKEY.match(pubkey) is None:
+            self._logger.warning(f"Ignoring users.json entry {name}: pubkey is not 64 hex chars")
+            return None
+        lnd = entry.get("lnd")
+        if lnd is not None:
+            lnd = lnd if isinstance(lnd, list) else [lnd]
+            if len(lnd) == 0 or not all(self._valid_node(node) for node in lnd):
+                self._logger.warning(f"Ignoring users.json entry {name}: lnd needs node names or objects "
+                                     f"with restaddr and macaroon")
+                return None
+        try:
+            min_sendable = int(entry.get("min_sendable", self.min_sendable))
+            max_sendable = int(entry.get("max_sendable", self.max_sendable))
+            comment_allowed = int(entry.get("comment_allowed", self.comment_allowed))
+        except (TypeError, ValueError):
+            self._logger.warning(f"Ignoring users.json entry {name}: sendable and comment limits must be numbers")
+            return None
+        return UserConfig(name, pubkey, min_sendable, max_sendable, comment_allowed, lnd)
+
+    @staticmethod
+    def _valid_node(node) -> bool:
+        if isinstance(node, str):
+            return node != ""
+        return isinstance(node, dict) and "restaddr" in node and "macaroon" in node
+
+    def load(self):
+        """
+        Read users.json and swap in the new snapshot.
+        :raise OSError, ValueError: if the file can't be read, the current snapshot stays
+        """
+        with self._reload_lock:
+            mtime = os.stat(self._path).st_mtime
+            with open(self._path) as users_file:
+                entries = json.load(users_file)
+            if not isinstance(entries, dict):
+                raise ValueError("users.json must be an object of name: pubkey")
+            users = {}
+            for name, entry in entries.items():
+                user = self._parse(name, entry)
+                if user is not None:
+                    users[name] = user
+            snapshot = UserSnapshot(users, mtime)
+            self.snapshot = snapshot
+        self._logger.info(f"Loaded {len(users)} users from {self._path}")
+        for listener in self._listeners:
+            listener(snapshot)
+
+    def reload(self) -> bool:
+        try:
+            self.load()
+            return True
+        except (OSError, ValueError) as e:
+            self._logger.error(f"Reloading {self._path} failed, keeping the old list: {e}")
+            return False
+
+    def check_for_changes(self):
+        try:
+            mtime = os.stat(self._path).st_mtime
+        except OSError:
+            return
+        if mtime != self.snapshot.mtime and mtime != self._failed_mtime:
+            if not self.reload():
+                # don't retry (and log) until the file changes again
+                self._failed_mtime = mtime
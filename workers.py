@@ -0,0 +1,129 @@
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+from shared_store import RespClient
+
+
+class WorkerSupervisor:
+    """
+    Runs the server as several worker processes on one listening socket, the kernel spreads the
+    connections over them. With a store_socket it also runs the stand-in shared store of store_server.py
+    in a process of its own. The parent process only forks, forwards SIGTERM/SIGHUP and replaces crashed
+    workers; it never starts a thread, so forking again later is as safe as the first time.
+    """
+    RESTART_DELAY = 1.0
+    # a worker dying sooner than this after its start most likely has a config problem, restarting won't help
+    MIN_UPTIME = 10.0
+    STORE_START_TIMEOUT = 10.0
+
+    def __init__(self, logger: logging.Logger, count: int, sock: socket.socket, store_socket: str | None):
+        """
+        :param sock: the listening socket all workers accept on
+        :param store_socket: Unix socket path to run the stand-in store on, None if there is a store already
+        """
+        self._logger = logger
+        self._count = count
+        self._sock = sock
+        self._store_socket = store_socket
+        # pid -> time.monotonic() it started
+        self._workers: dict[int, float] = {}
+        self._store_pid: int | None = None
+        self._stopping = False
+
+    def run(self) -> socket.socket:
+        """
+        Fork the workers. Returns in each worker, with the listening socket to serve on. The parent stays
+        in here until all workers exited after a SIGTERM and then exits.
+        """
+        if self._store_socket is not None:
+            self._start_store()
+        for _ in range(self._count):
+            if self._fork_worker() == 0:
+                return self._sock
+        signal.signal(signal.SIGTERM, self._forward)
+        signal.signal(signal.SIGINT, self._forward)
+        signal.signal(signal.SIGHUP, self._forward)
+        self._logger.info(f"Started {self._count} workers on {self._sock.getsockname()}")
+        while len(self._workers) > 0:
+            pid, status = os.wait()
+            if pid == self._store_pid:
+                self._store_pid = None
+                if not self._stopping:
+                    self._logger.error(f"Shared store stand-in exited with {status}, restarting it empty")
+                    self._start_store()
+                continue
+            started = self._workers.pop(pid, None)
+            if self._stopping or started is None:
+                continue
+            if time.monotonic() - started < self.MIN_UPTIME:
+                self._logger.error(f"Worker {pid} exited with {status} right after its start, not restarting it")
+                continue
+            self._logger.error(f"Worker {pid} exited with {status}, starting a new one")
+            time.sleep(self.RESTART_DELAY)
+            if self._fork_worker() == 0:
+                return self._sock
+        self._stop_store()
+        self._logger.info("All workers stopped")
+        sys.exit(0 if self._stopping else 1)
+
+    def _fork_worker(self) -> int:
+        pid = os.fork()
+        if pid == 0:
+            self._become_child()
+            return 0
+        self._workers[pid] = time.monotonic()
+        return pid
+
+    def _become_child(self):
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_DFL)
+        self._workers = {}
+        self._store_pid = None
+
+    def _start_store(self):
+        pid = os.fork()
+        if pid == 0:
+            # never return from here, the caller is the worker code path
+            try:
+                self._become_child()
+                self._sock.close()
+                # imported here, the workers never need it
+                from store_server import StoreServer
+                store = StoreServer(self._logger)
+                store.start(self._store_socket)
+                store.serve_forever()
+            except BaseException:
+                self._logger.exception("Shared store stand-in failed")
+                os._exit(1)
+            os._exit(0)
+        self._store_pid = pid
+        client = RespClient("unix://" + self._store_socket)
+        deadline = time.monotonic() + self.STORE_START_TIMEOUT
+        while not client.ping():
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Shared store stand-in did not come up on {self._store_socket}")
+            time.sleep(0.05)
+        client.close()
+
+    def _stop_store(self):
+        if self._store_pid is not None:
+            os.kill(self._store_pid, signal.SIGTERM)
+            os.waitpid(self._store_pid, 0)
+            self._store_pid = None
+        if self._store_socket is not None and os.path.exists(self._store_socket):
+            os.unlink(self._store_socket)
+
+    def _forward(self, signum, frame):
+        if signum in (signal.SIGTERM, signal.SIGINT):
+            self._logger.info(f"Got signal {signum}, stopping {len(self._workers)} workers")
+            self._stopping = True
+            signum = signal.SIGTERM
+        for pid in list(self._workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
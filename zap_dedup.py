@@ -0,0 +1,187 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import REGISTRY
+from shared_store import KEY_PREFIX, RespClient, StoreError
+
+DEDUP_HITS = REGISTRY.counter("nip57_dedup_hits_total", "Repeated zap requests answered from memory", ("kind",))
+
+
+class _TtlMap:
+    """
+    Entries that all live for the same ttl, so insertion order is expiry order and expiring
+    only ever looks at the oldest entries. Above max_size the oldest entry goes early. Not thread-safe.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        # key -> (expires_at, value)
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key, now: float):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= now:
+            return None
+        return entry[1]
+
+    def put(self, key, value, now: float):
+        self._entries.pop(key, None)
+        self._entries[key] = (now + self.ttl, value)
+        self.expire(now)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def expire(self, now: float) -> int:
+        expired = 0
+        while self._entries:
+            key, (expires_at, _) = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            del self._entries[key]
+            expired += 1
+        return expired
+
+    def pop(self, key):
+        self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ZapRequestDedup:
+    """
+    Wallets retry the invoice callback with the same signed 9734. The first request for an
+    (event id, amount) asks LND, later ones get the same payment request from memory for as long as the
+    pending invoice lives, and a retry that comes while the first one still waits for LND waits for its answer
+    instead of asking LND again. A retry is only served from memory if its 9734 is byte for byte the one
+    that was verified, anything else goes the full way.
+    It also remembers settled invoices, so a settlement LND streams again after a reconnect is not
+    receipted twice.
+    With a shared store the issued invoices are also kept there, so a retry that the load balancer sends
+    to another worker is answered from there. Waiting for a request in flight stays within one process.
+    """
+    TTL = int(os.environ.get("DEDUP_TTL", os.environ.get("INVOICE_CACHE_TTL", 120)))
+    SETTLED_TTL = int(os.environ.get("DEDUP_SETTLED_TTL", 86400))
+    MAX_SIZE = int(os.environ.get("DEDUP_MAX_SIZE", 100000))
+    # secs a retry waits for the same request in flight before asking LND itself
+    WAIT = float(os.environ.get("DEDUP_WAIT", 10))
+
+    def __init__(self, logger: logging.Logger, store: RespClient = None):
+        self._logger = logger
+        self._store = store
+        self._lock = threading.Lock()
+        # (event id, amount) -> (raw 9734, response)
+        self._issued = _TtlMap(self.TTL, self.MAX_SIZE)
+        # (event id, amount) -> set when the request in flight got its answer
+        self._in_flight: dict[tuple, threading.Event] = {}
+        # backend key of settled invoices
+        self._settled = _TtlMap(self.SETTLED_TTL, self.MAX_SIZE)
+        self.hits = 0
+        self.waits = 0
+        self.replays = 0
+
+    def claim(self, event_id: str, amount: int, raw: str) -> dict | None:
+        """
+        :return: the response issued for this zap request before, or None if the caller has to ask LND
+            and report the outcome with issued(). Waits up to WAIT secs if the same request is in flight.
+        """
+        key = (event_id, amount)
+        with self._lock:
+            response = self._lookup(key, raw)
+        if response is None and self._store is not None:
+            response = self._shared_lookup(key, raw)
+        if response is not None:
+            return response
+        with self._lock:
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                self._in_flight[key] = threading.Event()
+                return None
+            self.waits += 1
+        in_flight.wait(self.WAIT)
+        with self._lock:
+            if self._in_flight.get(key) is in_flight and not in_flight.is_set():
+                # the first request never reported back, don't let it hold up later ones
+                del self._in_flight[key]
+            # None if the first request failed: this one tries on its own
+            return self._lookup(key, raw)
+
+    def _lookup(self, key: tuple, raw: str) -> dict | None:
+        entry = self._issued.get(key, time.time())
+        if entry is None or entry[0] != raw:
+            return None
+        self.hits += 1
+        DEDUP_HITS.labels("invoice").inc()
+        return entry[1]
+
+    def _shared_lookup(self, key: tuple, raw: str) -> dict | None:
+        try:
+            stored = self._store.execute("GET", self._shared_key(key))
+        except StoreError as e:
+            self._logger.debug(f"Shared dedup lookup failed: {e}")
+            return None
+        if stored is None:
+            return None
+        entry = json.loads(stored)
+        with self._lock:
+            self._issued.put(key, (entry["raw"], entry["response"]), time.time())
+            return self._lookup(key, raw)
+
+    @staticmethod
+    def _shared_key(key: tuple) -> str:
+        return f"{KEY_PREFIX}dedup:{key[0]}:{key[1]}"
+
+    def issued(self, event_id: str, amount: int, raw: str, response: dict | None):
+        """
+        :param response: the response for the zap request, None if there is none
+        """
+        key = (event_id, amount)
+        with self._lock:
+            if response is not None:
+                self._issued.put(key, (raw, response), time.time())
+            in_flight = self._in_flight.pop(key, None)
+        if in_flight is not None:
+            in_flight.set()
+        if response is not None and self._store is not None:
+            try:
+                self._store.execute("SET", self._shared_key(key), json.dumps({"raw": raw, "response": response}),
+                                    "PX", int(self.TTL * 1000))
+            except StoreError as e:
+                self._logger.debug(f"Sharing an issued invoice failed: {e}")
+
+    def first_settlement(self, key: str) -> bool:
+        """
+        :param key: backend key of the settled invoice
+        :return: True the first time, False for a settlement seen before
+        """
+        now = time.time()
+        with self._lock:
+            if self._settled.get(key, now) is not None:
+                self.replays += 1
+                DEDUP_HITS.labels("settlement").inc()
+                return False
+            self._settled.put(key, True, now)
+            return True
+
+    def forget_settlement(self, key: str):
+        """
+        Undo first_settlement() for a settlement that could not be handled, so a replay gets another chance.
+        """
+        with self._lock:
+            self._settled.pop(key)
+
+    def expire(self):
+        now = time.time()
+        with self._lock:
+            expired = self._issued.expire(now) + self._settled.expire(now)
+        self._logger.debug(f"Dropped {expired} expired dedup entries")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"issued": len(self._issued), "in_flight": len(self._in_flight), "settled": len(self._settled),
+                    "hits": self.hits, "waits": self.waits, "replays": self.replays}
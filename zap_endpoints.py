@@ -0,0 +1,198 @@
+import logging
+
+import requests
+
+from admission import CLIENT_IP_HEADER, AdmissionControl
+from lnd_backend import LndBackend
+from lnd_helper import LndHelper
+from lnurlp_cache import CachedResponse, LnurlpResponseCache
+from metrics import REGISTRY
+from nostr_helper import NostrHelper
+from user_registry import UserRegistry
+from zap_dedup import ZapRequestDedup
+from zap_request import ZapRequest
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def client_ip(headers, peer: str | None) -> str | None:
+    """
+    :param headers: the request headers
+    :param peer: address of the connection's other end
+    """
+    if CLIENT_IP_HEADER != "":
+        forwarded = headers.get(CLIENT_IP_HEADER)
+        if forwarded:
+            # the last entry is the one our reverse proxy added, earlier ones come from the client
+            return forwarded.split(",")[-1].strip()
+    return peer
+
+
+class ZapEndpoints:
+    """
+    The request handling shared by the Flask/waitress server and the async server.
+    Handlers return what Flask accepts: a dict, or a (dict, status) tuple.
+    """
+
+    def __init__(self, logger: logging.Logger, user_registry: UserRegistry, lnurlp_cache: LnurlpResponseCache,
+                 nostr_helper: NostrHelper, lnd_helper: LndHelper, admission: AdmissionControl,
+                 dedup: ZapRequestDedup):
+        self._logger = logger
+        self._admission = admission
+        self._dedup = dedup
+        self._user_registry = user_registry
+        self._lnurlp_cache = lnurlp_cache
+        self._nostr_helper = nostr_helper
+        self._lnd_helper = lnd_helper
+
+    def lnurlp(self, username: str) -> tuple[CachedResponse, dict]:
+        """
+        :return: the cached response and its ETag/Cache-Control headers
+        """
+        self._logger.debug("got lnurlp request for: " + username)
+        cached = self._lnurlp_cache.get(username)
+        headers = {"ETag": f'"{cached.etag}"', "Cache-Control": self._lnurlp_cache.cache_control}
+        return cached, headers
+
+    def nostr_json(self, name: str | None):
+        user = self._user_registry.get(name) if name is not None else None
+        if user is None:
+            return {"names": {}}
+        return {"names": {user.name: user.pubkey}}
+
+    def state(self):
+        lnd_state = self._lnd_helper.lnd_state()
+        body = lnd_state[0] if isinstance(lnd_state, tuple) else lnd_state
+        body["relays"] = self._nostr_helper.relay_stats()
+        body["admission"] = self._admission.stats()
+        body["dedup"] = self._dedup.stats()
+        return lnd_state
+
+    def metrics(self):
+        """
+        :return: (Prometheus text, 200), or an error and 404 if METRICS_ENABLED is off
+        """
+        if not REGISTRY.enabled:
+            return {"status": "ERROR", "reason": "Metrics disabled"}, 404
+        return REGISTRY.render(), 200
+
+    def set_clearnet(self, secret: str | None, ipv4: str | None, port: int | None, tls_verify: str | None):
+        self._logger.debug("got set_clearnet request")
+        if secret is None:
+            return {"status": "ERROR", "reason": "No secret given"}, 403
+        if ipv4 is None:
+            return {"status": "ERROR", "reason": "No valid IP given"}, 400
+        if port is None:
+            port = self._lnd_helper.DYNIP_PORT
+        if tls_verify is None:
+            tls_verify = self._lnd_helper.TLS_VERIFY
+        elif tls_verify.lower() == "false":
+            requests.packages.urllib3.disable_warnings()
+            tls_verify = False
+
+        return self._lnd_helper.set_clearnet(ipv4=ipv4, secret=secret, port=port, tls_verify=tls_verify)
+
+    def check_invoice_request(self, username: str, amount: int | None, nostr: str | None, comment: str | None,
+                              client_ip: str | None = None):
+        """
+        Everything the invoice endpoint does before asking LND. On success it holds an LND slot,
+        the caller must give it back with release_lnd() once LND answered and then call complete_invoice().
+        :return: (response to send as is, None, None) for errors and repeated zap requests,
+            else (None, zap request, LND backends to ask)
+        """
+        response = self._admission.admit(client_ip, username)
+        if response is not None:
+            return response, None, None
+        if amount is None:
+            return ({"status": "ERROR", "reason": "No valid amount given"}, 400), None, None
+
+        self._logger.info(f"got invoice request for {username} amount {str(amount)} msats")
+
+        user = self._user_registry.get(username)
+        limits = user if user is not None else self._user_registry.defaults(username)
+        if amount < limits.min_sendable or amount > limits.max_sendable:
+            return ({"status": "ERROR", "reason": "Amount out of range"}, 400), None, None
+        if comment is not None and len(comment) > limits.comment_allowed:
+            return ({"status": "ERROR", "reason": "Comment too long"}, 400), None, None
+        pool = self._lnd_helper.pool_for(user)
+        if pool is None:
+            self._logger.error(f"No known LND node for {username}, refusing the invoice")
+            return ({"status": "ERROR", "reason": "No LND node for this user"}, 503), None, None
+
+        if nostr is None:
+            return ({"status": "ERROR", "reason": "No valid nostr given"}, 400), None, None
+        zap_request = self._nostr_helper.decode_9734_event(nostr)
+        if zap_request is None or not isinstance(zap_request.id, str):
+            return ({"status": "ERROR", "reason": "nostr event is not a valid kind 9734"}, 400), None, None
+
+        # a wallet retrying gets the invoice it got before, without a signature check or LND call
+        response = self._dedup.claim(zap_request.id, amount, zap_request.raw)
+        if response is not None:
+            self._logger.info(f"answered repeated zap request {zap_request.id} from memory")
+            return response, None, None
+        response = self._check_zap_request(zap_request, amount)
+        if response is not None:
+            self._dedup.issued(zap_request.id, amount, zap_request.raw, None)
+            return response, None, None
+
+        return None, zap_request, pool
+
+    def _check_zap_request(self, zap_request: ZapRequest, amount: int):
+        """
+        :return: None with an LND slot taken, or the error response
+        """
+        # fail fast while LND is saturated, before the signature check
+        error = self._admission.acquire_lnd()
+        if error is not None:
+            return error
+        if not self._nostr_helper.verify_9734_event(zap_request, amount):
+            self._admission.release_lnd()
+            return {"status": "ERROR", "reason": "nostr event is not a valid kind 9734"}, 400
+        error = self._admission.admit_pubkey(zap_request.pubkey)
+        if error is not None:
+            self._admission.release_lnd()
+            return error
+        return None
+
+    def release_lnd(self):
+        self._admission.release_lnd()
+
+    def complete_invoice(self, bech32_invoice, zap_request: ZapRequest, amount: int, backend: LndBackend | None):
+        """
+        :param bech32_invoice: LND's answer to the invoice request, "" if there is none
+        :param backend: the backend that issued the invoice
+        """
+        if bech32_invoice == "":
+            self._dedup.issued(zap_request.id, amount, zap_request.raw, None)
+            return {"status": "ERROR", "reason": "LND did not provide an invoice"}, 500
+
+        if not self._lnd_helper.cache_payment(bech32_invoice["add_index"], zap_request, backend):
+            self._dedup.issued(zap_request.id, amount, zap_request.raw, None)
+            return {"status": "ERROR", "reason": "Could not keep the invoice for its zap receipt"}, 503
+
+        response = {"status": "OK", "pr": bech32_invoice["payment_request"], "routes": []}
+        self._dedup.issued(zap_request.id, amount, zap_request.raw, response)
+        return response
+
+    def abandon_invoice(self, zap_request: ZapRequest, amount: int):
+        """
+        For a request that failed before complete_invoice() answered it: wallet retries waiting for it
+        go ahead at once instead of after DEDUP_WAIT secs.
+        """
+        self._dedup.issued(zap_request.id, amount, zap_request.raw, None)
+
+    def invoice(self, username: str, amount: int | None, nostr: str | None, comment: str | None,
+                client_ip: str | None = None):
+        response, zap_request, pool = self.check_invoice_request(username, amount, nostr, comment, client_ip)
+        if response is not None:
+            return response
+        try:
+            try:
+                bech32_invoice, backend = self._lnd_helper.fetch_invoice(amount, zap_request.raw, pool)
+            finally:
+                self.release_lnd()
+            response = self.complete_invoice(bech32_invoice, zap_request, amount, backend)
+        finally:
+            if response is None:
+                self.abandon_invoice(zap_request, amount)
+        return response
@@ -0,0 +1,55 @@
+import json
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+
+class ZapRequest:
+    """
+    A kind 9734 event decoded once: the raw json (it is hashed into the invoice and quoted in the 9735),
+    the decoded dict and an index of its tags by name.
+    """
+    __slots__ = ("raw", "event", "id", "pubkey", "kind", "_tags")
+
+    def __init__(self, raw: str, event: dict):
+        self.raw = raw
+        self.event = event
+        self.id = event.get("id")
+        self.pubkey = event.get("pubkey")
+        self.kind = event.get("kind")
+        self._tags: dict[str, list[list[str]]] = {}
+        tags = event.get("tags")
+        if isinstance(tags, list):
+            for tag in tags:
+                if isinstance(tag, list) and len(tag) > 0:
+                    self._tags.setdefault(tag[0], []).append(tag)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "ZapRequest":
+        """
+        :raise ValueError: if raw is no json object
+        """
+        event = _loads(raw)
+        if not isinstance(event, dict):
+            raise ValueError("9734 event is no json object")
+        return cls(raw, event)
+
+    def count_tag(self, name: str) -> int:
+        return len(self._tags.get(name, ()))
+
+    def get_tag(self, name: str) -> list[str]:
+        tags = self._tags.get(name)
+        return tags[0] if tags else []
+
+    def relays(self) -> list[str]:
+        """
+        :return: the websocket urls of the relays tag, anything else in it is left out
+        """
+        if self.count_tag("relays") != 1:
+            return []
+        return [url for url in self.get_tag("relays")[1:]
+                if isinstance(url, str) and url.startswith(("ws://", "wss://"))]